@@ -0,0 +1,332 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Enrichment throughput of each connector, using the tests data
+#
+# Copyright (C) 2018 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+""" The raw items of tests/data/<connector>.json are replicated up to
+the number of items requested and these stages are timed:
+
+- identities: get_identities of each item
+- rich: rich items (and the other documents generated for each item)
+- events: rich events, for the connectors supporting them
+- bulk: encoding of the rich documents in bulk bodies (docs/s)
+
+Nothing is sent to the network. SortingHat is replaced by an in memory
+snapshot with all the identities of the items, so rich items include
+the SortingHat fields (only if SortingHat is installed), and
+Elasticsearch by an object which fails if it is used. Each connector is run in its own process, to get its max RSS.
+
+Allocations are measured with tracemalloc in a second run of each stage,
+so they don't slow down the timed run.
+
+    python3 benchmarks/enrich.py --items 1000 --output baseline.json
+    python3 benchmarks/enrich.py --items 1000 --compare baseline.json
+"""
+
+import argparse
+import datetime
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+DATA_DIR = os.path.join(ROOT_DIR, 'tests', 'data')
+
+sys.path.insert(0, ROOT_DIR)
+
+import requests
+
+from grimoire_elk.elk.bulk import BulkBody
+from grimoire_elk.elk.enrich import Enrich, SORTINGHAT_LIBS
+from grimoire_elk.elk.geolocation import GeolocationCache, LocalGeocoder
+from grimoire_elk.utils import get_connectors
+
+if SORTINGHAT_LIBS:
+    from sortinghat import utils as sh_utils
+    from grimoire_elk.elk.sortinghat import SortingHatSnapshot
+else:
+    SortingHatSnapshot = object
+
+
+STAGES = ['identities', 'rich', 'events', 'bulk']
+
+ORG_NAME = "Bitergia"
+ORG_START = datetime.datetime(1900, 1, 1)
+ORG_END = datetime.datetime(2100, 1, 1)
+
+
+class OfflineError(Exception):
+    message = "Network access while running a benchmark"
+
+
+def offline_send(session, request, **kwargs):
+    raise OfflineError(request.url)
+
+
+class OfflineElastic():
+    """Elasticsearch of the enrichers, any request to it fails"""
+
+    url = "http://offline"
+    index_url = url + "/benchmark"
+    major = '6'
+
+    max_items_bulk = None
+    max_bytes_bulk = None
+    max_seconds_bulk = None
+
+    def __init__(self):
+        self.requests = requests.Session()
+
+
+class MemorySnapshot(SortingHatSnapshot):
+    """SortingHat snapshot with all the identities of some items, each
+    one with its own unique identity, profile and enrollment"""
+
+    def __init__(self, enricher, items):
+        super().__init__(object())
+        self.checked = time.time()
+
+        backend_name = enricher.get_connector_name()
+        for item in items:
+            for identity in enricher.get_sh_identities(item):
+                try:
+                    sh_id = sh_utils.uuid(backend_name, email=identity.get('email'),
+                                          name=identity.get('name'), username=identity.get('username'))
+                except ValueError:
+                    continue
+                self.uuids[sh_id] = sh_id
+                self.profiles[sh_id] = (identity.get('name'), identity.get('email'), False)
+                self.enrollments[sh_id] = self.get_periods([(ORG_START, ORG_END, ORG_NAME)])
+
+    def load(self):
+        pass
+
+    def update(self):
+        return False
+
+
+def get_params():
+    parser = argparse.ArgumentParser(description="Enrichment throughput of each connector")
+    parser.add_argument('--items', type=int, default=1000, help="Raw items of each connector (default 1000)")
+    parser.add_argument('--runs', type=int, default=3, help="Runs of each stage, the best is used (default 3)")
+    parser.add_argument('--connectors', nargs='*', help="Connectors to run (default all with tests data)")
+    parser.add_argument('--output', help="File to write the results, to be used as baseline")
+    parser.add_argument('--compare', help="Baseline file to compare the results with")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="Throughput loss reported as regression (default 0.2)")
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def load_items(name, ocean, nitems):
+    """ nitems raw items, like they are read from the raw index """
+
+    with open(os.path.join(DATA_DIR, name + ".json")) as f:
+        fixture = json.load(f)
+
+    items = []
+    while len(items) < nitems:
+        for item in json.loads(json.dumps(fixture)):
+            if len(items) == nitems:
+                break
+            if 'updated_on' not in item:
+                # twitter items come from logstash and use id
+                item['uuid'] = "%s_%i" % (item['id'], len(items))
+                items.append(item)
+                continue
+            item['uuid'] = "%s_%i" % (item['uuid'], len(items))
+            ocean.add_update_date(item)
+            ocean._fix_item(item)
+            items.append(item)
+
+    return items
+
+
+def run_stage(func, items_json, runs):
+    """ Best seconds of some runs of func(items), docs got and peak of
+    memory allocated """
+
+    times = []
+    for _ in range(runs):
+        items = json.loads(items_json)
+        start = time.perf_counter()
+        ndocs = func(items)
+        times.append(time.perf_counter() - start)
+    seconds = min(times)
+
+    items = json.loads(items_json)
+    tracemalloc.start()
+    func(items)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "seconds": seconds,
+        "items_s": len(items) / seconds if seconds else 0,
+        "docs": ndocs,
+        "alloc_peak_kb": peak / 1024
+    }
+
+
+def bench_connector(name, nitems, runs):
+    """ Results for the stages of a connector """
+
+    requests.Session.send = offline_send
+
+    connector = get_connectors()[name]
+    ocean = connector[1](None)
+    enricher = connector[2]()
+    enricher.elastic = OfflineElastic()
+    if hasattr(enricher, 'geolocations'):
+        enricher.geolocations = GeolocationCache(enricher.elastic, LocalGeocoder())
+
+    items = load_items(name, ocean, nitems)
+
+    if SORTINGHAT_LIBS:
+        Enrich.use_sh_snapshot = True
+        Enrich.sh_snapshot = MemorySnapshot(enricher, items)
+        Enrich.sh_snapshot_check = float('inf')
+        enricher.sh_db = Enrich.sh_snapshot.db
+        enricher.sortinghat = True
+
+    items_json = json.dumps(items)
+    docs_json = json.dumps(list(enricher.get_rich_docs(json.loads(items_json))))
+
+    def identities(items):
+        return sum(len(list(enricher.get_identities(item))) for item in items)
+
+    def rich(items):
+        return sum(1 for _ in enricher.get_rich_docs(items))
+
+    def events(items):
+        return sum(1 for _ in enricher.get_rich_docs(items, events=True))
+
+    def bulk(docs):
+        body = BulkBody()
+        for doc_id, doc in docs:
+            body.add(doc, doc_id)
+        body.getvalue()
+        return len(body)
+
+    results = {
+        "identities": run_stage(identities, items_json, runs),
+        "rich": run_stage(rich, items_json, runs),
+        "bulk": run_stage(bulk, docs_json, runs)
+    }
+    if type(enricher).get_rich_events is not Enrich.get_rich_events:
+        results["events"] = run_stage(events, items_json, runs)
+
+    results["sortinghat"] = SORTINGHAT_LIBS
+    # ru_maxrss is in KB in Linux
+    results["max_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    return results
+
+
+def run_worker(name, nitems, runs):
+    """ Results of a connector got in a new process """
+
+    cmd = [sys.executable, os.path.abspath(__file__), '--worker', name,
+           '--items', str(nitems), '--runs', str(runs)]
+    res = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if res.returncode != 0:
+        error = res.stderr.decode('utf-8', 'replace').strip().splitlines()
+        return {"error": error[-1] if error else "exit code %i" % res.returncode}
+
+    return json.loads(res.stdout.decode('utf-8'))
+
+
+def print_results(results, baseline, threshold):
+    """ Print the results, comparing them with baseline if any
+
+    :returns: number of regressions found
+    """
+    regressions = 0
+
+    header = ("connector", "stage", "items/s", "docs", "alloc peak KB", "vs base")
+    print("%-15s %-11s %12s %10s %14s %10s" % header)
+    for name, result in sorted(results.items()):
+        if 'error' in result:
+            print("%-15s failed: %s" % (name, result['error']))
+            continue
+
+        base = baseline.get(name, {})
+        for stage in STAGES:
+            if stage not in result:
+                continue
+            stats = result[stage]
+            compared = ""
+            if stage in base and base[stage]['items_s']:
+                ratio = stats['items_s'] / base[stage]['items_s']
+                compared = "%.2fx" % ratio
+                if ratio < 1 - threshold:
+                    compared += " SLOWER"
+                    regressions += 1
+            row = (name, stage, stats['items_s'], stats['docs'], stats['alloc_peak_kb'], compared)
+            print("%-15s %-11s %12.0f %10i %14.0f %10s" % row)
+        print("%-15s %-11s %12.1f" % (name, "max RSS MB", result['max_rss_mb']))
+
+    return regressions
+
+
+def main():
+    args = get_params()
+
+    if args.worker:
+        print(json.dumps(bench_connector(args.worker, args.items, args.runs)))
+        return
+
+    names = args.connectors
+    if not names:
+        names = [name for name in get_connectors()
+                 if os.path.exists(os.path.join(DATA_DIR, name + ".json"))]
+
+    results = {}
+    for name in sorted(names):
+        results[name] = run_worker(name, args.items, args.runs)
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['connectors']
+
+    regressions = print_results(results, baseline, args.threshold)
+
+    if args.output:
+        report = {
+            "items": args.items,
+            "runs": args.runs,
+            "python": sys.version.split()[0],
+            "date": datetime.datetime.utcnow().isoformat(),
+            "connectors": results
+        }
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4, sort_keys=True)
+
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
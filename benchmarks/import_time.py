@@ -0,0 +1,99 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Time needed to start GrimoireELK: import it and load the connectors
+#
+# Copyright (C) 2018 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+""" Each case is run in a new Python process, so nothing is already
+imported. Loading all the connectors is what importing grimoire_elk.utils
+cost before the connectors were loaded on first use.
+
+    python3 benchmarks/import_time.py [--runs N] [--connector git]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Code of each case, it prints the seconds spent
+TIMER = """
+import sys
+import time
+sys.path.insert(0, %r)
+start = time.time()
+%s
+print(time.time() - start)
+"""
+
+LOAD_ALL = """
+from grimoire_elk.utils import get_connectors
+for name in get_connectors():
+    try:
+        get_connectors()[name]
+    except ImportError:
+        # Data sources not supported by the installed Perceval
+        pass
+"""
+
+
+def get_params():
+    parser = argparse.ArgumentParser(description="Time needed to start GrimoireELK")
+    parser.add_argument('--runs', type=int, default=5, help="Runs of each case (default 5)")
+    parser.add_argument('--connector', default='git', help="Connector loaded (default git)")
+    return parser.parse_args()
+
+
+def run_case(code, runs):
+    """ Median of the seconds spent running code in new processes """
+
+    times = []
+    for _ in range(runs):
+        out = subprocess.check_output([sys.executable, '-c', TIMER % (ROOT_DIR, code)])
+        times.append(float(out.decode('utf-8').split()[-1]))
+
+    return statistics.median(times)
+
+
+def main():
+    args = get_params()
+
+    cases = [
+        ("import grimoire_elk.utils", "import grimoire_elk.utils"),
+        ("import grimoire_elk.arthur", "import grimoire_elk.arthur"),
+        ("load %s connector" % args.connector,
+         "from grimoire_elk.utils import get_connectors\nget_connectors()[%r]" % args.connector),
+        ("load all connectors", LOAD_ALL)
+    ]
+
+    for name, code in cases:
+        try:
+            seconds = run_case(code, args.runs)
+        except subprocess.CalledProcessError:
+            print("%-30s failed" % name)
+            continue
+        print("%-30s %8.3f sec" % (name, seconds))
+
+
+if __name__ == '__main__':
+    main()
@@ -23,28 +23,32 @@
 #   Alvaro del Castillo San Felix <acs@bitergia.com>
 #
 
+import hashlib
 import inspect
+import json
 import logging
 import pickle
 import traceback
 
 import redis
 
+from collections import deque
 from datetime import datetime
 from dateutil import parser
+from time import time
 
 from arthur.common import Q_STORAGE_ITEMS
 
 from .ocean.conf import ConfOcean
 from .utils import get_elastic
 from .utils import get_connectors, get_connector_from_name
-from .elk.utils import get_last_enrich, grimoire_con
+from .elk.metrics import metrics
+from .elk.study_state import scroll_docs
+from .elk.utils import get_last_enrich
 
 
 logger = logging.getLogger(__name__)
 
-requests_ses = grimoire_con()
-
 arthur_items = {}  # Hash with tag list with all items collected from arthur queue
 
 
@@ -106,6 +110,7 @@ def feed_backend(url, clean, fetch_cache, backend_name, backend_params,
     repo = {}    # repository data to be stored in conf
     repo['backend_name'] = backend_name
     repo['backend_params'] = backend_params
+    task_labels = {"connector": backend_name, "task": "feed"}  # labels of the metrics
 
     if es_index:
         clean = False  # don't remove index, it could be shared
@@ -122,6 +127,8 @@ def feed_backend(url, clean, fetch_cache, backend_name, backend_params,
         ocean_backend = connector[1](backend, fetch_cache=fetch_cache, project=project)
 
         logger.info("Feeding Ocean from %s (%s)", backend_name, backend.origin)
+        task_labels['origin'] = backend.origin
+        metrics.set_labels(**task_labels)
 
         if not es_index:
             es_index = backend_name + "_" + backend.origin
@@ -217,6 +224,8 @@ def feed_backend(url, clean, fetch_cache, backend_name, backend_params,
     if es_index:
         unique_id = es_index + "_" + backend.origin
         ConfOcean.add_repo(unique_id, repo)
+        if ConfOcean.store_metrics:
+            ConfOcean.add_metrics(unique_id, metrics.get_report(**task_labels))
     else:
         logger.debug("Repository not added to Ocean because errors.")
         logger.debug(backend_params)
@@ -224,73 +233,60 @@ def feed_backend(url, clean, fetch_cache, backend_name, backend_params,
     logger.info("Done %s " % (backend_name))
 
 
-def get_items_from_uuid(uuid, enrich_backend, ocean_backend):
-    """ Get all items that include uuid """
-
-    # logger.debug("Getting items for merged uuid %s "  % (uuid))
+def get_items_from_uuids(uuids, enrich_backend, ocean_backend):
+    """ Get all items that include any of the uuids """
 
     uuid_fields = enrich_backend.get_fields_uuid()
-
-    terms = ""  # all terms with uuids in the enriched item
-
-    for field in uuid_fields:
-        terms += """
-         {"term": {
-           "%s": {
-              "value": "%s"
-           }
-         }}
-         """ % (field, uuid)
-        terms += ","
-
-    terms = terms[:-1]  # remove last , for last item
-
-    query = """
-    {"query": { "bool": { "should": [%s] }}}
-    """ % (terms)
-
-    url_search = enrich_backend.elastic.index_url + "/_search"
-    url_search += "?size=1000"  # TODO get all items
-
-    r = requests_ses.post(url_search, data=query)
-
-    eitems = r.json()['hits']['hits']
-
-    if len(eitems) == 0:
-        # logger.warning("No enriched items found for uuid: %s " % (uuid))
-        return []
+    max_ids = enrich_backend.elastic.max_items_clause
+    uuids = list(uuids)
 
     items_ids = []
-
-    for eitem in eitems:
-        item_id = enrich_backend.get_item_id(eitem)
-        # For one item several eitems could be generated
-        if item_id not in items_ids:
-            items_ids.append(item_id)
+    seen = set()  # For one item several eitems could be generated
+
+    for i in range(0, len(uuids), max_ids):
+        chunk = uuids[i:i + max_ids]
+        query = {
+            "query": {
+                "bool": {
+                    "should": [{"terms": {field: chunk}} for field in uuid_fields],
+                    "minimum_should_match": 1
+                }
+            }
+        }
+
+        for eitem in scroll_docs(enrich_backend.elastic, query):
+            item_id = enrich_backend.get_item_id(eitem)
+            if item_id not in seen:
+                seen.add(item_id)
+                items_ids.append(item_id)
+
+    if not items_ids:
+        # logger.warning("No enriched items found for uuids: %s " % (uuids))
+        return []
 
     # Time to get the items
     logger.debug("Items to be renriched for merged uuids: %s" % (",".join(items_ids)))
 
     url_mget = ocean_backend.elastic.index_url + "/_mget"
+    headers = {"Content-Type": "application/json"}
 
-    items_ids_query = ""
+    items = []
+    for i in range(0, len(items_ids), max_ids):
+        query = {"docs": [{"_id": item_id} for item_id in items_ids[i:i + max_ids]]}
+        r = ocean_backend.elastic.requests.post(url_mget, data=json.dumps(query), headers=headers)
+        r.raise_for_status()
 
-    for item_id in items_ids:
-        items_ids_query += '{"_id" : "%s"}' % (item_id)
-        items_ids_query += ","
-    items_ids_query = items_ids_query[:-1]  # remove last , for last item
+        for res_item in r.json()['docs']:
+            if res_item['found']:
+                items.append(res_item["_source"])
 
-    query = '{"docs" : [%s]}' % (items_ids_query)
-    r = requests_ses.post(url_mget, data=query)
+    return items
 
-    res_items = r.json()['docs']
 
-    items = []
-    for res_item in res_items:
-        if res_item['found']:
-            items.append(res_item["_source"])
+def get_items_from_uuid(uuid, enrich_backend, ocean_backend):
+    """ Get all items that include uuid """
 
-    return items
+    return get_items_from_uuids([uuid], enrich_backend, ocean_backend)
 
 
 def refresh_projects(enrich_backend):
@@ -307,6 +303,180 @@ def refresh_projects(enrich_backend):
     logger.info("Total eitems refreshed for project field %i", total)
 
 
+def refresh_projects_fields(enrich_backend):
+    """Refresh projects in enriched index generating only the project fields
+    of each item, so they can be written with partial updates.
+
+    :returns: generator of (item unique id, project fields) tuples
+    """
+
+    logger.debug("Refreshing project field (partial updates) in %s", enrich_backend.elastic.index_url)
+    total = 0
+
+    field_id = enrich_backend.get_field_unique_id()
+
+    for eitem in enrich_backend.fetch():
+        yield eitem[field_id], enrich_backend.get_item_project(eitem)
+        total += 1
+
+    logger.info("Total eitems refreshed for project field %i", total)
+
+
+def use_projects_groups(enrich_backend):
+    """ Check if the projects can be refreshed per group of items. Items
+    without some of the fields are only grouped by composite aggregations
+    with missing_bucket, available since ES 6.4. """
+
+    elastic = enrich_backend.elastic
+    if elastic.major in ['2', '5'] or (elastic.major == '6' and int(elastic.minor) < 4):
+        return False
+
+    return enrich_backend.get_project_repository_fields() is not None
+
+
+def get_group_filters(key):
+    """ Filters for the items of a group, matching the items without the
+    fields with a None value """
+
+    filters = []
+    for field, value in key.items():
+        if value is None:
+            filters.append({"bool": {"must_not": {"exists": {"field": field}}}})
+        else:
+            filters.append({"term": {field: value}})
+
+    return filters
+
+
+def get_stale_query(key, project):
+    """ Query for the items of a group with some of the project fields
+    different from project """
+
+    return {
+        "bool": {
+            "filter": get_group_filters(key),
+            "must_not": {
+                "bool": {
+                    "filter": [{"term": {field: value}} for field, value in project.items()]
+                }
+            }
+        }
+    }
+
+
+def refresh_projects_groups(enrich_backend):
+    """Refresh projects in enriched index per group of items with the same
+    project repository fields (origin, product...).
+
+    The groups are read with a composite aggregation. The project is found
+    once per group, and the items of each page of groups with some project
+    field different are counted with a filters aggregation. Only those
+    items are updated, with an update by query per group. The cost depends
+    on the number of repositories instead of on the number of items.
+
+    :returns: number of groups updated
+    """
+
+    elastic = enrich_backend.elastic
+    fields = enrich_backend.get_project_repository_fields()
+
+    logger.debug("Refreshing project field by %s in %s", ",".join(fields), elastic.index_url)
+
+    headers = {"Content-Type": "application/json"}
+    composite = {
+        "size": elastic.max_items_clause,
+        # Items without some of the fields are grouped with a null value
+        "sources": [{field: {"terms": {"field": field, "missing_bucket": True}}} for field in fields]
+    }
+    query = {
+        "size": 0,
+        "aggs": {
+            "groups": {
+                "composite": composite
+            }
+        }
+    }
+
+    # Set the project fields of the items in the group
+    script = "for (def field : params.project.entrySet()) { ctx._source[field.getKey()] = field.getValue(); }"
+
+    ngroups = 0
+    nupdated = 0
+    while True:
+        r = elastic.requests.post(elastic.index_url + "/_search", data=json.dumps(query), headers=headers)
+        r.raise_for_status()
+        groups = r.json()['aggregations']['groups']
+        if not groups['buckets']:
+            break
+
+        stale_queries = []
+        for group in groups['buckets']:
+            ngroups += 1
+            # The fields missing in the items are missing for the project too
+            key = {field: value for field, value in group['key'].items() if value is not None}
+            project = enrich_backend.get_item_project(key)
+            stale_queries.append((group['key'], project, get_stale_query(group['key'], project)))
+
+        # Count the items of each group with some project field different
+        stale = {
+            "size": 0,
+            "aggs": {
+                "stale": {
+                    "filters": {
+                        "filters": {str(i): stale_query for i, (_, _, stale_query) in enumerate(stale_queries)}
+                    }
+                }
+            }
+        }
+        r = elastic.requests.post(elastic.index_url + "/_search", data=json.dumps(stale), headers=headers)
+        r.raise_for_status()
+        counts = r.json()['aggregations']['stale']['buckets']
+
+        for i, (key, project, stale_query) in enumerate(stale_queries):
+            if not counts[str(i)]['doc_count']:
+                continue
+
+            update = {
+                "query": stale_query,
+                "script": {
+                    "source": script,
+                    "lang": "painless",
+                    "params": {"project": project}
+                }
+            }
+            r = elastic.requests.post(elastic.index_url + "/_update_by_query?conflicts=proceed",
+                                      data=json.dumps(update), headers=headers)
+            r.raise_for_status()
+            nupdated += 1
+            logger.debug("Project %s for %i items with %s", project['project'],
+                         r.json()['updated'], key)
+
+        # after_key is only returned since ES 6.3
+        composite['after'] = groups.get('after_key', groups['buckets'][-1]['key'])
+
+    logger.info("Groups of items refreshed for project field %i/%i", nupdated, ngroups)
+
+    return nupdated
+
+
+def get_filters_author(filter_author, max_ids):
+    """ Split filter_author in filters with at most max_ids identities """
+
+    if filter_author is None:
+        # No filter, all the items
+        yield None
+        return
+
+    nidentities = len(filter_author['value'])
+    logger.debug('Identities to refresh: %i', nidentities)
+    if nidentities > max_ids:
+        logger.warning('Refreshing identities in groups of %i', max_ids)
+
+    for i in range(0, nidentities, max_ids):
+        yield {"name": filter_author['name'],
+               "value": filter_author['value'][i:i + max_ids]}
+
+
 def refresh_identities(enrich_backend, filter_author=None):
     """Refresh identities in enriched index.
 
@@ -321,49 +491,134 @@ def refresh_identities(enrich_backend, filter_author=None):
     :param  filter_author: filter to use to match items
     """
 
-    def update_items(new_filter_author):
+    logger.debug("Refreshing identities fields from %s", enrich_backend.elastic.index_url)
+
+    total = 0
 
+    roles = getattr(enrich_backend, 'roles', None)
+    max_ids = enrich_backend.elastic.max_items_clause
+
+    for new_filter_author in get_filters_author(filter_author, max_ids):
         for eitem in enrich_backend.fetch(new_filter_author):
-            # logger.info(eitem)
-            roles = None
-            try:
-                roles = enrich_backend.roles
-            except AttributeError:
-                pass
             new_identities = enrich_backend.get_item_sh_from_id(eitem, roles)
             eitem.update(new_identities)
             yield eitem
+            total += 1
 
-    logger.debug("Refreshing identities fields from %s", enrich_backend.elastic.index_url)
+    logger.info("Total eitems refreshed for identities fields %i", total)
+
+
+def refresh_identities_fields(enrich_backend, filter_author=None):
+    """Refresh identities in enriched index reading and writing only the
+    identities fields.
+
+    Only the SortingHat ids of each role, the date and the unique id of
+    the items are read from the enriched index. The SortingHat fields
+    computed for them are generated so they can be written with partial
+    updates, without sending the whole items back.
+
+    :param enrich_backend: enriched backend to update
+    :param  filter_author: filter to use to match items
+    :returns: generator of (item unique id, identities fields) tuples
+    """
+
+    logger.debug("Refreshing identities fields (partial updates) from %s",
+                 enrich_backend.elastic.index_url)
 
     total = 0
 
+    roles = getattr(enrich_backend, 'roles', None)
     max_ids = enrich_backend.elastic.max_items_clause
+    field_id = enrich_backend.get_field_unique_id()
 
-    if filter_author is None:
-        # No filter, update all items
-        for item in update_items(None):
-            yield item
-            total += 1
-    else:
-        nidentities = len(filter_author['value'])
-        logger.debug('Identities to refresh: %i', nidentities)
-        if nidentities > max_ids:
-            logger.warning('Refreshing identities in groups of %i', max_ids)
-            while filter_author['value']:
-                new_filter_author = {"name": filter_author['name'],
-                                     "value": filter_author['value'][0:max_ids]}
-                filter_author['value'] = filter_author['value'][max_ids:]
-                for item in update_items(new_filter_author):
-                    yield item
-                    total += 1
-        else:
-            for item in update_items(filter_author):
-                yield item
+    author_field = enrich_backend.get_field_author()
+    fields = [rol + "_id" for rol in (roles or [author_field])]
+    fields += [enrich_backend.get_field_date(), field_id]
+
+    fetch_source = enrich_backend.fetch_source
+    enrich_backend.fetch_source = fields
+    try:
+        for new_filter_author in get_filters_author(filter_author, max_ids):
+            for eitem in enrich_backend.fetch(new_filter_author):
+                new_identities = enrich_backend.get_item_sh_from_id(eitem, roles)
+                if not new_identities:
+                    continue
+                yield eitem[field_id], new_identities
                 total += 1
+    finally:
+        enrich_backend.fetch_source = fetch_source
+
     logger.info("Total eitems refreshed for identities fields %i", total)
 
 
+def get_sh_checkpoint_id(enrich_backend):
+    """ Id of the checkpoint for the identities refreshed in an enriched index """
+
+    key = " ".join(["sortinghat", enrich_backend.elastic.index])
+
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def load_sh_checkpoint(enrich_backend):
+    """ Date of the last identities refresh, None if not known """
+
+    checkpoint = ConfOcean.get_checkpoint(get_sh_checkpoint_id(enrich_backend))
+    if not checkpoint:
+        return None
+
+    return parser.parse(checkpoint['sortinghat_after'])
+
+
+def save_sh_checkpoint(enrich_backend, after):
+    """ Store the date from which identities must be refreshed next time """
+
+    checkpoint = {
+        "enrich_index": enrich_backend.elastic.index,
+        "sortinghat_after": after.isoformat(),
+        "metadata__updated_on": datetime.utcnow().isoformat()
+    }
+    ConfOcean.set_checkpoint(get_sh_checkpoint_id(enrich_backend), checkpoint)
+
+
+def refresh_identities_changes(enrich_backend, after=None):
+    """Refresh in enriched index the identities changed in SortingHat.
+
+    Only the items with the ids of identities modified in SortingHat on or
+    after the after date are refreshed. Identities merged, moved, with a new
+    profile or with new enrollments are modified for SortingHat. Without
+    after date, all the items are refreshed.
+
+    :param enrich_backend: enriched backend to update
+    :param after: refresh the identities modified since this date
+    :returns: generator of (item unique id, identities fields) tuples
+    """
+
+    if after is None:
+        logger.info("No previous identities refresh for %s, refreshing all of them",
+                    enrich_backend.elastic.index_url)
+        for item in refresh_identities_fields(enrich_backend):
+            yield item
+        return
+
+    from .elk.sortinghat import SortingHat
+
+    sh_ids = sorted(SortingHat.get_modified_ids(enrich_backend.sh_db, after))
+    logger.info("Identities modified in SortingHat since %s: %i", after, len(sh_ids))
+    if not sh_ids:
+        return
+
+    roles = getattr(enrich_backend, 'roles', None) or [enrich_backend.get_field_author()]
+    refreshed = set()  # items with several roles changed are refreshed once
+
+    for rol in roles:
+        filter_author = {"name": rol + "_id", "value": sh_ids}
+        for item_id, new_identities in refresh_identities_fields(enrich_backend, filter_author):
+            if item_id in refreshed:
+                continue
+            refreshed.add(item_id)
+            yield item_id, new_identities
+
+
 def load_identities(ocean_backend, enrich_backend):
     try:
         from .elk.sortinghat import SortingHat
@@ -373,6 +628,8 @@ def load_identities(ocean_backend, enrich_backend):
     # First we add all new identities to SH
     items_count = 0
     new_identities = []
+    seen = set()  # identities already in new_identities
+    init = time()
 
     # Support that ocean_backend is a list of items (old API)
     if isinstance(ocean_backend, list):
@@ -385,7 +642,9 @@ def load_identities(ocean_backend, enrich_backend):
         # Get identities from new items to be added to SortingHat
         identities = enrich_backend.get_identities(item)
         for identity in identities:
-            if identity not in new_identities:
+            identity_key = tuple(sorted(identity.items()))
+            if identity_key not in seen:
+                seen.add(identity_key)
                 new_identities.append(identity)
         if items_count % 100 == 0:
             logger.debug("Processed %i items identities (%i identities) from %s",
@@ -393,10 +652,17 @@ def load_identities(ocean_backend, enrich_backend):
                          enrich_backend.get_connector_name())
     logger.debug("TOTAL ITEMS: %i", items_count)
 
-    logger.info("Total new identities to be checked %i", len(new_identities))
+    enrich_backend.close_identities()
 
-    SortingHat.add_identities(enrich_backend.sh_db, new_identities,
-                              enrich_backend.get_connector_name())
+    logger.info("Total new identities to be checked %i from %i items (%.2f sec)",
+                len(new_identities), items_count, time() - init)
+    metrics.observe("identities_load", time() - init)
+    metrics.inc("identities_items", items_count)
+    metrics.inc("identities_found", len(new_identities))
+
+    with metrics.timer("sh_add_identities"):
+        SortingHat.add_identities(enrich_backend.sh_db, new_identities,
+                                  enrich_backend.get_connector_name())
 
     return len(new_identities)
 
@@ -457,7 +723,91 @@ def get_ocean_backend(backend_cmd, enrich_backend, no_incremental,
     return ocean_backend
 
 
+def get_checkpoint_id(ocean_backend, enrich_backend):
+    """ Id of the checkpoint for the enrichment of a repository in a raw index """
+
+    origin = ocean_backend.perceval_backend.origin
+    key = " ".join([ocean_backend.elastic.index, enrich_backend.elastic.index, origin])
+
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def load_checkpoint(ocean_backend, enrich_backend):
+    """ Start reading raw items after the last one enriched, if known """
+
+    checkpoint_id = get_checkpoint_id(ocean_backend, enrich_backend)
+    checkpoint = ConfOcean.get_checkpoint(checkpoint_id)
+    if not checkpoint:
+        return
+
+    logger.info("Resuming enrichment of %s after %s",
+                ocean_backend.perceval_backend.origin, checkpoint['search_after'])
+    ocean_backend.checkpoint = checkpoint['search_after']
+    # The checkpoint is more precise than the last enrichment date
+    ocean_backend.from_date = None
+    ocean_backend.offset = None
+
+
+def save_checkpoint(ocean_backend, enrich_backend, search_after=None):
+    """ Store the position of the last raw item enriched, the last one
+    read if search_after is not provided """
+
+    if search_after is None:
+        search_after = ocean_backend.last_sort
+    if search_after is None:
+        return
+
+    checkpoint = {
+        "raw_index": ocean_backend.elastic.index,
+        "enrich_index": enrich_backend.elastic.index,
+        "origin": ocean_backend.perceval_backend.origin,
+        "search_after": search_after,
+        "metadata__updated_on": datetime.utcnow().isoformat()
+    }
+    ConfOcean.set_checkpoint(get_checkpoint_id(ocean_backend, enrich_backend), checkpoint)
+
+
+class EnrichCheckpoint():
+    """Checkpoint of an enrichment saved while its rich docs are written.
+
+    The mark of each pack sent is the position in the raw index of the last
+    item with all its rich docs in that pack or before. Raw items are read
+    ahead of the docs written, so the last position read can't be used.
+    The checkpoint is stored every save_packs packs written.
+    """
+
+    save_packs = 10
+
+    def __init__(self, ocean_backend, enrich_backend):
+        self.ocean_backend = ocean_backend
+        self.enrich_backend = enrich_backend
+
+        # Positions of the raw items read and not enriched yet
+        ocean_backend.positions = deque()
+        self.enriched = enrich_backend.enriched_items
+        self.mark = None
+        self.packs = 0
+
+    def get_mark(self):
+        """ Position of the last raw item with all its rich docs generated """
+
+        positions = self.ocean_backend.positions
+        while self.enriched < self.enrich_backend.enriched_items and positions:
+            self.mark = positions.popleft()
+            self.enriched += 1
+
+        return self.mark
+
+    def save(self, mark):
+        self.packs += 1
+        if self.packs % self.save_packs == 0:
+            save_checkpoint(self.ocean_backend, self.enrich_backend, mark)
+
+
 def do_studies(enrich_backend, no_incremental=False):
+    # Studies search the enriched items just written
+    enrich_backend.elastic.refresh_index()
+
     try:
         for study in enrich_backend.studies:
             logger.info("Starting study: %s (no_incremental %s)", study, no_incremental)
@@ -478,16 +828,17 @@ def enrich_backend(url, clean, backend_name, backend_params, ocean_index=None,
                    do_refresh_projects=False, do_refresh_identities=False,
                    author_id=None, author_uuid=None, filter_raw=None,
                    filters_raw_prefix=None, jenkins_rename_file=None,
-                   unaffiliated_group=None):
+                   unaffiliated_group=None, do_refresh_identities_changes=False):
     """ Enrich Ocean index """
 
     backend = None
     enrich_index = None
+    task_labels = {"connector": backend_name, "task": "enrich"}  # labels of the metrics
 
     if ocean_index or ocean_index_enrich:
         clean = False  # don't remove index, it could be shared
 
-    if do_refresh_projects or do_refresh_identities:
+    if do_refresh_projects or do_refresh_identities or do_refresh_identities_changes:
         clean = False  # refresh works over the existing enriched items
 
     if not get_connector_from_name(backend_name):
@@ -502,6 +853,8 @@ def enrich_backend(url, clean, backend_name, backend_params, ocean_index=None,
             # Data is retrieved from Perceval
             backend_cmd = klass(*backend_params)
             backend = backend_cmd.backend
+            task_labels['origin'] = backend.origin
+        metrics.set_labels(**task_labels)
 
         if ocean_index_enrich:
             enrich_index = ocean_index_enrich
@@ -555,9 +908,12 @@ def enrich_backend(url, clean, backend_name, backend_params, ocean_index=None,
             do_studies(enrich_backend, no_incremental)
         elif do_refresh_projects:
             logger.info("Refreshing project field in %s", enrich_backend.elastic.index_url)
-            field_id = enrich_backend.get_field_unique_id()
-            eitems = refresh_projects(enrich_backend)
-            enrich_backend.elastic.bulk_upload_sync(eitems, field_id)
+            if use_projects_groups(enrich_backend):
+                refresh_projects_groups(enrich_backend)
+            else:
+                with enrich_backend.elastic.bulk_writer() as writer:
+                    for item_id, new_project in refresh_projects_fields(enrich_backend):
+                        writer.add({"doc": new_project}, item_id, action="update")
         elif do_refresh_identities:
 
             filter_author = None
@@ -569,14 +925,33 @@ def enrich_backend(url, clean, backend_name, backend_params, ocean_index=None,
                                  'value': author_uuid}
 
             logger.info("Refreshing identities fields in %s", enrich_backend.elastic.index_url)
-            field_id = enrich_backend.get_field_unique_id()
-            eitems = refresh_identities(enrich_backend, filter_author)
-            enrich_backend.elastic.bulk_upload_sync(eitems, field_id)
+            with enrich_backend.elastic.bulk_writer() as writer:
+                for item_id, new_identities in refresh_identities_fields(enrich_backend, filter_author):
+                    writer.add({"doc": new_identities}, item_id, action="update")
+        elif do_refresh_identities_changes and not enrich_backend.sortinghat:
+            logger.error("SortingHat is not configured. Identities changes can't be refreshed.")
+        elif do_refresh_identities_changes:
+            logger.info("Refreshing identities changed in SortingHat in %s", enrich_backend.elastic.index_url)
+            ConfOcean.set_elastic(enrich_backend.elastic)
+            after = None if no_incremental else load_sh_checkpoint(enrich_backend)
+            # Changes done while refreshing are refreshed the next time
+            refresh_started = datetime.utcnow()
+            with enrich_backend.elastic.bulk_writer() as writer:
+                for item_id, new_identities in refresh_identities_changes(enrich_backend, after):
+                    writer.add({"doc": new_identities}, item_id, action="update")
+            save_sh_checkpoint(enrich_backend, refresh_started)
         else:
             clean = False  # Don't remove ocean index when enrich
             elastic_ocean = get_elastic(url, ocean_index, clean, ocean_backend)
             ocean_backend.set_elastic(elastic_ocean)
 
+            # Checkpoints are only available reading raw items with search_after
+            use_checkpoint = ocean_backend.search_after and backend is not None
+            if use_checkpoint or ConfOcean.store_metrics:
+                ConfOcean.set_elastic(elastic_ocean)
+            if use_checkpoint and not no_incremental:
+                load_checkpoint(ocean_backend, enrich_backend)
+
             logger.info("Adding enrichment data to %s", enrich_backend.elastic.index_url)
 
             if db_sortinghat:
@@ -588,6 +963,9 @@ def enrich_backend(url, clean, backend_name, backend_params, ocean_index=None,
                 logger.info("Only SH identities added. Enrich not done!")
 
             else:
+                if use_checkpoint:
+                    # Interrupted enrichments resume after the last pack written
+                    enrich_backend.enrich_checkpoint = EnrichCheckpoint(ocean_backend, enrich_backend)
                 # Enrichment for the new items once SH update is finished
                 if not events_enrich:
                     enrich_count = enrich_items(ocean_backend, enrich_backend)
@@ -597,9 +975,15 @@ def enrich_backend(url, clean, backend_name, backend_params, ocean_index=None,
                     enrich_count = enrich_items(ocean_backend, enrich_backend, events=True)
                     if enrich_count is not None:
                         logger.info("Total events enriched %i ", enrich_count)
+                # All the items read are enriched and written now
+                if use_checkpoint:
+                    save_checkpoint(ocean_backend, enrich_backend)
                 if studies:
                     do_studies(enrich_backend)
 
+            if ConfOcean.store_metrics:
+                ConfOcean.add_metrics(enrich_index, metrics.get_report(**task_labels))
+
     except Exception as ex:
         logger.error("%s", traceback.format_exc())
         if backend:
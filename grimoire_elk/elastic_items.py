@@ -25,14 +25,23 @@
 """Generates items from ElasticSearch based on filters """
 
 
+import heapq
 import json
 import logging
+import queue
+import threading
 
-from .elk.utils import get_repository_filter, grimoire_con
+from time import time
+
+from .elk.metrics import metrics
+from .elk.utils import get_grimoire_con, get_repository_filter
 from .elastic_mapping import Mapping
 
 logger = logging.getLogger(__name__)
 
+# Only the fields of the search responses used to read the items
+HITS_FILTER_PATH = "filter_path=_scroll_id,hits.hits._id,hits.hits._source,hits.hits.sort"
+
 
 class ElasticItems():
 
@@ -41,6 +50,18 @@ class ElasticItems():
     # In large projects like Eclipse commits, 100 is too much
     # Change it from p2o command line or mordred config
     scroll_size = 100
+    # Slices of the scroll read in parallel and if the items from them
+    # must be generated in the incremental date order
+    scroll_slices = 1
+    scroll_ordered = True
+    # Read the items sorted by the incremental date and the unique id using
+    # search_after pages (ES >= 5) instead of a scroll context. The position
+    # reached is available in last_sort so it can be used as a checkpoint.
+    search_after = False
+    # Items of raw indexes, which are unique by uuid. Enriched indexes can
+    # have several docs with the same uuid and date (like git multi author
+    # commits), which would be skipped by search_after at a page boundary.
+    raw_items = False
 
     def __init__(self, perceval_backend, from_date=None, insecure=True, offset=None):
 
@@ -50,8 +71,12 @@ class ElasticItems():
         self.offset = offset  # fetch from offset
         self.filter_raw = None  # to filter raw items from Ocean
         self.filter_raw_should = None  # to filter raw items from Ocean
+        self.checkpoint = None  # sort values to read items after (search_after)
+        self.last_sort = None  # sort values of the last item fetched (search_after)
+        self.positions = None  # sort values of the items fetched, if tracked (search_after)
+        self.fetch_source = None  # fields of the items to be fetched, all if None
 
-        self.requests = grimoire_con(insecure)
+        self.requests = get_grimoire_con(insecure)
         self.elastic = None
         self.elastic_url = None
 
@@ -91,35 +116,211 @@ class ElasticItems():
 
         logger.debug("Creating a elastic items generator.")
 
-        elastic_scroll_id = None
+        if self.search_after and self.__use_search_after():
+            for eitem in self.__fetch_search_after(_filter):
+                yield eitem
+            return
 
-        while True:
-            rjson = self.get_elastic_items(elastic_scroll_id, _filter=_filter)
+        if self.scroll_slices > 1 and self.elastic and self.elastic.major == '2':
+            logger.warning("Sliced scroll not supported in ES 2, using only one scroll")
+        elif self.scroll_slices > 1 and self.elastic:
+            for eitem in self.__fetch_sliced(_filter):
+                yield eitem
+            return
 
-            if rjson and "_scroll_id" in rjson:
-                elastic_scroll_id = rjson["_scroll_id"]
+        for hits in self.__fetch_pages(_filter):
+            for hit in hits:
+                yield hit['_source']
 
-            if rjson and "hits" in rjson:
-                received = len(rjson["hits"]["hits"])
-                if received == 0:
-                    logger.debug("Fetching from %s: done receiving",
-                                 self.elastic.index_url)
-                    break
-                logger.debug("Fetching from %s: %d received",
-                             self.elastic.index_url, received)
-                for hit in rjson["hits"]["hits"]:
-                    eitem = hit['_source']
-                    yield eitem
-            else:
+    def __get_order_field(self):
+        """ Field used to sort the items, if any """
+
+        order_field = None
+        if self.perceval_backend:
+            order_field = self.get_incremental_date()
+        elif hasattr(self, 'is_twitter_ocean'):
+            # TwitterOcean, order field is special
+            order_field = '@timestamp'
+
+        return order_field
+
+    def __use_search_after(self):
+        """ Check if the items can be read using search_after """
+
+        if not self.elastic or self.elastic.major == '2':
+            logger.warning("search_after not supported in ES 2, using scroll")
+            return False
+        if not self.raw_items or not self.perceval_backend:
+            # Only raw items from perceval have the unique id to sort them
+            logger.debug("search_after only supported for raw items, using scroll")
+            return False
+
+        return True
+
+    def __fetch_search_after(self, _filter=None):
+        """ Fetch the items using search_after, starting after the checkpoint """
+
+        search_after = self.checkpoint
+
+        while True:
+            rjson = self.get_elastic_items_search(search_after, _filter=_filter)
+
+            if not rjson or "hits" not in rjson:
                 logger.warning("No results found from %s", self.elastic.index_url)
                 break
-        return
 
-    def get_elastic_items(self, elastic_scroll_id=None, _filter=None):
-        """ Get the items from the index related to the backend applying and
-        optional _filter if provided"""
+            hits = rjson["hits"]["hits"]
+            if not hits:
+                logger.debug("Fetching from %s: done receiving", self.elastic.index_url)
+                break
+            logger.debug("Fetching from %s: %d received", self.elastic.index_url, len(hits))
+
+            for hit in hits:
+                self.last_sort = hit['sort']
+                if self.positions is not None:
+                    self.positions.append(hit['sort'])
+                yield hit['_source']
+
+            if len(hits) < self.scroll_size:
+                # Last page, no need to ask for an empty one
+                break
+            search_after = hits[-1]['sort']
 
+    def __fetch_pages(self, _filter=None, slice_=None):
+        """ Generate the pages of hits of a scroll """
+
+        elastic_scroll_id = None
+
+        try:
+            while True:
+                rjson = self.get_elastic_items(elastic_scroll_id, _filter=_filter, slice_=slice_)
+
+                if rjson and "_scroll_id" in rjson:
+                    elastic_scroll_id = rjson["_scroll_id"]
+
+                if rjson and "hits" in rjson:
+                    received = len(rjson["hits"]["hits"])
+                    if received == 0:
+                        logger.debug("Fetching from %s: done receiving",
+                                     self.elastic.index_url)
+                        break
+                    logger.debug("Fetching from %s: %d received",
+                                 self.elastic.index_url, received)
+                    yield rjson["hits"]["hits"]
+                else:
+                    logger.warning("No results found from %s", self.elastic.index_url)
+                    break
+        finally:
+            # Don't keep the scroll context open in the cluster until it expires
+            if elastic_scroll_id:
+                self.clear_scroll(elastic_scroll_id)
+
+    def clear_scroll(self, elastic_scroll_id):
+        """ Free the resources used by a scroll context in Elasticsearch """
+
+        url = self.elastic.url + "/_search/scroll"
         headers = {"Content-Type": "application/json"}
+        data = json.dumps({"scroll_id": [elastic_scroll_id]})
+
+        try:
+            res = self.requests.delete(url, data=data, headers=headers)
+            res.raise_for_status()
+        except Exception as ex:
+            # The context expires anyway after the scroll time
+            logger.debug("Can't clear scroll in %s: %s", self.elastic.url, ex)
+
+    def __fetch_sliced(self, _filter=None):
+        """ Fetch the items reading the slices of a scroll in parallel threads.
+
+        Each slice is read in its own thread which queues the pages of hits.
+        In ordered mode the slices, sorted by the incremental date, are merged
+        keeping that order, so an interrupted enrichment can be resumed from
+        the last date enriched. Otherwise pages are generated as they arrive.
+        """
+
+        nslices = self.scroll_slices
+        # Items are only sorted if there is a field to order them
+        ordered = self.scroll_ordered and self.__get_order_field() is not None
+        # Several pages per slice could be waiting to be processed
+        max_pages = 2
+        stop = threading.Event()
+        done = object()  # mark for the end of a slice
+
+        if ordered:
+            queues = [queue.Queue(max_pages) for _ in range(nslices)]
+        else:
+            queues = [queue.Queue(max_pages * nslices)] * nslices
+
+        def put(pages, page):
+            """ Wait for room in the queue unless the generator was closed """
+            while not stop.is_set():
+                try:
+                    pages.put(page, timeout=1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def read_slice(slice_id):
+            pages = queues[slice_id]
+            slice_ = {"id": slice_id, "max": nslices}
+            slice_pages = self.__fetch_pages(_filter, slice_)
+            try:
+                for hits in slice_pages:
+                    if not put(pages, hits):
+                        return
+            except Exception as ex:
+                put(pages, ex)
+            finally:
+                # Clear the scroll of the slice also if reading is stopped
+                slice_pages.close()
+            put(pages, done)
+
+        def slice_hits(pages, nslices_pages=1):
+            """ Hits from the pages queued by nslices_pages slices """
+            finished = 0
+            while finished < nslices_pages:
+                hits = pages.get()
+                if hits is done:
+                    finished += 1
+                    continue
+                if isinstance(hits, Exception):
+                    raise hits
+                for hit in hits:
+                    yield hit
+
+        def sorted_hits(slice_id, pages):
+            """ (sort value, slice, hit) tuples to merge the slices """
+            nhit = 0
+            for hit in slice_hits(pages):
+                yield (hit['sort'], slice_id, nhit, hit)
+                nhit += 1
+
+        logger.debug("Fetching from %s using %i slices (ordered: %s)",
+                     self.elastic.index_url, nslices, ordered)
+
+        for slice_id in range(nslices):
+            reader = threading.Thread(target=read_slice, args=(slice_id,))
+            reader.daemon = True
+            reader.start()
+
+        try:
+            if ordered:
+                hits = (hit for (_, _, _, hit) in
+                        heapq.merge(*[sorted_hits(i, queues[i]) for i in range(nslices)]))
+            else:
+                hits = slice_hits(queues[0], nslices)
+
+            for hit in hits:
+                yield hit['_source']
+        finally:
+            # Stop the readers if the generator is closed before the end
+            stop.set()
+
+    def get_elastic_items(self, elastic_scroll_id=None, _filter=None, slice_=None):
+        """ Get the items from the index related to the backend applying and
+        optional _filter if provided. With slice_ ({"id": id, "max": max})
+        only the items in that slice of the scroll are returned. """
 
         if not self.elastic:
             return None
@@ -128,115 +329,156 @@ class ElasticItems():
         # In gerrit enrich with 500 items per page we need >1 min
         # In Mozilla ES in Amazon we need 10m
         max_process_items_pack_time = "10m"  # 10 minutes
-        url += "/_search?scroll=%s&size=%i" % (max_process_items_pack_time,
-                                               self.scroll_size)
+        url += "/_search?scroll=%s&%s&size=%i" % (max_process_items_pack_time, HITS_FILTER_PATH,
+                                                  self.scroll_size)
 
         if elastic_scroll_id:
             """ Just continue with the scrolling """
             url = self.elastic.url
-            url += "/_search/scroll"
+            url += "/_search/scroll?" + HITS_FILTER_PATH
             scroll_data = {
                 "scroll": max_process_items_pack_time,
                 "scroll_id": elastic_scroll_id
             }
             query_data = json.dumps(scroll_data)
         else:
-            # If using a perceval backends always filter by repository
-            # to support multi repository indexes
-            # We need the filter dict as a string to join with the rest
-            filters_dict = self.get_repository_filter_raw(term=True)
-            if filters_dict:
-                filters = json.dumps(filters_dict)
-            else:
-                filters = ''
-
-            if self.filter_raw:
-                filters += '''
-                    , {"term":
-                        { "%s":"%s"  }
-                    }
-                ''' % (self.filter_raw['name'], self.filter_raw['value'])
-
-            if _filter:
-                filter_str = '''
-                    , {"terms":
-                        { "%s": %s }
-                    }
-                ''' % (_filter['name'], _filter['value'])
-                # List to string conversion uses ' that are not allowed in JSON
-                filter_str = filter_str.replace("'", "\"")
-                filters += filter_str
-
-            if self.from_date:
-                date_field = self.get_incremental_date()
-                from_date = self.from_date.isoformat()
-
-                filters += '''
-                    , {"range":
-                        {"%s": {"gte": "%s"}}
-                    }
-                ''' % (date_field, from_date)
-            elif self.offset:
-                filters += '''
-                    , {"range":
-                        {"offset": {"gte": %i}}
-                    }
-                ''' % (self.offset)
-
             # Order the raw items from the old ones to the new so if the
             # enrich process fails, it could be resume incrementally
             order_query = ''
-            order_field = None
-            if self.perceval_backend:
-                order_field = self.get_incremental_date()
-            elif hasattr(self, 'is_twitter_ocean'):
-                # TwitterOcean, order field is special
-                order_field = '@timestamp'
+            order_field = self.__get_order_field()
             if order_field is not None:
                 order_query = ', "sort": { "%s": { "order": "asc" }} ' % order_field
 
-            filters_should = ''
-            if self.filter_raw_should:
-                filters_should = json.dumps(self.filter_raw_should)[1:-1]
-                # We need to add a bool should query to the outer must query
-                query_should = '{"bool": {%s}}' % filters_should
-                filters += ", " + query_should
-
-            # Fix the filters string if it starts with "," (empty first filter)
-            if filters.lstrip().startswith(','):
-                filters = filters.lstrip()[1:]
-
-            filters_dict = json.loads("[" + filters + "]")
-            if len(filters_dict) == 0:
-                # Avoid empty list of filters, ES 6.x doesn't like it
-                # In this case, ensure that order_query does not start with ,
-                if order_query.startswith(','):
-                    order_query = order_query[1:]
-                query = """
-                {
-                  %s
-                }
-                """ % (order_query)
-            else:
-                query = """
-                {
-                    "query": {
-                        "bool": {
-                            "must": [%s]
-                        }
-                    } %s
-                }
-                """ % (filters, order_query)
+            query = self.__get_query(_filter, order_query)
+
+            if slice_:
+                query_json = json.loads(query)
+                query_json['slice'] = slice_
+                query = json.dumps(query_json)
 
             logger.debug("Raw query to %s\n%s", url, json.dumps(json.loads(query), indent=4))
             query_data = query
 
-        items = []
+        return self.__search(url, query_data)
+
+    def get_elastic_items_search(self, search_after=None, _filter=None):
+        """ Get a page of items sorted by the incremental date and the unique
+        id, after the item with the search_after sort values if provided. """
+
+        if not self.elastic:
+            return None
+        url = self.elastic.index_url
+        url += "/_search?%s&size=%i" % (HITS_FILTER_PATH, self.scroll_size)
+
+        order_query = ', "sort": [{ "%s": { "order": "asc" }}, { "uuid": { "order": "asc" }}] ' % \
+            self.get_incremental_date()
+        if search_after:
+            order_query += ', "search_after": %s ' % json.dumps(search_after)
+
+        query = self.__get_query(_filter, order_query)
+
+        logger.debug("Raw query to %s\n%s", url, json.dumps(json.loads(query), indent=4))
+
+        return self.__search(url, query)
+
+    def __get_query(self, _filter, order_query):
+        """ Query with the filters for the items to be read """
+
+        if self.fetch_source:
+            # Only the fields needed are sent by ES
+            order_query += ', "_source": %s ' % json.dumps(self.fetch_source)
+
+        # If using a perceval backends always filter by repository
+        # to support multi repository indexes
+        # We need the filter dict as a string to join with the rest
+        filters_dict = self.get_repository_filter_raw(term=True)
+        if filters_dict:
+            filters = json.dumps(filters_dict)
+        else:
+            filters = ''
+
+        if self.filter_raw:
+            filters += '''
+                , {"term":
+                    { "%s":"%s"  }
+                }
+            ''' % (self.filter_raw['name'], self.filter_raw['value'])
+
+        if _filter:
+            filter_str = '''
+                , {"terms":
+                    { "%s": %s }
+                }
+            ''' % (_filter['name'], _filter['value'])
+            # List to string conversion uses ' that are not allowed in JSON
+            filter_str = filter_str.replace("'", "\"")
+            filters += filter_str
+
+        if self.from_date:
+            date_field = self.get_incremental_date()
+            from_date = self.from_date.isoformat()
+
+            filters += '''
+                , {"range":
+                    {"%s": {"gte": "%s"}}
+                }
+            ''' % (date_field, from_date)
+        elif self.offset:
+            filters += '''
+                , {"range":
+                    {"offset": {"gte": %i}}
+                }
+            ''' % (self.offset)
+
+        filters_should = ''
+        if self.filter_raw_should:
+            filters_should = json.dumps(self.filter_raw_should)[1:-1]
+            # We need to add a bool should query to the outer must query
+            query_should = '{"bool": {%s}}' % filters_should
+            filters += ", " + query_should
+
+        # Fix the filters string if it starts with "," (empty first filter)
+        if filters.lstrip().startswith(','):
+            filters = filters.lstrip()[1:]
+
+        filters_dict = json.loads("[" + filters + "]")
+        if len(filters_dict) == 0:
+            # Avoid empty list of filters, ES 6.x doesn't like it
+            # In this case, ensure that order_query does not start with ,
+            if order_query.startswith(','):
+                order_query = order_query[1:]
+            query = """
+            {
+              %s
+            }
+            """ % (order_query)
+        else:
+            query = """
+            {
+                "query": {
+                    "bool": {
+                        "must": [%s]
+                    }
+                } %s
+            }
+            """ % (filters, order_query)
+
+        return query
+
+    def __search(self, url, query_data):
+
+        headers = {"Content-Type": "application/json"}
+
         rjson = None
         try:
+            start = time()
             res = self.requests.post(url, data=query_data, headers=headers)
             res.raise_for_status()
             rjson = res.json()
+            # filter_path removes the hits when there are none
+            rjson.setdefault("hits", {"hits": []})
+            metrics.observe("raw_fetch", time() - start)
+            metrics.inc("raw_items", len(rjson["hits"]["hits"]))
         except Exception:
             # The index could not exists yet or it could be empty
             logger.warning("No JSON found in %s" % (res.text))
@@ -24,8 +24,7 @@
 
 import logging
 
-from dateutil import parser
-
+from .dates import parse_date
 from .utils import get_time_diff_days, unixtime_to_datetime
 
 from .enrich import Enrich, metadata
@@ -244,7 +243,7 @@ class AskbotEnrich(Enrich):
         if dfield == 'added_at':
             comment_at = unixtime_to_datetime(float(comment[dfield]))
         else:
-            comment_at = parser.parse(comment[dfield])
+            comment_at = parse_date(comment[dfield])
 
         added_at = unixtime_to_datetime(float(item['data']["added_at"]))
         ecomment['time_from_question'] = get_time_diff_days(added_at, comment_at)
@@ -315,28 +314,13 @@ class AskbotEnrich(Enrich):
 
         return (answers_enrich, comments_enrich)
 
-    def enrich_items(self, ocean_backend):
-        items = ocean_backend.fetch()
-        nitems = super(AskbotEnrich, self).enrich_items(ocean_backend)
-        logger.info("Total questions enriched: %i", nitems)
-
-        # And now for each item we want also the answers (tops)
-        items = ocean_backend.fetch()
-        nanswers = 0
-        ncomments = 0
-        rich_item_answers = []
-        rich_item_comments = []
-
-        for item in items:
-            (answers, comments) = self.get_rich_item_answers_comments(item)
-            rich_item_answers += answers
-            rich_item_comments += comments
-
-        if rich_item_answers:
-            nanswers = self.elastic.bulk_upload(rich_item_answers,
-                                                self.get_field_unique_id_answer())
-        if rich_item_comments:
-            ncomments += self.elastic.bulk_upload(rich_item_comments,
-                                                  self.get_field_unique_id_comment())
-        logger.info("Total answers enriched: %i", nanswers)
-        logger.info("Total comments enriched: %i", ncomments)
+    def get_rich_item_docs(self, item):
+        """ The question with its answers and comments """
+
+        yield item[self.get_field_unique_id()], self.get_rich_item(item)
+
+        (answers, comments) = self.get_rich_item_answers_comments(item)
+        for eanswer in answers:
+            yield eanswer[self.get_field_unique_id_answer()], eanswer
+        for ecomment in comments:
+            yield ecomment[self.get_field_unique_id_comment()], ecomment
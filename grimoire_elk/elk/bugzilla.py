@@ -28,8 +28,7 @@ import logging
 
 from datetime import datetime
 
-from dateutil import parser
-
+from .dates import parse_date
 from .enrich import Enrich, metadata
 
 from .utils import get_time_diff_days
@@ -79,6 +78,9 @@ class BugzillaEnrich(Enrich):
         repo += "buglist.cgi?product=" + product
         return repo
 
+    def get_project_repository_fields(self):
+        return ['origin', 'product']
+
     def get_identities(self, item):
         ''' Return the identities from an item '''
 
@@ -148,7 +150,7 @@ class BugzillaEnrich(Enrich):
                 eitem["reporter_email"] = issue["reporter"][0]["__text__"]
                 eitem["author_email"] = issue["reporter"][0]["__text__"]
 
-        date_ts = parser.parse(issue['creation_ts'][0]['__text__'])
+        date_ts = parse_date(issue['creation_ts'][0]['__text__'])
         eitem['creation_date'] = date_ts.strftime('%Y-%m-%dT%H:%M:%S')
 
         eitem["bug_id"] = issue['bug_id'][0]['__text__']
@@ -161,7 +163,7 @@ class BugzillaEnrich(Enrich):
                 eitem["summary"] = issue['summary'][0]['__text__']
 
         # Fix dates
-        date_ts = parser.parse(issue['delta_ts'][0]['__text__'])
+        date_ts = parse_date(issue['delta_ts'][0]['__text__'])
         eitem['changeddate_date'] = date_ts.isoformat()
         eitem['delta_ts'] = date_ts.strftime('%Y-%m-%dT%H:%M:%S')
 
@@ -27,9 +27,8 @@ import logging
 
 from datetime import datetime
 
-from dateutil import parser
-
-from .enrich import Enrich, metadata, DEFAULT_PROJECT
+from .dates import parse_date
+from .enrich import Enrich, metadata
 
 from .utils import get_time_diff_days
 
@@ -68,6 +67,9 @@ class BugzillaRESTEnrich(Enrich):
         identity['name'] = user['real_name']
         return identity
 
+    def get_project_repository_fields(self):
+        return ['origin', 'product', 'component']
+
     def get_item_project(self, eitem):
         """ Get project mapping enrichment field.
 
@@ -75,31 +77,27 @@ class BugzillaRESTEnrich(Enrich):
         implementacion.
         """
 
-        project = None
-        eitem_project = {}
         ds_name = self.get_connector_name()  # data source name in projects map
 
         component = eitem['component']
         url = eitem['origin']
         product = eitem['product']
 
-        repo_comp = url + "/buglist.cgi?product=" + product + "&component=" + component
-        repo_comp1 = url + "/buglist.cgi?component=" + component + "&product=" + product
-        repo_product = url + "/buglist.cgi?product=" + product
-
-        for repo in [repo_comp, repo_comp1, repo_product, url]:
-            if repo in self.prjs_map[ds_name]:
-                project = self.prjs_map[ds_name][repo]
-                break
-
-        if project is None:
-            project = DEFAULT_PROJECT
-
-        eitem_project = {"project": project}
+        # All the bugs of a component have the same project
+        key = (url, product, component)
+        if key not in self.prjs_cache:
+            repo_comp = url + "/buglist.cgi?product=" + product + "&component=" + component
+            repo_comp1 = url + "/buglist.cgi?component=" + component + "&product=" + product
+            repo_product = url + "/buglist.cgi?product=" + product
 
-        eitem_project.update(self.add_project_levels(project))
+            project = None
+            for repo in [repo_comp, repo_comp1, repo_product, url]:
+                if repo in self.prjs_map[ds_name]:
+                    project = self.prjs_map[ds_name][repo]
+                    break
+            self.prjs_cache[key] = project
 
-        return eitem_project
+        return self.get_project_fields(self.prjs_cache[key])
 
     @metadata
     def get_rich_item(self, item):
@@ -136,9 +134,9 @@ class BugzillaRESTEnrich(Enrich):
         eitem["product"] = issue['product']
 
         # Fix dates
-        date_ts = parser.parse(issue['creation_time'])
+        date_ts = parse_date(issue['creation_time'])
         eitem['creation_ts'] = date_ts.strftime('%Y-%m-%dT%H:%M:%S')
-        date_ts = parser.parse(issue['last_change_time'])
+        date_ts = parse_date(issue['last_change_time'])
         eitem['changeddate_date'] = date_ts.isoformat()
         eitem['delta_ts'] = date_ts.strftime('%Y-%m-%dT%H:%M:%S')
 
@@ -0,0 +1,338 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Elastic Search bulk API helpers
+#
+# Copyright (C) 2018 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+"""Builder and writer for the NDJSON bodies sent to the Elasticsearch bulk API"""
+
+import gzip
+import io
+import json
+import logging
+import threading
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from time import sleep, time
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+HEADER_NDJSON = {"Content-Type": "application/x-ndjson"}
+HEADER_NDJSON_GZIP = dict(HEADER_NDJSON, **{"Content-Encoding": "gzip"})
+
+# Only the fields of the response needed to check the items
+BULK_FILTER_PATH = "filter_path=errors,items.*._id,items.*.status,items.*.error"
+# Fast compression, most of the size reduction with little CPU
+GZIP_LEVEL = 1
+
+# Status returned by ES when it can not handle more requests now
+RETRY_STATUS = [429, 503]
+
+
+# ensure_ascii output can always be encoded as ascii, so mbox and other
+# data sources with broken unicode can't make the bulk request fail
+_json_encode = json.JSONEncoder(ensure_ascii=True).encode
+
+
+class BulkBody():
+    """NDJSON body for a bulk request kept in a reusable byte buffer.
+
+    Each document is JSON encoded only once, when it is added, and its
+    bytes are appended to the buffer. Building a pack of documents is
+    linear in its size and the buffer is reused between packs.
+
+    The pack is full when it reaches max_items documents, max_bytes
+    bytes or when max_seconds have passed since its first document was
+    added. A None limit is not checked.
+    """
+
+    def __init__(self, max_items=None, max_bytes=None, max_seconds=None):
+        self._buffer = io.BytesIO()
+        self.items = 0
+        self.started = None  # time in which the first document was added
+
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+
+    def __len__(self):
+        return self.items
+
+    @property
+    def size(self):
+        """ Size in bytes of the body """
+        return self._buffer.tell()
+
+    def add(self, doc, doc_id, action="index"):
+        """ Add a document with doc_id to the body """
+
+        if not self.items:
+            self.started = time()
+
+        header = {action: {"_id": str(doc_id)}}
+
+        write = self._buffer.write
+        write(_json_encode(header).encode('ascii'))
+        write(b"\n")
+        write(_json_encode(doc).encode('ascii'))
+        write(b"\n")
+
+        self.items += 1
+
+    def is_full(self):
+        """ Check if the pack must be sent before adding more documents """
+
+        if not self.items:
+            return False
+        if self.max_items is not None and self.items >= self.max_items:
+            return True
+        if self.max_bytes is not None and self.size >= self.max_bytes:
+            return True
+        if self.max_seconds is not None and time() - self.started >= self.max_seconds:
+            return True
+
+        return False
+
+    def getvalue(self):
+        """ Bytes to be sent as the body of the bulk request """
+        return self._buffer.getvalue()
+
+    def clear(self):
+        """ Empty the body so the buffer can be reused for the next pack """
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        self.items = 0
+        self.started = None
+
+
+class BulkWriter():
+    """Send bulk packs to Elasticsearch in background threads.
+
+    Documents are added to a BulkBody and, once it is full, its bytes are
+    handed to a pool of workers threads which send them while the caller
+    continues generating documents. At most max_pending packs can be
+    waiting or being sent: add() blocks when this limit is reached, so
+    a slow cluster slows down the producer instead of filling the memory.
+
+    Requests and items rejected because the cluster is overloaded
+    (429 and 503 status) are retried with an exponential backoff. Other
+    errors for items are logged and kept in errors (up to max_errors).
+
+    With only one worker, packs are written in the same order they were
+    added. With several workers that order is not guaranteed.
+
+    Responses only include the fields needed to check each item. The
+    packs can be sent compressed with gzip, to save bandwidth with remote
+    clusters.
+
+    The time spent encoding and sending each pack, and the documents and
+    bytes sent, are added to the metrics, labelled with the index.
+
+    A checkpoint can follow the packs written: the mark returned by its
+    get_mark() when a pack is sent is passed to its save() once that pack
+    and all the packs sent before it are written.
+
+    :param elastic: ElasticSearch object for the index
+    :param url: bulk API url
+    :param workers: number of bulk requests sent at the same time
+    :param max_pending: max number of packs waiting or being sent
+    :param compress: compress the packs with gzip
+    :param index: name of the index written, elastic index by default
+    :param checkpoint: object with get_mark() and save(mark) methods
+    """
+
+    max_retries = 5
+    retry_backoff = 1  # seconds to wait before the first retry
+    max_errors = 100
+
+    def __init__(self, elastic, url, workers=1, max_pending=None, compress=False, index=None,
+                 checkpoint=None):
+        self.elastic = elastic
+        self.url = url + ("&" if "?" in url else "?") + BULK_FILTER_PATH
+        self.compress = compress
+        self.index = index if index else elastic.index
+        self.checkpoint = checkpoint
+
+        self.bulk = BulkBody(max_items=elastic.max_items_bulk,
+                             max_bytes=elastic.max_bytes_bulk,
+                             max_seconds=elastic.max_seconds_bulk)
+
+        if not max_pending:
+            max_pending = workers + 1
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self._futures = deque()  # (future, mark) of the packs sent, in order
+        self._lock = threading.Lock()
+
+        self.inserted = 0
+        self.failed = 0
+        self.errors = []
+        self.encode_time = 0  # seconds encoding the current pack
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type:
+            # Don't hide the original exception with the pending ones
+            self._executor.shutdown(wait=True)
+        else:
+            self.close()
+
+    def add(self, doc, doc_id, action="index"):
+        """ Add a document to the current pack, sending it once full """
+
+        start = time()
+        self.bulk.add(doc, doc_id, action)
+        self.encode_time += time() - start
+        if self.bulk.is_full():
+            self.flush()
+
+    def flush(self):
+        """ Hand the current pack to the workers """
+
+        if len(self.bulk) == 0:
+            return
+
+        self._check_futures()
+
+        # Back-pressure: wait until a pending pack is done
+        self._pending.acquire()
+        try:
+            future = self._executor.submit(self._send, self.bulk.getvalue(),
+                                           len(self.bulk), self.bulk.started)
+        except Exception:
+            self._pending.release()
+            raise
+        mark = self.checkpoint.get_mark() if self.checkpoint else None
+        self._futures.append((future, mark))
+        metrics.observe("bulk_encode", self.encode_time, index=self.index)
+        self.encode_time = 0
+        self.bulk.clear()
+
+    def close(self):
+        """ Send the last pack and wait until all of them are written
+
+        :returns: number of documents written
+        """
+
+        try:
+            self.flush()
+            self._check_futures(wait=True)
+        finally:
+            self._executor.shutdown(wait=True)
+
+        if self.failed:
+            logger.error("Failed to insert %i items in %s", self.failed, self.url)
+
+        return self.inserted
+
+    def _check_futures(self, wait=False):
+        """ Raise the errors of the packs already sent and save the mark
+        of the last one written after all the previous ones """
+
+        mark = None
+        while self._futures and (wait or self._futures[0][0].done()):
+            future, mark = self._futures.popleft()
+            future.result()
+
+        if mark is not None:
+            self.checkpoint.save(mark)
+
+    def _send(self, body, nitems, started):
+        try:
+            task_init = time()
+            retries = self.__send_with_retries(body)
+            task_time = time() - task_init
+
+            metrics.observe("bulk_http", task_time, index=self.index)
+            metrics.inc("bulk_docs", nitems, index=self.index)
+            metrics.inc("bulk_bytes", len(body), index=self.index)
+            if retries:
+                metrics.inc("bulk_retries", retries, index=self.index)
+
+            logger.debug("bulk packet sent (%.2f sec, %i items, %.2f MB, %.2f sec building it, "
+                         "%.0f KB/s, %i retries)",
+                         task_time, nitems, len(body) / (1024 * 1024), task_init - started,
+                         len(body) / 1024 / task_time if task_time else 0, retries)
+        finally:
+            self._pending.release()
+
+    def __send_with_retries(self, body):
+        retries = 0
+
+        while True:
+            if self.compress:
+                res = self.elastic.requests.put(self.url, data=gzip.compress(body, GZIP_LEVEL),
+                                                headers=HEADER_NDJSON_GZIP)
+            else:
+                res = self.elastic.requests.put(self.url, data=body, headers=HEADER_NDJSON)
+
+            if res.status_code in RETRY_STATUS and retries < self.max_retries:
+                logger.warning("Bulk request rejected by %s (%i), retrying", self.url, res.status_code)
+            else:
+                res.raise_for_status()
+                body = self.__process_result(res.json(), body, retries < self.max_retries)
+                if not body:
+                    return retries
+                logger.warning("Items rejected by %s, retrying them", self.url)
+
+            sleep(self.retry_backoff * 2 ** retries)
+            retries += 1
+
+    def __process_result(self, result, body, retry):
+        """ Count the written items and collect the failed ones
+
+        :returns: body with the items to be retried, if any
+        """
+        inserted = 0
+        failed = []
+        retry_lines = []
+
+        # Each item in the body has an action line and a document line
+        lines = body.split(b"\n") if result['errors'] else []
+
+        for i, item in enumerate(result['items']):
+            status = list(item.values())[0]
+            if 'error' not in status:
+                inserted += 1
+            elif retry and status['status'] in RETRY_STATUS:
+                retry_lines += lines[2 * i:2 * i + 2]
+            else:
+                failed.append({"_id": status.get('_id'),
+                               "status": status['status'],
+                               "error": status['error']})
+
+        if failed:
+            metrics.inc("bulk_failed", len(failed), index=self.index)
+
+        with self._lock:
+            self.inserted += inserted
+            self.failed += len(failed)
+            self.errors += failed[:max(self.max_errors - len(self.errors), 0)]
+
+        if failed:
+            # Only the first error is logged, they are usually the same
+            logger.error("Failed to insert data to ES: %s, %s", str(failed[0]['error']), self.url)
+
+        if retry_lines:
+            return b"\n".join(retry_lines) + b"\n"
@@ -83,6 +83,9 @@ class ConfluenceEnrich(Enrich):
     def get_project_repository(self, eitem):
         return str(eitem['space'])
 
+    def get_project_repository_fields(self):
+        return ['space', 'origin']
+
     def get_users_data(self, item):
         """ If user fields are inside the global item dict """
         if 'data' in item:
@@ -26,8 +26,7 @@ import logging
 
 from copy import deepcopy
 
-from dateutil import parser
-
+from .dates import parse_date
 from .enrich import Enrich, metadata
 from ..elastic_mapping import Mapping as BaseMapping
 
@@ -131,7 +130,7 @@ class CratesEnrich(Enrich):
             event = deepcopy(eitem)
             event['download_sample_id'] = sample['id']
             event['sample_date'] = sample['date']
-            sample_date = parser.parse(event['sample_date'])
+            sample_date = parse_date(event['sample_date'])
             event['sample_version'] = sample['version']
             event['sample_downloads'] = sample['downloads']
             event.update(self.get_grimoire_fields(sample_date.isoformat(), "downloads_event"))
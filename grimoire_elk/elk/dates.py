@@ -0,0 +1,156 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Date parsing helpers for enrichment
+#
+# Copyright (C) 2018 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+"""Fast and memoized parsing of the dates found in raw items.
+
+The formats used by most data sources (ISO 8601, RFC 2822 and the default
+git log format) are parsed with regular expressions. Other formats are
+parsed with dateutil. The same date is usually parsed several times for
+an item, so the last dates parsed are cached.
+"""
+
+import datetime
+import re
+
+from functools import lru_cache
+
+from dateutil import parser, tz
+
+
+DATE_CACHE_SIZE = 4096
+
+MONTHS = {month: number for number, month in
+          enumerate(["jan", "feb", "mar", "apr", "may", "jun",
+                     "jul", "aug", "sep", "oct", "nov", "dec"], 1)}
+
+# 2016-07-27T10:43:25.467921+00:00, 2016-07-27 10:43:25Z, 2016-07-27
+ISO_8601_REGEX = re.compile(r"^(?P<year>\d{4})-(?P<month>\d{2})-(?P<day>\d{2})"
+                            r"(?:[T ](?P<hour>\d{2}):(?P<minute>\d{2})"
+                            r"(?::(?P<second>\d{2})(?:\.(?P<fraction>\d{1,6}))?)?"
+                            r"(?P<tz>Z|[+-]\d{2}:?\d{2})?)?$")
+
+# Mon, 01 Dec 2014 10:14:44 +0100
+RFC_2822_REGEX = re.compile(r"^(?:[A-Za-z]{3}, )?(?P<day>\d{1,2}) (?P<month>[A-Za-z]{3}) (?P<year>\d{4}) "
+                            r"(?P<hour>\d{2}):(?P<minute>\d{2}):(?P<second>\d{2}) (?P<tz>[+-]\d{4})$")
+
+# Fri Jul 1 17:48:15 2016 +0200
+GIT_REGEX = re.compile(r"^[A-Za-z]{3} (?P<month>[A-Za-z]{3}) (?P<day>\d{1,2}) "
+                       r"(?P<hour>\d{2}):(?P<minute>\d{2}):(?P<second>\d{2}) (?P<year>\d{4}) (?P<tz>[+-]\d{4})$")
+
+
+def _get_tz(tz_str):
+    """ tzinfo for Z, +HH:MM or +HHMM, as dateutil does """
+
+    if tz_str == 'Z':
+        return tz.tzutc()
+
+    tz_str = tz_str.replace(':', '')
+    offset = int(tz_str[1:3]) * 3600 + int(tz_str[3:5]) * 60
+    if tz_str[0] == '-':
+        offset = -offset
+    if offset == 0:
+        return tz.tzutc()
+
+    return tz.tzoffset(None, offset)
+
+
+def _parse_fast(date_str):
+    """ Parse the most common formats, None if date_str is not one of them """
+
+    match = ISO_8601_REGEX.match(date_str)
+    if match:
+        fields = match.groupdict()
+        microsecond = 0
+        if fields['fraction']:
+            microsecond = int(fields['fraction'].ljust(6, '0'))
+        return datetime.datetime(int(fields['year']), int(fields['month']), int(fields['day']),
+                                 int(fields['hour'] or 0), int(fields['minute'] or 0),
+                                 int(fields['second'] or 0), microsecond,
+                                 tzinfo=_get_tz(fields['tz']) if fields['tz'] else None)
+
+    match = RFC_2822_REGEX.match(date_str) or GIT_REGEX.match(date_str)
+    if match:
+        fields = match.groupdict()
+        month = MONTHS.get(fields['month'].lower())
+        if month:
+            return datetime.datetime(int(fields['year']), month, int(fields['day']),
+                                     int(fields['hour']), int(fields['minute']),
+                                     int(fields['second']), tzinfo=_get_tz(fields['tz']))
+
+    return None
+
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def _parse_date_str(date_str):
+    try:
+        date = _parse_fast(date_str)
+    except ValueError:
+        # Out of range values, let dateutil report them
+        date = None
+
+    if date is None:
+        date = parser.parse(date_str)
+
+    return date
+
+
+def parse_date(date):
+    """ Datetime for a date string, in any format supported by dateutil.
+    datetime objects are returned as they are.
+
+    :raises ValueError: if the date can't be parsed
+    """
+    if isinstance(date, datetime.datetime):
+        return date
+
+    return _parse_date_str(date)
+
+
+def to_utc_naive(date):
+    """ Offset-naive datetime in UTC for a datetime. Offset-naive
+    datetimes are returned as they are """
+
+    if date.tzinfo is None:
+        return date
+
+    return (date - date.utcoffset()).replace(tzinfo=None)
+
+
+def parse_date_utc(date):
+    """ Offset-naive datetime in UTC for a date string or datetime """
+    return to_utc_naive(parse_date(date))
+
+
+def parse_date_iso(date):
+    """ ISO 8601 string for a date string or datetime """
+    return parse_date(date).isoformat()
+
+
+def parse_date_all(date):
+    """ Parse a date once and get the datetime, the offset-naive datetime
+    in UTC and the ISO 8601 string for it
+
+    :returns: (datetime, utc naive datetime, isoformat string)
+    """
+    date = parse_date(date)
+
+    return date, to_utc_naive(date), date.isoformat()
@@ -24,7 +24,7 @@
 
 import logging
 
-from .utils import get_time_diff_days, grimoire_con
+from .utils import get_grimoire_con, get_time_diff_days
 
 from .enrich import Enrich, metadata
 
@@ -72,6 +72,9 @@ class DiscourseEnrich(Enrich):
     def get_project_repository(self, eitem):
         return str(eitem['category_id'])
 
+    def get_project_repository_fields(self):
+        return ['category_id', 'origin']
+
     def get_users_data(self, post):
         """ Adapt the data to be used with standard SH enrich API """
         poster = {}
@@ -119,7 +122,7 @@ class DiscourseEnrich(Enrich):
 
     def __collect_categories(self, origin):
         categories = {}
-        con = grimoire_con()
+        con = get_grimoire_con()
         raw_site = con.get(origin + "/site.json")
         for cat in raw_site.json()['categories']:
             categories[cat['id']] = cat['name']
@@ -127,7 +130,7 @@ class DiscourseEnrich(Enrich):
 
     def __collect_categories_tree(self, origin):
         tree = {}
-        con = grimoire_con()
+        con = get_grimoire_con()
         raw = con.get(origin + "/categories.json")
         raw_json = raw.json()
         if "category_list" in raw_json and 'categories' in raw_json["category_list"]:
@@ -244,21 +247,10 @@ class DiscourseEnrich(Enrich):
     def get_field_unique_id_answer(self):
         return "id"
 
-    def enrich_items(self, ocean_backend):
-        items = ocean_backend.fetch()
-
-        nitems = super(DiscourseEnrich, self).enrich_items(ocean_backend)
-        logger.info("Total questions enriched: %i", nitems)
-
-        # And now for each item we want also the answers (tops)
-        items = ocean_backend.fetch()
-        nanswers = 0
-        rich_item_answers = []
+    def get_rich_item_docs(self, item):
+        """ The question and its answers (posts) """
 
-        for item in items:
-            rich_item_answers += self.get_rich_item_answers(item)
+        yield item[self.get_field_unique_id()], self.get_rich_item(item)
 
-        if rich_item_answers:
-            nanswers += self.elastic.bulk_upload(rich_item_answers,
-                                                 self.get_field_unique_id_answer())
-        logger.info("Total answers enriched: %i", nanswers)
+        for eanswer in self.get_rich_item_answers(item):
+            yield eanswer[self.get_field_unique_id_answer()], eanswer
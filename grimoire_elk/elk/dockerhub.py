@@ -22,9 +22,7 @@
 #   Alvaro del Castillo San Felix <acs@bitergia.com>
 #
 
-import json
 import logging
-import sys
 
 from .enrich import Enrich, metadata
 from ..elastic_mapping import Mapping as BaseMapping
@@ -126,74 +124,26 @@ class DockerHubEnrich(Enrich):
 
         return eitem
 
-    def enrich_items(self, ocean_backend, events=False):
-        """ A custom enrich items is needed because apart from the enriched
-        events from raw items, a image item with the last data for an image
-        must be created """
+    def enrich_docs(self, items, events=False):
+        """ Apart from the enriched events from raw items, a image item with
+        the last data for an image must be created. Only the last event
+        for each image is kept, and the images are generated once all the
+        events are done, so they are the same also enriching in parallel. """
 
-        max_items = self.elastic.max_items_bulk
-        current = 0
-        total = 0
-        bulk_json = ""
-
-        items = ocean_backend.fetch()
         images_items = {}
 
-        url = self.elastic.index_url + '/items/_bulk'
-
-        logger.debug("Adding items to %s (in %i packs)", url, max_items)
-
-        headers = {"Content-Type": "application/json"}
-
-        for item in items:
-            if current >= max_items:
-                r = self.requests.put(url, data=bulk_json, headers=headers)
-                r.raise_for_status()
-                json_size = sys.getsizeof(bulk_json) / (1024 * 1024)
-                logger.debug("Added %i items to %s (%0.2f MB)", total, url, json_size)
-                bulk_json = ""
-                current = 0
-
-            rich_item = self.get_rich_item(item)
-            data_json = json.dumps(rich_item)
-            bulk_json += '{"index" : {"_id" : "%s" } }\n' % \
-                (item[self.get_field_unique_id()])
-            bulk_json += data_json + "\n"  # Bulk document
-            current += 1
-            total += 1
-
-            if rich_item['id'] not in images_items:
-                # Let's transform the rich_event in a rich_image
-                rich_item['is_docker_image'] = 1
-                rich_item['is_event'] = 0
-                images_items[rich_item['id']] = rich_item
-            else:
-                image_date = images_items[rich_item['id']]['last_updated']
-                if image_date <= rich_item['last_updated']:
-                    # This event is newer for the image
-                    rich_item['is_docker_image'] = 1
-                    rich_item['is_event'] = 0
-                    images_items[rich_item['id']] = rich_item
+        for item_id, rich_item in super().enrich_docs(items, events):
+            yield item_id, rich_item
 
-        if total == 0:
-            # No items enriched, nothing to upload to ES
-            return total
-
-        r = self.requests.put(url, data=bulk_json, headers=headers)
-        r.raise_for_status()
+            if rich_item['id'] not in images_items or \
+                    images_items[rich_item['id']]['last_updated'] <= rich_item['last_updated']:
+                # This event is newer for the image
+                images_items[rich_item['id']] = rich_item
 
         # Time to upload the images enriched items. The id is uuid+"_image"
         # Normally we are enriching events for a unique image so all images
         # data can be upload in one query
-        for image in images_items:
-            data = images_items[image]
-            data_json = json.dumps(data)
-            bulk_json += '{"index" : {"_id" : "%s" } }\n' % \
-                (data['id'] + "_image")
-            bulk_json += data_json + "\n"  # Bulk document
-            total += 1
-
-        r = self.requests.put(url, data=bulk_json, headers=headers)
-        r.raise_for_status()
-
-        return total
+        for image in images_items.values():
+            # Let's transform the rich_event in a rich_image
+            rich_image = dict(image, is_docker_image=1, is_event=0)
+            yield rich_image['id'] + "_image", rich_image
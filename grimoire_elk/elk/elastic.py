@@ -23,18 +23,15 @@
 #   Alvaro del Castillo San Felix <acs@bitergia.com>
 #
 
-from datetime import datetime
 from dateutil import parser
+import hashlib
 import json
 import logging
-import sys
-
-from time import time, sleep
 
 import requests
 
-from ..errors import ELKError
-from .utils import unixtime_to_datetime, grimoire_con
+from .bulk import BulkWriter
+from .utils import get_grimoire_con, unixtime_to_datetime
 
 
 logger = logging.getLogger(__name__)
@@ -51,8 +48,26 @@ class ElasticWriteException(Exception):
 class ElasticSearch(object):
 
     max_items_bulk = 1000
+    max_bytes_bulk = 10 * 1024 * 1024  # max size of the bulk request body
+    max_seconds_bulk = 30  # max time building a pack before sending it
+    bulk_workers = 1  # bulk requests sent at the same time
+    bulk_gzip = False  # send the bulk requests compressed
     max_items_clause = 1000  # max items in search clause (refresh identities)
 
+    # Clusters and indexes already set up in this process, so creating
+    # ElasticSearch objects for them again doesn't query the cluster.
+    # url -> version
+    versions = {}
+    # index url -> fingerprint of the analyzers and mappings of the index
+    indexes = {}
+
+    @classmethod
+    def clear_bootstrap_cache(cls):
+        """ Forget the clusters and indexes already set up, i.e. if they
+        were changed by other processes """
+        cls.versions.clear()
+        cls.indexes.clear()
+
     @classmethod
     def safe_index(cls, unique_id):
         """ Return a valid elastic index generated from unique_id """
@@ -62,7 +77,7 @@ class ElasticSearch(object):
         return index
 
     @staticmethod
-    def _check_instance(url, insecure):
+    def _get_version(url, insecure):
         """Checks if there is an instance of Elasticsearch in url.
 
         Actually, it checks if GET on the url returns a JSON document
@@ -71,43 +86,66 @@ class ElasticSearch(object):
 
         :value      url: url of the instance to check
         :value insecure: don't verify ssl connection (boolean)
-        :returns:        major version of Ellasticsearch, as string.
+        :returns:        version of Ellasticsearch, as string.
         """
 
-        res = grimoire_con(insecure).get(url)
+        res = get_grimoire_con(insecure).get(url)
         if res.status_code != 200:
             logger.error("Didn't get 200 OK from url %s", url)
             raise ElasticConnectException
         else:
             try:
-                version_str = res.json()['version']['number']
-                version_major = version_str.split('.')[0]
-                return version_major
+                return res.json()['version']['number']
             except Exception:
                 logger.error("Could not read proper welcome message from url %s",
                              url)
                 logger.error("Message read: %s", res.text)
                 raise ElasticConnectException
 
+    @staticmethod
+    def _check_instance(url, insecure):
+        """Checks if there is an instance of Elasticsearch in url.
+
+        :value      url: url of the instance to check
+        :value insecure: don't verify ssl connection (boolean)
+        :returns:        major version of Ellasticsearch, as string.
+        """
+
+        return ElasticSearch._get_version(url, insecure).split('.')[0]
+
     def __init__(self, url, index, mappings=None, clean=False,
                  insecure=True, analyzers=None):
         ''' clean: remove already existing index
             insecure: support https with invalid certificates
         '''
 
-        # Get major version of Elasticsearch instance
-        self.major = self._check_instance(url, insecure)
-        logger.debug("Found version of ES instance at %s: %s.",
-                     url, self.major)
+        # Get version of Elasticsearch instance
+        if url not in self.versions:
+            self.versions[url] = self._get_version(url, insecure)
+            logger.debug("Found version of ES instance at %s: %s.",
+                         url, self.versions[url])
+        version = self.versions[url].split('.')
+        self.major = version[0]
+        self.minor = version[1] if len(version) > 1 else '0'
 
         self.url = url
 
         # Valid index for elastic
         self.index = self.safe_index(index)
         self.index_url = self.url + "/" + self.index
-        self.wait_bulk_seconds = 2  # time to wait to complete a bulk operation
 
-        self.requests = grimoire_con(insecure)
+        self.requests = get_grimoire_con(insecure)
+
+        map_dict = mappings.get_elastic_mappings(es_major=self.major) if mappings else None
+        fingerprint = hashlib.sha1(json.dumps([analyzers, map_dict], sort_keys=True).encode('utf-8')).hexdigest()
+        if clean or self.indexes.get(self.index_url) != fingerprint:
+            self.indexes.pop(self.index_url, None)
+            self.__setup_index(analyzers, map_dict, clean)
+            self.indexes[self.index_url] = fingerprint
+
+    def __setup_index(self, analyzers, map_dict, clean):
+        """ Create the index, if it doesn't exist or it must be cleaned,
+        and its mappings """
 
         res = self.requests.get(self.index_url)
 
@@ -130,133 +168,72 @@ class ElasticSearch(object):
                                         headers=headers)
                 res.raise_for_status()
                 logger.info("Deleted and created index " + self.index_url)
-        if mappings:
-            map_dict = mappings.get_elastic_mappings(es_major=self.major)
+        if map_dict:
             self.create_mappings(map_dict)
 
-    def _safe_put_bulk(self, url, bulk_json):
-        """ Bulk PUT controlling unicode issues """
+    def bulk_writer(self, refresh=False, checkpoint=None):
+        """ BulkWriter to send packs of documents to the index
 
-        headers = {"Content-Type": "application/x-ndjson"}
+        :param refresh: 'wait_for' to wait after each pack until its
+            docs are searchable
+        :param checkpoint: checkpoint saved as the packs are written
+        """
 
-        try:
-            res = self.requests.put(url, data=bulk_json, headers=headers)
-            res.raise_for_status()
-        except UnicodeEncodeError:
-            # Related to body.encode('iso-8859-1'). mbox data
-            logger.error("Encondig error ... converting bulk to iso-8859-1")
-            bulk_json = bulk_json.encode('iso-8859-1', 'ignore')
-            res = self.requests.put(url, data=bulk_json, headers=headers)
-            res.raise_for_status()
+        url = self.index_url + '/items/_bulk'
+        if refresh == 'wait_for':
+            # ES 2 does not support wait_for, it forces a refresh instead
+            url += '?refresh=' + ('true' if self.major == '2' else 'wait_for')
 
-        result = res.json()
-        failed_items = []
-        if result['errors']:
-            # Due to multiple errors that may be thrown when inserting bulk data, only the first error is returned
-            failed_items = [item['index'] for item in result['items'] if 'error' in item['index']]
-            error = str(failed_items[0]['error'])
+        logger.debug("Adding items to %s (in packs of %i items, %.2f MB or %i sec, %i workers)",
+                     url, self.max_items_bulk, self.max_bytes_bulk / (1024 * 1024),
+                     self.max_seconds_bulk, self.bulk_workers)
 
-            logger.error("Failed to insert data to ES: %s, %s", error, url)
+        return BulkWriter(self, url, workers=self.bulk_workers, compress=self.bulk_gzip, index=self.index,
+                          checkpoint=checkpoint)
 
-        inserted_items = len(result['items']) - len(failed_items)
+    def bulk_upload(self, items, field_id, refresh=False):
+        ''' Upload in controlled packs items to ES using bulk API '''
 
-        # The exception is currently not thrown to avoid stopping ocean uploading processes
-        try:
-            if failed_items:
-                raise ELKError(cause=error)
-        except ELKError:
-            pass
+        docs = ((item[field_id], item) for item in items)
 
-        return inserted_items
+        return self.bulk_upload_docs(docs, refresh=refresh)
 
-    def bulk_upload(self, items, field_id):
-        ''' Upload in controlled packs items to ES using bulk API '''
+    def bulk_upload_docs(self, docs, refresh=False, checkpoint=None):
+        ''' Upload in controlled packs (doc_id, doc) pairs to ES using bulk API
 
-        current = 0
-        new_items = 0  # total items added with bulk
-        bulk_json = ""
+        :param docs: iterable with (doc_id, doc) pairs
+        :param refresh: False to not wait until the docs are visible in searches,
+            'wait_for' to wait after each pack until its docs are searchable,
+            True to refresh the index once all packs have been sent
+        :param checkpoint: checkpoint saved as the packs are written
+        :returns: number of docs inserted
+        '''
 
-        if not items:
-            return new_items
+        with self.bulk_writer(refresh=refresh, checkpoint=checkpoint) as writer:
+            for doc_id, doc in docs:
+                writer.add(doc, doc_id)
 
-        url = self.index_url + '/items/_bulk'
+        new_items = writer.inserted
 
-        logger.debug("Adding items to %s (in %i packs)" % (url, self.max_items_bulk))
-        task_init = time()
-
-        for item in items:
-            if current >= self.max_items_bulk:
-                task_init = time()
-                new_items += self._safe_put_bulk(url, bulk_json)
-                current = 0
-                json_size = sys.getsizeof(bulk_json) / (1024 * 1024)
-                logger.debug("bulk packet sent (%.2f sec, %i total, %.2f MB)"
-                             % (time() - task_init, new_items, json_size))
-                bulk_json = ""
-            data_json = json.dumps(item)
-            bulk_json += '{"index" : {"_id" : "%s" } }\n' % (item[field_id])
-            bulk_json += data_json + "\n"  # Bulk document
-            current += 1
-        new_items += self._safe_put_bulk(url, bulk_json)
-        json_size = sys.getsizeof(bulk_json) / (1024 * 1024)
-        logger.debug("bulk packet sent (%.2f sec prev, %i total, %.2f MB)"
-                     % (time() - task_init, new_items, json_size))
+        if refresh is True and new_items > 0:
+            self.refresh_index()
 
         return new_items
 
     def bulk_upload_sync(self, items, field_id, sync=True):
         """ Upload items in packs to ES using bulk API
-            and wait until the items appears in searches """
-
-        # After a bulk upload the searches are not refreshed immediately
-        # This method waits until the upload is visible in searches
-
-        def current_items():
-            """ Current number of items in the index """
-            res = self.requests.get(self.index_url + '/_search?size=1')
-            res.raise_for_status()
-            return res.json()['hits']['total']
-
-        def wait_index(total_expected):
-            """ Wait until ES has indexed all items
-
-            In incremental update, some items are updates not additions so
-            this check will fail. Log and return with timeout in this case.
-            """
-
-            total_search = 0  # total items found with search
-            search_start = datetime.now()
-            while total_search != total_expected:
-                sleep(0.1)
-                total_search = current_items()
-                if (datetime.now() - search_start).total_seconds() > self.wait_bulk_seconds:
-                    logger.debug("Bulk data does not appear as NEW after %is",
-                                 self.wait_bulk_seconds)
-                    logger.debug("Probably %i item updates", total_expected - total_search)
-                    break
-
-        total = 0
-        max_items = self.max_items_bulk
-        # After each pack we wait until all pack is indexed
-        items_pack = []
-
-        for item in items:
-            # We should pack the items before sending them
-            # After each pack we wait that is fully indexed to continue
-
-            if len(items_pack) >= max_items:
-                total_items = current_items()
-                total += self.bulk_upload(items_pack, field_id)
-                items_pack = []
-                if sync:
-                    wait_index(total_items + max_items)
-                logger.debug('Total items already uploaded %i', total)
-
-            items_pack.append(item)
-
-        total += self.bulk_upload(items_pack, field_id)
-
-        return total
+            and make them visible in searches once all are uploaded """
+
+        # After a bulk upload the searches are not refreshed immediately.
+        # Instead of polling the index after each pack, the index is
+        # refreshed once when all the packs have been sent.
+        return self.bulk_upload(items, field_id, refresh=sync)
+
+    def refresh_index(self):
+        """ Make all the operations done in the index visible in searches """
+
+        res = self.requests.post(self.index_url + '/_refresh')
+        res.raise_for_status()
 
     @classmethod
     def global_mapping(cls):
@@ -23,19 +23,24 @@
 #   Alvaro del Castillo San Felix <acs@bitergia.com>
 #
 
+import bisect
 import json
 import functools
 import logging
-import sys
+import multiprocessing
+
+from collections import deque
 
 from datetime import datetime as dt
 
-from dateutil import parser
 from functools import lru_cache
+from time import time
 
 from ..elastic_items import ElasticItems
 
-from .utils import grimoire_con
+from .dates import parse_date, parse_date_iso
+from .metrics import metrics
+from .utils import get_grimoire_con
 from .. import __version__
 
 logger = logging.getLogger(__name__)
@@ -55,7 +60,7 @@ try:
     from sortinghat import api, utils
     from sortinghat.exceptions import AlreadyExistsError, NotFoundError, WrappedValueError
 
-    from .sortinghat import SortingHat
+    from .sortinghat import SortingHat, SortingHatSnapshot
 
     SORTINGHAT_LIBS = True
 except ImportError:
@@ -66,6 +71,22 @@ except ImportError:
 DEFAULT_PROJECT = 'Main'
 DEFAULT_DB_USER = 'root'
 
+# Enricher replicated in the worker processes when enriching in parallel
+_enricher = None
+
+
+def _init_enrich_worker():
+    _enricher.init_enrich_worker()
+
+
+def _enrich_batch(items, events):
+    """ Rich docs for a batch of raw items, got in a worker process """
+
+    items = _enricher.prefetch_sh_identities(items)
+    rich_docs = list(_enricher.get_rich_docs(items, events))
+
+    return rich_docs, _enricher.get_enrich_updates(), metrics.pop()
+
 
 def metadata(func):
     """Add metadata to an item.
@@ -90,6 +111,17 @@ def metadata(func):
 class Enrich(ElasticItems):
 
     sh_db = None
+    # Items whose SortingHat identities are resolved together when enriching
+    sh_window_size = 1000
+    # Max number of identities kept in the SortingHat caches
+    sh_cache_size = 100000
+    # Load all the SortingHat data in memory instead of querying it
+    use_sh_snapshot = False
+    sh_snapshot = None  # SortingHatSnapshot shared by all the enrichers
+    sh_snapshot_check = 300  # seconds between checks of the snapshot version
+    # Processes getting the rich items in parallel, 1 to get them in this process
+    enrich_workers = 1
+    enrich_batch_size = 1000  # raw items sent at once to a worker process
     kibiter_version = None
     RAW_FIELDS_COPY = ["metadata__updated_on", "metadata__timestamp",
                        "offset", "origin", "tag", "uuid"]
@@ -112,6 +144,9 @@ class Enrich(ElasticItems):
             self.sortinghat = True
 
         self.prjs_map = None  # mapping beetween repositories and projects
+        self.prjs_index = {}  # repositories of each data source to search origins
+        self.prjs_cache = {}  # project found for each repository
+        self.prjs_fields = {}  # project fields for each project
         json_projects = None
 
         if json_projects_map:
@@ -134,7 +169,6 @@ class Enrich(ElasticItems):
 
         self.studies = []
 
-        self.requests = grimoire_con()
         self.elastic = None
         self.type_name = "items"  # type inside the index to store items enriched
 
@@ -148,6 +182,16 @@ class Enrich(ElasticItems):
         # Label used during enrichment for identities without a known affiliation
         self.unaffiliated_group = 'Unknown'
 
+        # SortingHat data resolved in bulk for the identities being enriched
+        self.sh_ids = {}  # (backend, email, name, username) -> {"id", "uuid"}
+        self.sh_uuids = {}  # id -> uuid
+        self.sh_uuids_data = {}  # uuid -> {"profile", "bot", "enrollments"}
+
+        # Raw items with all their rich docs generated, in the order read
+        self.enriched_items = 0
+        # Checkpoint saved as the rich docs are written (set by arthur)
+        self.enrich_checkpoint = None
+
     def set_elastic_url(self, url):
         """ Elastic URL """
         self.elastic_url = url
@@ -299,6 +343,14 @@ class Enrich(ElasticItems):
         """ Create a rich item from the raw item """
         raise NotImplementedError
 
+    def get_rich_item_docs(self, item):
+        """ Generate the (id, rich doc) pairs for a raw item. Connectors
+        which create several documents for an item (questions and their
+        answers...) generate all of them here, each one with its own id,
+        so they are written with the rest of rich items in one pass. """
+
+        yield item[self.get_field_unique_id()], self.get_rich_item(item)
+
     def get_rich_events(self, item):
         """ Create rich events from the raw item """
         raise NotImplementedError
@@ -307,63 +359,124 @@ class Enrich(ElasticItems):
         return self.enrich_items(items, events=True)
 
     def enrich_items(self, ocean_backend, events=False):
-        max_items = self.elastic.max_items_bulk
-        current = 0
-        total = 0
-        bulk_json = ""
-
         items = ocean_backend.fetch()
 
-        url = self.elastic.index_url + '/items/_bulk'
-
-        logger.debug("Adding items to %s (in %i packs)", url, max_items)
-
         if events:
             logger.debug("Adding events items")
 
-        for item in items:
-            if current >= max_items:
-                try:
-                    r = self.requests.put(url, headers=HEADERS_JSON, data=bulk_json)
-                    r.raise_for_status()
-                    json_size = sys.getsizeof(bulk_json) / (1024 * 1024)
-                    logger.debug("Added %i items to %s (%0.2f MB)", total, url, json_size)
-                except UnicodeEncodeError:
-                    # Why is requests encoding the POST data as ascii?
-                    logger.error("Unicode error in enriched items")
-                    logger.debug(bulk_json)
-                    safe_json = str(bulk_json.encode('ascii', 'ignore'), 'ascii')
-                    self.requests.put(url, headers=HEADERS_JSON, data=safe_json)
-                bulk_json = ""
-                current = 0
+        total = self.elastic.bulk_upload_docs(self.enrich_docs(items, events),
+                                              checkpoint=self.enrich_checkpoint)
+
+        return total
+
+    def get_rich_docs(self, items, events=False):
+        """ Generate the (id, rich item) pairs for the raw items """
 
+        for item in items:
+            start = time()
             if not events:
-                rich_item = self.get_rich_item(item)
-                data_json = json.dumps(rich_item)
-                bulk_json += '{"index" : {"_id" : "%s" } }\n' % \
-                    (item[self.get_field_unique_id()])
-                bulk_json += data_json + "\n"  # Bulk document
-                current += 1
-                total += 1
+                rich_docs = list(self.get_rich_item_docs(item))
+                metrics.observe("rich_item", time() - start)
             else:
-                rich_events = self.get_rich_events(item)
-                for rich_event in rich_events:
-                    data_json = json.dumps(rich_event)
-                    bulk_json += '{"index" : {"_id" : "%s_%s" } }\n' % \
-                        (item[self.get_field_unique_id()],
-                         rich_event[self.get_field_event_unique_id()])
-                    bulk_json += data_json + "\n"  # Bulk document
-                    current += 1
-                    total += 1
-
-        if total == 0:
-            # No items enriched, nothing to upload to ES
-            return total
-
-        r = self.requests.put(url, data=bulk_json, headers=HEADERS_JSON)
-        r.raise_for_status()
+                rich_docs = []
+                for rich_event in self.get_rich_events(item):
+                    event_id = "%s_%s" % (item[self.get_field_unique_id()],
+                                          rich_event[self.get_field_event_unique_id()])
+                    rich_docs.append((event_id, rich_event))
+                metrics.observe("rich_events", time() - start)
+            metrics.inc("rich_docs", len(rich_docs))
+
+            for rich_doc in rich_docs:
+                yield rich_doc
+            self.enriched_items += 1
+
+    def enrich_docs(self, items, events=False):
+        """ Generate the (id, rich item) pairs for the raw items, getting
+        them in enrich_workers processes if there are more than one """
+
+        if self.enrich_workers > 1:
+            return self.__enrich_docs_parallel(items, events)
+
+        return self.get_rich_docs(self.prefetch_sh_identities(items), events)
+
+    def __enrich_docs_parallel(self, items, events=False):
+        """ Send batches of raw items to a pool of processes with replicas
+        of this enricher and generate the rich docs in the order of the items.
+
+        Replicas are forked from this enricher, so they share the projects
+        map and the SortingHat snapshot loaded before. The data discovered
+        by the replicas is merged back with add_enrich_updates.
+        """
+        global _enricher
+
+        # Load the data to be shared by the replicas before forking them
+        self.get_sh_snapshot()
+        if self.sh_db is not None and hasattr(self.sh_db, '_engine'):
+            # Replicas must not share the connections to SortingHat
+            self.sh_db._engine.dispose()
+
+        workers = self.enrich_workers
+        logger.info("Enriching items with %i processes", workers)
+
+        _enricher = self
+        pool = multiprocessing.get_context('fork').Pool(workers, initializer=_init_enrich_worker)
+        _enricher = None
+
+        # Batches sent to the pool and not collected yet
+        pending = deque()
+        max_pending = 2 * workers
+
+        def collect():
+            result, nitems = pending.popleft()
+            rich_docs, updates, worker_metrics = result.get()
+            self.add_enrich_updates(updates)
+            metrics.merge(worker_metrics)
+            for rich_doc in rich_docs:
+                yield rich_doc
+            self.enriched_items += nitems
 
-        return total
+        try:
+            batch = []
+            for item in items:
+                batch.append(item)
+                if len(batch) >= self.enrich_batch_size:
+                    pending.append((pool.apply_async(_enrich_batch, (batch, events)), len(batch)))
+                    batch = []
+                    if len(pending) >= max_pending:
+                        for rich_doc in collect():
+                            yield rich_doc
+            if batch:
+                pending.append((pool.apply_async(_enrich_batch, (batch, events)), len(batch)))
+
+            while pending:
+                for rich_doc in collect():
+                    yield rich_doc
+
+            pool.close()
+        finally:
+            # Stop the workers also if enrichment is stopped before the end
+            pool.terminate()
+            pool.join()
+
+    def init_enrich_worker(self):
+        """ Prepare a replica of the enricher in a worker process """
+
+        # Connections to services must not be shared with other processes
+        self.requests = get_grimoire_con()
+        if self.elastic:
+            self.elastic.requests = get_grimoire_con()
+
+        # Only the metrics of the worker are sent to the main process
+        metrics.pop()
+
+    def get_enrich_updates(self):
+        """ Data found by a replica of the enricher, like new cache entries
+        or counters, since the last call. It is sent to the main enricher. """
+        return None
+
+    def add_enrich_updates(self, updates):
+        """ Merge the data found by a replica of the enricher """
+        pass
 
     def get_connector_name(self):
         """ Find the name for the current connector """
@@ -386,6 +499,11 @@ class Enrich(ElasticItems):
         """ Return the identities from an item """
         raise NotImplementedError
 
+    def close_identities(self):
+        """ Called once the identities of all the items have been got,
+        to finish the work done in background for them """
+        pass
+
     def get_email_domain(self, email):
         domain = None
         try:
@@ -454,7 +572,7 @@ class Enrich(ElasticItems):
 
         grimoire_date = None
         try:
-            grimoire_date = parser.parse(creation_date).isoformat()
+            grimoire_date = parse_date_iso(creation_date)
         except Exception as ex:
             pass
 
@@ -474,6 +592,14 @@ class Enrich(ElasticItems):
         """
         return ''
 
+    def get_project_repository_fields(self):
+        """
+            Fields of the enriched items used to find their project. All
+            the items with the same values in them have the same project.
+            None if the project can't be found from a fixed set of fields.
+        """
+        return ['origin']
+
     @classmethod
     def add_project_levels(cls, project):
         """ Add project sub levels extra items """
@@ -491,11 +617,50 @@ class Enrich(ElasticItems):
 
         return eitem_project_levels
 
-    def get_item_project(self, eitem):
-        """ Get project mapping enrichment field """
-        eitem_project = {}
-        ds_name = self.get_connector_name()  # data source name in projects map
-        repository = self.get_project_repository(eitem)
+    def get_project_fields(self, project):
+        """ Project field and its levels for a project. They are the same
+        for all the items of a project, so they are computed only once """
+
+        if project is None:
+            project = DEFAULT_PROJECT
+
+        if project not in self.prjs_fields:
+            eitem_project = {"project": project}
+            # Time to add the project levels: eclipse.platform.releng.aggregator
+            eitem_project.update(self.add_project_levels(project))
+            self.prjs_fields[project] = eitem_project
+
+        return dict(self.prjs_fields[project])
+
+    def find_origin_project(self, ds_name, origin):
+        """ Project of the first repository of ds_name which contains origin
+
+        All the repositories are joined in one string, so the search is done
+        with only one find instead of checking each repository.
+        """
+
+        if ds_name not in self.prjs_index:
+            repos = []
+            starts = []  # position of each repository in the joined string
+            pos = 0
+            for ds_repo in self.prjs_map[ds_name]:
+                ds_repo = str(ds_repo)  # discourse has category_id ints
+                repos.append(ds_repo)
+                starts.append(pos)
+                pos += len(ds_repo) + 1
+            self.prjs_index[ds_name] = ("\0".join(repos), starts,
+                                        list(self.prjs_map[ds_name].values()))
+
+        repos, starts, projects = self.prjs_index[ds_name]
+        pos = repos.find(origin)
+        if pos < 0:
+            return None
+
+        return projects[bisect.bisect_right(starts, pos) - 1]
+
+    def find_item_project(self, ds_name, repository, origin):
+        """ Project for the repository or, if not mapped, for the origin """
+
         try:
             project = (self.prjs_map[ds_name][repository])
             # logger.debug("Project FOUND for repository %s %s", repository, project)
@@ -503,25 +668,32 @@ class Enrich(ElasticItems):
             # logger.warning("Project not found for repository %s (data source: %s)", repository, ds_name)
             project = None
             # Try to use always the origin in any case
-            if 'origin' in eitem:
-                if ds_name in self.prjs_map and eitem['origin'] in self.prjs_map[ds_name]:
-                    project = self.prjs_map[ds_name][eitem['origin']]
-                elif ds_name in self.prjs_map:
+            if origin is not None and ds_name in self.prjs_map:
+                if origin in self.prjs_map[ds_name]:
+                    project = self.prjs_map[ds_name][origin]
+                else:
                     # Try to find origin as part of the keys
-                    for ds_repo in self.prjs_map[ds_name]:
-                        ds_repo = str(ds_repo)  # discourse has category_id ints
-                        if eitem['origin'] in ds_repo:
-                            project = self.prjs_map[ds_name][ds_repo]
-                            break
+                    project = self.find_origin_project(ds_name, origin)
 
-        if project is None:
-            project = DEFAULT_PROJECT
+        return project
+
+    def get_item_project(self, eitem):
+        """ Get project mapping enrichment field """
 
-        eitem_project = {"project": project}
-        # Time to add the project levels: eclipse.platform.releng.aggregator
-        eitem_project.update(self.add_project_levels(project))
+        ds_name = self.get_connector_name()  # data source name in projects map
+        repository = self.get_project_repository(eitem)
+        origin = eitem.get('origin')
+
+        # All the items of a repository have the same project
+        key = (repository, origin)
+        if key not in self.prjs_cache:
+            metrics.inc("project_lookups", result="miss")
+            with metrics.timer("project_find"):
+                self.prjs_cache[key] = self.find_item_project(ds_name, repository, origin)
+        else:
+            metrics.inc("project_lookups", result="hit")
 
-        return eitem_project
+        return self.get_project_fields(self.prjs_cache[key])
 
     # Sorting Hat stuff to be moved to SortingHat class
 
@@ -543,7 +715,131 @@ class Enrich(ElasticItems):
                 pass
         return domain
 
+    def get_sh_identities(self, item):
+        """ Identities of an item to be resolved in bulk before enriching it """
+        return self.get_identities(item)
+
+    def prefetch_sh_identities(self, items):
+        """ Generate the items resolving the SortingHat data of the identities
+        in each window of sh_window_size items with a few bulk queries """
+
+        if not self.sortinghat:
+            for item in items:
+                yield item
+            return
+
+        window = []
+        for item in items:
+            window.append(item)
+            if len(window) >= self.sh_window_size:
+                self.resolve_sh_identities(window)
+                for witem in window:
+                    yield witem
+                window = []
+
+        if window:
+            self.resolve_sh_identities(window)
+            for witem in window:
+                yield witem
+
+    def resolve_sh_identities(self, items):
+        """ Get the SortingHat uuid, profile, enrollments and bot flag for all
+        the identities in items. Identities not found are resolved one by one
+        when they are enriched. """
+
+        if self.get_sh_snapshot():
+            # All the data is already in memory
+            return
+
+        backend_name = self.get_connector_name()
+
+        if len(self.sh_ids) > self.sh_cache_size:
+            self.sh_ids = {}
+            self.sh_uuids = {}
+            self.sh_uuids_data = {}
+
+        ids = {}
+        for item in items:
+            for identity in self.get_sh_identities(item):
+                key = self.__get_sh_key(identity, backend_name)
+                if key in self.sh_ids or key in ids:
+                    continue
+                try:
+                    ids[key] = utils.uuid(backend_name, email=key[1],
+                                          name=key[2], username=key[3])
+                except ValueError:
+                    # Empty identity, not in SortingHat
+                    continue
+
+        if not ids:
+            return
+
+        try:
+            start = time()
+            uuids = SortingHat.get_uuids_from_ids(self.sh_db, ids.values())
+            new_uuids = set(uuids.values()) - set(self.sh_uuids_data)
+            profiles = SortingHat.get_profiles(self.sh_db, new_uuids)
+            enrollments = SortingHat.get_enrollments(self.sh_db, new_uuids)
+            metrics.observe("sh_resolve", time() - start)
+        except Exception as ex:
+            logger.warning("Can't resolve SortingHat identities in bulk: %s", ex)
+            return
+
+        for key, sh_id in ids.items():
+            if sh_id in uuids:
+                self.sh_ids[key] = {"id": sh_id, "uuid": uuids[sh_id]}
+                self.sh_uuids[sh_id] = uuids[sh_id]
+
+        for uuid in new_uuids:
+            profile = {}
+            bot = False
+            if uuid in profiles:
+                profile = {"name": profiles[uuid]['name'],
+                           "email": profiles[uuid]['email']}
+                bot = profiles[uuid]['is_bot']
+            self.sh_uuids_data[uuid] = {
+                "profile": profile,
+                "bot": bot,
+                "enrollments": enrollments.get(uuid, [])
+            }
+
+        logger.debug("SortingHat identities resolved in bulk: %i of %i", len(uuids), len(ids))
+
+    def get_sh_snapshot(self):
+        """ SortingHat snapshot, loaded the first time it is used, if
+        use_sh_snapshot is enabled. Its version is checked every
+        sh_snapshot_check seconds and it is reloaded if it has changed. """
+
+        if not self.use_sh_snapshot or not self.sortinghat:
+            return None
+
+        snapshot = Enrich.sh_snapshot
+        if snapshot is None or snapshot.db is not self.sh_db:
+            snapshot = SortingHatSnapshot(self.sh_db)
+            with metrics.timer("sh_snapshot_load"):
+                snapshot.load()
+            Enrich.sh_snapshot = snapshot
+        elif time() - snapshot.checked > self.sh_snapshot_check:
+            with metrics.timer("sh_snapshot_update"):
+                snapshot.update()
+
+        return snapshot
+
+    @staticmethod
+    def __get_sh_key(identity, backend_name):
+        return (backend_name, identity.get('email'), identity.get('name'), identity.get('username'))
+
     def is_bot(self, uuid):
+        snapshot = self.get_sh_snapshot()
+        if snapshot:
+            metrics.inc("sh_lookups", lookup="bot", result="hit")
+            return snapshot.is_bot(uuid)
+
+        if uuid in self.sh_uuids_data:
+            metrics.inc("sh_lookups", lookup="bot", result="hit")
+            return self.sh_uuids_data[uuid]['bot']
+
+        metrics.inc("sh_lookups", lookup="bot", result="miss")
         bot = False
         u = self.get_unique_identity(uuid)
         if u.profile:
@@ -556,16 +852,27 @@ class Enrich(ElasticItems):
         if item_date and item_date.tzinfo:
             item_date = (item_date - item_date.utcoffset()).replace(tzinfo=None)
 
-        enrollments = self.get_enrollments(uuid)
+        snapshot = self.get_sh_snapshot()
+        if snapshot:
+            metrics.inc("sh_lookups", lookup="enrollment", result="hit")
+            return snapshot.get_enrollment(uuid, item_date, self.unaffiliated_group)
+
+        if uuid in self.sh_uuids_data:
+            metrics.inc("sh_lookups", lookup="enrollment", result="hit")
+            enrollments = self.sh_uuids_data[uuid]['enrollments']
+        else:
+            metrics.inc("sh_lookups", lookup="enrollment", result="miss")
+            enrollments = [(enrollment.start, enrollment.end, enrollment.organization.name)
+                           for enrollment in self.get_enrollments(uuid)]
+
         enroll = self.unaffiliated_group
-        if len(enrollments) > 0:
-            for enrollment in enrollments:
-                if not item_date:
-                    enroll = enrollment.organization.name
-                    break
-                elif item_date >= enrollment.start and item_date <= enrollment.end:
-                    enroll = enrollment.organization.name
-                    break
+        for start, end, org_name in enrollments:
+            if not item_date:
+                enroll = org_name
+                break
+            elif item_date >= start and item_date <= end:
+                enroll = org_name
+                break
         return enroll
 
     def __get_item_sh_fields_empty(self, rol):
@@ -622,6 +929,16 @@ class Enrich(ElasticItems):
         return eitem_sh
 
     def get_profile_sh(self, uuid):
+        snapshot = self.get_sh_snapshot()
+        if snapshot:
+            metrics.inc("sh_lookups", lookup="profile", result="hit")
+            return snapshot.get_profile(uuid)
+
+        if uuid in self.sh_uuids_data:
+            metrics.inc("sh_lookups", lookup="profile", result="hit")
+            return self.sh_uuids_data[uuid]['profile']
+
+        metrics.inc("sh_lookups", lookup="profile", result="miss")
         profile = {}
 
         u = self.get_unique_identity(uuid)
@@ -644,7 +961,7 @@ class Enrich(ElasticItems):
         if not roles:
             roles = [author_field]
 
-        date = parser.parse(eitem[self.get_field_date()])
+        date = parse_date(eitem[self.get_field_date()])
 
         for rol in roles:
             if rol + "_id" not in eitem:
@@ -693,9 +1010,9 @@ class Enrich(ElasticItems):
             roles = [author_field]
 
         if not date_field:
-            item_date = parser.parse(item[self.get_field_date()])
+            item_date = parse_date(item[self.get_field_date()])
         else:
-            item_date = parser.parse(item[date_field])
+            item_date = parse_date(item[date_field])
 
         users_data = self.get_users_data(item)
 
@@ -720,13 +1037,44 @@ class Enrich(ElasticItems):
     def get_unique_identity(self, uuid):
         return api.unique_identities(self.sh_db, uuid)[0]
 
-    @lru_cache()
     def get_uuid_from_id(self, sh_id):
         """ Get the SH identity uuid from the id """
+        snapshot = self.get_sh_snapshot()
+        if snapshot:
+            metrics.inc("sh_lookups", lookup="uuid", result="hit")
+            return snapshot.get_uuid(sh_id)
+
+        if sh_id in self.sh_uuids:
+            metrics.inc("sh_lookups", lookup="uuid", result="hit")
+            return self.sh_uuids[sh_id]
+
+        metrics.inc("sh_lookups", lookup="uuid", result="miss")
+        return self.__get_uuid_from_id_cache(sh_id)
+
+    @lru_cache()
+    def __get_uuid_from_id_cache(self, sh_id):
         return SortingHat.get_uuid_from_id(self.sh_db, sh_id)
 
     def get_sh_ids(self, identity, backend_name):
         """ Return the Sorting Hat id and uuid for an identity """
+        key = self.__get_sh_key(identity, backend_name)
+        if key in self.sh_ids:
+            metrics.inc("sh_lookups", lookup="ids", result="hit")
+            return self.sh_ids[key]
+
+        snapshot = self.get_sh_snapshot()
+        if snapshot:
+            try:
+                sh_id = utils.uuid(backend_name, email=key[1], name=key[2], username=key[3])
+                if snapshot.get_uuid(sh_id):
+                    metrics.inc("sh_lookups", lookup="ids", result="hit")
+                    return {"id": sh_id, "uuid": snapshot.get_uuid(sh_id)}
+            except ValueError:
+                pass
+
+        # Identities not resolved in bulk are queried one by one
+        metrics.inc("sh_lookups", lookup="ids", result="miss")
+
         # Convert the dict to tuple so it is hashable
         identity_tuple = tuple(identity.items())
         sh_ids = self.__get_sh_ids_cache(identity_tuple, backend_name)
@@ -0,0 +1,205 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Geolocation of user locations with a cache stored in Elasticsearch
+#
+# Copyright (C) 2018 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+import hashlib
+import logging
+
+import requests
+
+from .bulk import BulkWriter
+from .study_state import scroll_docs
+from ..errors import ELKError
+
+
+logger = logging.getLogger(__name__)
+
+
+class MapsGeocoder():
+    """Geocoder using the Google Maps API"""
+
+    url = 'https://maps.googleapis.com/maps/api/geocode/json'
+
+    def __init__(self, requests):
+        self.requests = requests
+
+    def geocode(self, location):
+        """ Geo point for a location, None if it is not found
+
+        :raises ELKError: when the API fails or doesn't answer, like when
+            the quota is exceeded, so the location is not cached
+        """
+
+        params = {'sensor': 'false', 'address': location}
+
+        try:
+            logger.debug("Using Maps API to find %s" % (location))
+            r = self.requests.get(self.url, params=params)
+            r.raise_for_status()
+            res = r.json()
+        except (requests.exceptions.RequestException, ValueError) as ex:
+            raise ELKError(cause="Maps API failed for %s: %s" % (location, ex))
+
+        status = res.get('status')
+        if status == 'ZERO_RESULTS' or (status == 'OK' and not res.get('results')):
+            logger.debug("Can't find geocode for " + location)
+            return None
+        if status != 'OK':
+            raise ELKError(cause="Maps API status %s for %s" % (status, location))
+
+        geo_code = res['results'][0]['geometry']['location']
+
+        return {"lat": geo_code['lat'], "lon": geo_code['lng']}
+
+
+class LocalGeocoder():
+    """Geocoder for a fixed set of locations, which doesn't use any
+    external service. Useful when enriching offline or in tests.
+
+    :param geo_points: dict with the geo point for each location
+    """
+
+    def __init__(self, geo_points=None):
+        self.geo_points = geo_points or {}
+
+    def geocode(self, location):
+        return self.geo_points.get(location)
+
+
+class GeolocationCache():
+    """Geo points of the locations already geocoded, and locations which
+    can't be geocoded, stored in an Elasticsearch index.
+
+    The geocoder is only used for the locations which are not in the
+    cache. Only the entries added since the cache was loaded or saved
+    are written when it is saved. Locations the geocoder fails for are
+    not cached, so they are geocoded again later.
+
+    :param elastic: ElasticSearch object of the cluster with the cache
+    :param geocoder: object with a geocode(location) method, which
+        raises ELKError when it fails
+    :param index: index (and type) with the cache
+    """
+
+    def __init__(self, elastic, geocoder, index="github/geolocations"):
+        self.elastic = elastic
+        self.geocoder = geocoder
+        self.index = index.split("/")[0]
+        self.url = elastic.url + "/" + index
+
+        self.geo_points = {}  # location -> geo point
+        self.not_found = set()  # locations not found by the geocoder
+
+        self.new_geo_points = {}
+        self.new_not_found = set()
+
+    def load(self):
+        """ Read all the cache entries """
+
+        res = self.elastic.requests.head(self.url)
+        if res.status_code != 200:
+            logger.info("No geolocations data in %s", self.url)
+            return
+
+        for hit in scroll_docs(self.elastic, {"query": {"match_all": {}}}, self.url):
+            entry = hit['_source']
+            if entry.get('not_found'):
+                self.not_found.add(entry['location'])
+            else:
+                self.geo_points[entry['location']] = {"lat": entry['lat'], "lon": entry['lon']}
+
+        logger.debug("Geolocations loaded from %s: %i found, %i not found",
+                     self.url, len(self.geo_points), len(self.not_found))
+
+    def get_geo_point(self, location):
+        """ Geo point for location, geocoding it if it is not in the cache """
+
+        if location is None:
+            return None
+
+        if location in self.geo_points:
+            return dict(self.geo_points[location])
+
+        if location in self.not_found:
+            # Don't call the geocoder
+            return None
+
+        try:
+            geo_point = self.geocoder.geocode(location)
+        except ELKError as ex:
+            logger.warning("Can't geocode %s now: %s", location, ex)
+            return None
+        self.add(location, geo_point)
+
+        return geo_point
+
+    def add(self, location, geo_point):
+        """ Add a new entry, None geo_point if not found """
+
+        if geo_point:
+            self.geo_points[location] = geo_point
+            self.new_geo_points[location] = geo_point
+        else:
+            self.not_found.add(location)
+            self.new_not_found.add(location)
+
+    def get_new(self):
+        """ Entries added since the last call, to be merged in other cache
+        with add_new. They won't be saved by this cache. """
+
+        new = (self.new_geo_points, list(self.new_not_found))
+        self.new_geo_points = {}
+        self.new_not_found = set()
+
+        return new
+
+    def add_new(self, new):
+        """ Add the entries got with get_new from other cache """
+
+        geo_points, not_found = new
+        for location, geo_point in geo_points.items():
+            self.add(location, geo_point)
+        for location in not_found:
+            if location not in self.geo_points:
+                self.add(location, None)
+
+    def save(self):
+        """ Write the entries added since the last save """
+
+        if not self.new_geo_points and not self.new_not_found:
+            return 0
+
+        with BulkWriter(self.elastic, self.url + "/_bulk", index=self.index) as writer:
+            for location, geo_point in self.new_geo_points.items():
+                # Don't include in URL non ascii codes
+                safe_loc = str(location.encode('ascii', 'ignore'), 'ascii')
+                geo_id = "%s-%s-%s" % (geo_point["lat"], geo_point["lon"], safe_loc)
+                writer.add(dict(geo_point, location=location), geo_id)
+            for location in self.new_not_found:
+                loc_id = hashlib.sha1(location.encode('utf-8')).hexdigest()
+                writer.add({"location": location, "not_found": True}, "not_found-" + loc_id)
+
+        logger.debug("Geolocations added to %s: %i", self.url, writer.inserted)
+
+        self.new_geo_points = {}
+        self.new_not_found = set()
+
+        return writer.inserted
@@ -24,10 +24,10 @@
 #
 
 from datetime import datetime
-from dateutil import parser
 import logging
 import time
 
+from .dates import parse_date
 from .enrich import Enrich, metadata
 from ..elastic_mapping import Mapping as BaseMapping
 
@@ -108,6 +108,9 @@ class GerritEnrich(Enrich):
         repo += "_" + eitem['repository']
         return repo
 
+    def get_project_repository_fields(self):
+        return ['origin', 'repository']
+
     def get_identities(self, item):
         ''' Return the identities from an item '''
 
@@ -210,10 +213,10 @@ class GerritEnrich(Enrich):
         eitem["patchsets"] = len(review["patchSets"])
 
         # Time to add the time diffs
-        createdOn_date = parser.parse(review['createdOn'])
+        createdOn_date = parse_date(review['createdOn'])
         if len(review["patchSets"]) > 0:
-            createdOn_date = parser.parse(review["patchSets"][0]['createdOn'])
-        lastUpdated_date = parser.parse(review['lastUpdated'])
+            createdOn_date = parse_date(review["patchSets"][0]['createdOn'])
+        lastUpdated_date = parse_date(review['lastUpdated'])
         seconds_day = float(60 * 60 * 24)
         if eitem['status'] in ['MERGED', 'ABANDONED']:
             timeopen = \
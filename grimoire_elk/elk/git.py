@@ -22,17 +22,13 @@
 #   Alvaro del Castillo San Felix <acs@bitergia.com>
 #
 
-import json
 import logging
 import re
-import time
-import sys
-
-import requests
-
-from dateutil import parser
 
+from .dates import parse_date, to_utc_naive
 from .enrich import Enrich, metadata
+from .git_study_demography import demography
+from .github_logins import GitHubLogins
 from ..elastic_mapping import Mapping as BaseMapping
 
 try:
@@ -41,12 +37,8 @@ try:
 except ImportError:
     SORTINGHAT_LIBS = False
 
-# Mandatory in Elasticsearch 6, optional in earlier versions
-HEADER_JSON = {"Content-Type": "application/json"}
-
 GITHUB = 'https://github.com/'
 SH_GIT_COMMIT = 'github-commit'
-DEMOGRAPHY_COMMIT_MIN_DATE = '1980-01-01'
 logger = logging.getLogger(__name__)
 
 
@@ -105,16 +97,16 @@ class GitEnrich(Enrich):
 
         # GitHub API management
         self.github_token = None
-        self.github_logins = {}
-        self.github_logins_committer_not_found = 0
-        self.github_logins_author_not_found = 0
-        self.rate_limit = None
-        self.rate_limit_reset_ts = None
-        self.min_rate_to_sleep = 100  # if pending rate < 100 sleep
+        self.github_logins = None  # GitHubLogins resolving the logins in background
+        self.github_identities = {}  # users waiting for their login -> SH identity
         self.pair_programming = False
+        self.total_signed_off = 0  # commits generated for signed-off authors
+        self.total_multi_author = 0  # commits generated for multi authors
 
     def set_github_token(self, token):
         self.github_token = token
+        self.github_logins = GitHubLogins(self.elastic, token)
+        self.github_logins.load()
 
     def get_field_author(self):
         return "Author"
@@ -145,7 +137,7 @@ class GitEnrich(Enrich):
 
         return authors
 
-    def get_identities(self, item):
+    def get_identities(self, item, github_logins=True):
         """ Return the identities from an item.
             If the repo is in GitHub, get the usernames from GitHub. """
         identities = []
@@ -165,20 +157,19 @@ class GitEnrich(Enrich):
 
             # Try to get the identity from SH
             user_data = item['data'][user_field]
+            if user_data in self.github_identities:
+                # Already waiting for its login
+                return
             sh_identity = SortingHat.get_github_commit_username(self.sh_db, user, SH_GIT_COMMIT)
             if not sh_identity:
-                # Get the usename from GitHub
-                gh_username = self.get_github_login(user_data, rol, commit_hash, github_repo)
-                # Create a new SH identity with name, email from git and username from github
-                logger.debug("Adding new identity %s to SH %s: %s", gh_username, SH_GIT_COMMIT, user)
-                user = self.get_sh_identity(user_data)
-                user['username'] = gh_username
-                SortingHat.add_identity(self.sh_db, user, SH_GIT_COMMIT)
+                # Get the usename from GitHub, the SH identity is added once resolved
+                self.github_identities[user_data] = self.get_sh_identity(user_data)
+                resolved, gh_username = self.github_logins.lookup(user_data, rol, commit_hash, github_repo)
+                if resolved:
+                    self.__add_github_identity(user_data, gh_username)
             else:
-                if user_data not in self.github_logins:
-                    self.github_logins[user_data] = sh_identity['username']
-                    logger.debug("GitHub-commit exists. username:%s user:%s",
-                                 sh_identity['username'], user_data)
+                logger.debug("GitHub-commit exists. username:%s user:%s",
+                             sh_identity['username'], user_data)
 
         commit_hash = item['data']['commit']
 
@@ -193,7 +184,7 @@ class GitEnrich(Enrich):
             else:
                 user = self.get_sh_identity(item['data']["Author"])
                 identities.append(user)
-                if self.github_token:
+                if self.github_token and github_logins:
                     add_sh_github_identity(user, 'Author', 'author')
         if item['data']['Commit']:
             m = self.AUTHOR_P2P_REGEX.match(item['data']["Commit"])
@@ -205,7 +196,7 @@ class GitEnrich(Enrich):
             else:
                 user = self.get_sh_identity(item['data']['Commit'])
                 identities.append(user)
-                if self.github_token:
+                if self.github_token and github_logins:
                     add_sh_github_identity(user, 'Commit', 'committer')
         if 'Signed-off-by' in item['data'] and self.pair_programming:
             signers = item['data']["Signed-off-by"]
@@ -213,8 +204,39 @@ class GitEnrich(Enrich):
                 user = self.get_sh_identity(signer)
                 identities.append(user)
 
+        if self.github_token and github_logins:
+            for user_data, gh_username in self.github_logins.get_resolved():
+                self.__add_github_identity(user_data, gh_username)
+
         return identities
 
+    def close_identities(self):
+        """ Add to SH the GitHub identities still waiting for their login """
+
+        if not self.github_logins:
+            return
+
+        self.github_logins.close()
+        for user_data, gh_username in self.github_logins.get_resolved():
+            self.__add_github_identity(user_data, gh_username)
+        # Users whose login couldn't be got are looked up again next time
+        self.github_identities = {}
+        logger.debug("GitHub logins not found: %i authors %i committers",
+                     self.github_logins.authors_not_found,
+                     self.github_logins.committers_not_found)
+
+    def __add_github_identity(self, user_data, gh_username):
+        """ Create a new SH identity with name, email from git and username from github """
+
+        user = self.github_identities.pop(user_data)
+        user['username'] = gh_username
+        logger.debug("Adding new identity %s to SH %s: %s", gh_username, SH_GIT_COMMIT, user)
+        SortingHat.add_identity(self.sh_db, user, SH_GIT_COMMIT)
+
+    def get_sh_identities(self, item):
+        """ The GitHub logins were already added to SH when loading identities """
+        return self.get_identities(item, github_logins=False)
+
     def get_sh_identity(self, item, identity_field=None):
         # John Smith <john.smith@bitergia.com>
         identity = {}
@@ -238,74 +260,6 @@ class GitEnrich(Enrich):
     def get_project_repository(self, eitem):
         return eitem['origin']
 
-    def get_github_login(self, user, rol, commit_hash, repo):
-        """ rol: author or committer """
-        login = None
-        try:
-            login = self.github_logins[user]
-        except KeyError:
-            # Get the login from github API
-            GITHUB_API_URL = "https://api.github.com"
-            commit_url = GITHUB_API_URL + "/repos/%s/commits/%s" % (repo, commit_hash)
-            headers = {'Authorization': 'token ' + self.github_token}
-
-            r = self.requests.get(commit_url, headers=headers)
-
-            try:
-                r.raise_for_status()
-            except requests.exceptions.ConnectionError as ex:
-                # Connection error
-                logger.error("Can't get github login for %s in %s because a connection error ", repo, commit_hash)
-                return login
-
-            self.rate_limit = int(r.headers['X-RateLimit-Remaining'])
-            self.rate_limit_reset_ts = int(r.headers['X-RateLimit-Reset'])
-            logger.debug("Rate limit pending: %s", self.rate_limit)
-            if self.rate_limit <= self.min_rate_to_sleep:
-                seconds_to_reset = self.rate_limit_reset_ts - int(time.time()) + 1
-                if seconds_to_reset < 0:
-                    seconds_to_reset = 0
-                cause = "GitHub rate limit exhausted."
-                logger.info("%s Waiting %i secs for rate limit reset.", cause, seconds_to_reset)
-                time.sleep(seconds_to_reset)
-                # Retry once we have rate limit
-                r = self.requests.get(commit_url, headers=headers)
-
-            try:
-                r.raise_for_status()
-            except requests.exceptions.HTTPError as ex:
-                # commit not found probably or rate limit exhausted
-                logger.error("Can't find commit %s %s", commit_url, ex)
-                return login
-
-            commit_json = r.json()
-            author_login = None
-            if 'author' in commit_json and commit_json['author']:
-                author_login = commit_json['author']['login']
-            else:
-                self.github_logins_author_not_found += 1
-
-            user_login = None
-            if 'committer' in commit_json and commit_json['committer']:
-                user_login = commit_json['committer']['login']
-            else:
-                self.github_logins_committer_not_found += 1
-
-            if rol == "author":
-                login = author_login
-            elif rol == "committer":
-                login = user_login
-            else:
-                logger.error("Wrong rol: %s" % (rol))
-                raise RuntimeError
-
-            self.github_logins[user] = login
-            logger.debug("%s is %s in github (not found %i authors %i committers )", user, login,
-                         self.github_logins_author_not_found,
-                         self.github_logins_committer_not_found)
-
-        return login
-
     @metadata
     def get_rich_item(self, item):
 
@@ -335,12 +289,12 @@ class GitEnrich(Enrich):
                 eitem[map_fields[fn]] = None
         eitem['hash_short'] = eitem['hash'][0:6]
         # Enrich dates
-        author_date = parser.parse(commit["AuthorDate"])
-        commit_date = parser.parse(commit["CommitDate"])
+        author_date = parse_date(commit["AuthorDate"])
+        commit_date = parse_date(commit["CommitDate"])
         eitem["author_date"] = author_date.replace(tzinfo=None).isoformat()
         eitem["commit_date"] = commit_date.replace(tzinfo=None).isoformat()
-        eitem["utc_author"] = (author_date - author_date.utcoffset()).replace(tzinfo=None).isoformat()
-        eitem["utc_commit"] = (commit_date - commit_date.utcoffset()).replace(tzinfo=None).isoformat()
+        eitem["utc_author"] = to_utc_naive(author_date).isoformat()
+        eitem["utc_commit"] = to_utc_naive(commit_date).isoformat()
         eitem["tz"] = int(author_date.strftime("%z")[0:3])
         # Other enrichment
         eitem["repo_name"] = item["origin"]
@@ -457,252 +411,98 @@ class GitEnrich(Enrich):
         """ Implementation supporting signed-off and multiauthor/committer commits.
         """
 
-        headers = {"Content-Type": "application/json"}
-
-        max_items = self.elastic.max_items_bulk
-        current = 0
-        total = 0
-        bulk_json = ""
-
-        total_signed_off = 0
-        total_multi_author = 0
-
-        url = self.elastic.index_url + '/items/_bulk'
-
-        logger.debug("Adding items to %s (in %i packs)", url, max_items)
+        self.total_signed_off = 0
+        self.total_multi_author = 0
 
         items = ocean_backend.fetch()
 
-        for item in items:
-
-            if self.CLOUDFOUNDRY_URL in item['origin']:
-                self.pair_programming = True
-
-            if self.pair_programming:
-                # First we need to add the authors field to all commits
-                # Check multi author
-                m = self.AUTHOR_P2P_REGEX.match(item['data']['Author'])
-                if m:
-                    logger.debug("Multiauthor detected. Creating one commit " +
-                                 "per author: %s", item['data']['Author'])
-                    item['data']['authors'] = self.__get_authors(item['data']['Author'])
-                    item['data']['Author'] = item['data']['authors'][0]
-                m = self.AUTHOR_P2P_REGEX.match(item['data']['Commit'])
-                if m:
-                    logger.debug("Multicommitter detected: using just the first committer")
-                    item['data']['committers'] = self.__get_authors(item['data']['Commit'])
-                    item['data']['Commit'] = item['data']['committers'][0]
-                # Add the authors list using the original Author and the Signed-off list
-                if 'Signed-off-by' in item['data']:
-                    authors_all = item['data']['Signed-off-by'] + [item['data']['Author']]
-                    item['data']['authors_signed_off'] = list(set(authors_all))
-
-            if current >= max_items:
-                try:
-                    res = self.requests.put(url, data=bulk_json, headers=headers)
-                    res.raise_for_status()
-                    json_size = sys.getsizeof(bulk_json) / (1024 * 1024)
-                    logger.debug("Added %i items to %s (%0.2f MB)", total, url, json_size)
-                except UnicodeEncodeError:
-                    # Why is requests encoding the POST data as ascii?
-                    logger.error("Unicode error in enriched items")
-                    logger.debug(bulk_json)
-                    safe_json = str(bulk_json.encode('ascii', 'ignore'), 'ascii')
-                    self.requests.put(url, data=safe_json, headers=headers)
-                bulk_json = ""
-                current = 0
-
-            rich_item = self.get_rich_item(item)
-            data_json = json.dumps(rich_item)
-            unique_field = self.get_field_unique_id()
-            bulk_json += '{"index" : {"_id" : "%s" } }\n' % (rich_item[unique_field])
-            bulk_json += data_json + "\n"  # Bulk document
-            current += 1
-            total += 1
-
-            if self.pair_programming:
-                # Multi author support
-                if 'authors' in item['data']:
-                    # First author already added in the above commit
-                    authors = item['data']['authors']
-                    for i in range(1, len(authors)):
-                        # logger.debug('Adding a new commit for %s', authors[i])
-                        item['data']['Author'] = authors[i]
-                        item['data']['is_git_commit_multi_author'] = 1
-                        rich_item = self.get_rich_item(item)
-                        item['data']['is_git_commit_multi_author'] = 1
-                        data_json = json.dumps(rich_item)
-                        commit_id = item["uuid"] + "_" + str(i - 1)
-                        rich_item['git_uuid'] = commit_id
-                        bulk_json += '{"index" : {"_id" : "%s" } }\n' % rich_item['git_uuid']
-                        bulk_json += data_json + "\n"  # Bulk document
-                        current += 1
-                        total += 1
-                        total_multi_author += 1
-
-                if rich_item['Signed-off-by_number'] > 0:
-                    nsg = 0
-                    # Remove duplicates and the already added Author if exists
-                    authors = list(set(item['data']['Signed-off-by']))
-                    if item['data']['Author'] in authors:
-                        authors.remove(item['data']['Author'])
-                    for author in authors:
-                        # logger.debug('Adding a new commit for %s', author)
-                        # Change the Author in the original commit and generate
-                        # a new enriched item with it
-                        item['data']['Author'] = author
-                        item['data']['is_git_commit_signed_off'] = 1
-                        rich_item = self.get_rich_item(item)
-                        commit_id = item["uuid"] + "_" + str(nsg)
-                        rich_item['git_uuid'] = commit_id
-                        data_json = json.dumps(rich_item)
-                        bulk_json += '{"index" : {"_id" : "%s" } }\n' % rich_item['git_uuid']
-                        bulk_json += data_json + "\n"  # Bulk document
-                        current += 1
-                        total += 1
-                        total_signed_off += 1
-                        nsg += 1
-
-        if total == 0:
-            # No items enriched, nothing to upload to ES
-            return total
-
-        r = self.requests.put(url, data=bulk_json, headers=headers)
-        r.raise_for_status()
+        total = self.elastic.bulk_upload_docs(self.enrich_docs(items), checkpoint=self.enrich_checkpoint)
 
         if self.pair_programming:
-            logger.info("Signed-off commits generated: %i", total_signed_off)
-            logger.info("Multi author commits generated: %i", total_multi_author)
+            logger.info("Signed-off commits generated: %i", self.total_signed_off)
+            logger.info("Multi author commits generated: %i", self.total_multi_author)
 
         return total
 
-    def enrich_demography(self, enrich_backend, no_incremental=False):
+    def get_enrich_updates(self):
+        updates = {
+            "pair_programming": self.pair_programming,
+            "total_signed_off": self.total_signed_off,
+            "total_multi_author": self.total_multi_author
+        }
+        self.total_signed_off = 0
+        self.total_multi_author = 0
 
-        logger.info("Doing demography enrich for %s", self.elastic.index_url)
-        time.sleep(1)  # HACK: Wait until git enrich index has been written
+        return updates
 
-        date_field = self.get_incremental_date()
+    def add_enrich_updates(self, updates):
+        self.pair_programming = self.pair_programming or updates['pair_programming']
+        self.total_signed_off += updates['total_signed_off']
+        self.total_multi_author += updates['total_multi_author']
 
-        # Don't use commits before DEMOGRAPHY_COMMIT_MIN_DATE
-        filters = '''
-        {"range":
-            {"%s": {"gte": "%s"}}
-        }
-        ''' % (date_field, DEMOGRAPHY_COMMIT_MIN_DATE)
-
-        # Only commits not already processed by demography study so it
-        # must not contains the extra fields author_min_date/author_max_date
-        query = """
-        "query": {
-            "bool": {
-                "must": [%s],
-                "must_not": [
-                    {"exists": {
-                        "field": "author_min_date"
-                    }},
-                    {"exists": {
-                        "field": "author_max_date"
-                    }}
-                ]
-            }
-        },
-        """ % (filters)
-
-        # First, get the min and max commit date for all the authors
-        # Limit aggregations: https://github.com/elastic/elasticsearch/issues/18838
-        # 10000 seems to be a sensible number of the number of people in git
-        es_query = """
-        {
-          %s
-          "size": 0,
-          "aggs": {
-            "author": {
-              "terms": {
-                "field": "Author",
-                "size": 10000
-              },
-              "aggs": {
-                "min": {
-                  "min": {
-                    "field": "utc_commit"
-                  }
-                },
-                "max": {
-                  "max": {
-                    "field": "utc_commit"
-                  }
-                }
-              }
-            }
-          }
-        }
-        """ % (query)
-
-        logger.debug(es_query)
-
-        r = self.requests.post(self.elastic.index_url + "/_search",
-                               data=es_query, headers=HEADER_JSON,
-                               verify=False)
-        try:
-            r.raise_for_status()
-        except requests.exceptions.HTTPError as ex:
-            logger.error("Error getting authors mix and max date. Demography aborted.")
-            logger.error(ex)
-            return
+    def get_rich_item_docs(self, item):
+        """ Generate the (id, rich item) pairs for a commit, one per
+        author in multi author and signed-off commits """
+
+        if self.CLOUDFOUNDRY_URL in item['origin']:
+            self.pair_programming = True
 
-        authors = r.json()['aggregations']['author']['buckets']
-
-        author_items = []  # items from author with new date fields added
-        nauthors_done = 0
-        author_query = """
-        {
-            "query": {
-                "bool": {
-                    "must": [
-                        {"term":
-                            { "Author" : ""  }
-                        }
-                        ]
-                }
-            }
+        if self.pair_programming:
+            # First we need to add the authors field to all commits
+            # Check multi author
+            m = self.AUTHOR_P2P_REGEX.match(item['data']['Author'])
+            if m:
+                logger.debug("Multiauthor detected. Creating one commit " +
+                             "per author: %s", item['data']['Author'])
+                item['data']['authors'] = self.__get_authors(item['data']['Author'])
+                item['data']['Author'] = item['data']['authors'][0]
+            m = self.AUTHOR_P2P_REGEX.match(item['data']['Commit'])
+            if m:
+                logger.debug("Multicommitter detected: using just the first committer")
+                item['data']['committers'] = self.__get_authors(item['data']['Commit'])
+                item['data']['Commit'] = item['data']['committers'][0]
+            # Add the authors list using the original Author and the Signed-off list
+            if 'Signed-off-by' in item['data']:
+                authors_all = item['data']['Signed-off-by'] + [item['data']['Author']]
+                item['data']['authors_signed_off'] = list(set(authors_all))
+
+        rich_item = self.get_rich_item(item)
+        unique_field = self.get_field_unique_id()
+        yield rich_item[unique_field], rich_item
 
-        }
-        """
-        author_query_json = json.loads(author_query)
-
-        for author in authors:
-            # print("%s: %s %s" % (author['key'], author['min']['value_as_string'], author['max']['value_as_string']))
-            # Time to add all the commits (items) from this author
-            author_query_json['query']['bool']['must'][0]['term']['Author'] = author['key']
-            author_query_str = json.dumps(author_query_json)
-            r = self.requests.post(self.elastic.index_url + "/_search?size=10000",
-                                   data=author_query_str, headers=HEADER_JSON,
-                                   verify=False)
-
-            if "hits" not in r.json():
-                logger.error("Can't find commits for %s", author['key'])
-                logger.error(r.json())
-                logger.error(author_query)
-                continue
-            for item in r.json()["hits"]["hits"]:
-                new_item = item['_source']
-                new_item["author_max_date"] = author['max']['value_as_string']
-                if "author_min_date" not in new_item or not new_item['author_min_date']:
-                    new_item["author_min_date"] = author['min']['value_as_string']
-                # In p2p the ids are created during enrichment
-                new_item["_item_id"] = item['_id']
-                author_items.append(new_item)
-
-            if len(author_items) >= self.elastic.max_items_bulk:
-                self.elastic.bulk_upload(author_items, "_item_id")
-                author_items = []
-
-            nauthors_done += 1
-            logger.debug("%s: %s %s", author['key'],
-                         author['min']['value_as_string'],
-                         author['max']['value_as_string'])
-            logger.info("Authors processed %i/%i", nauthors_done, len(authors))
-
-        self.elastic.bulk_upload(author_items, "_item_id")
-
-        logger.debug("Completed demography enrich from %s" % (self.elastic.index_url))
+        if self.pair_programming:
+            # Multi author support
+            if 'authors' in item['data']:
+                # First author already added in the above commit
+                authors = item['data']['authors']
+                for i in range(1, len(authors)):
+                    # logger.debug('Adding a new commit for %s', authors[i])
+                    item['data']['Author'] = authors[i]
+                    item['data']['is_git_commit_multi_author'] = 1
+                    rich_item = self.get_rich_item(item)
+                    # The docs of the other authors keep the git_uuid of the commit
+                    commit_id = item["uuid"] + "_" + str(i - 1)
+                    yield commit_id, rich_item
+                    self.total_multi_author += 1
+
+            if rich_item['Signed-off-by_number'] > 0:
+                nsg = 0
+                # Remove duplicates and the already added Author if exists
+                authors = list(set(item['data']['Signed-off-by']))
+                if item['data']['Author'] in authors:
+                    authors.remove(item['data']['Author'])
+                for author in authors:
+                    # logger.debug('Adding a new commit for %s', author)
+                    # Change the Author in the original commit and generate
+                    # a new enriched item with it
+                    item['data']['Author'] = author
+                    item['data']['is_git_commit_signed_off'] = 1
+                    rich_item = self.get_rich_item(item)
+                    commit_id = item["uuid"] + "_" + str(nsg)
+                    rich_item['git_uuid'] = commit_id
+                    yield rich_item['git_uuid'], rich_item
+                    self.total_signed_off += 1
+                    nsg += 1
+
+    def enrich_demography(self, enrich_backend, no_incremental=False):
+        demography(self, no_incremental)
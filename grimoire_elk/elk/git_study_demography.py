@@ -0,0 +1,237 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Demography study for git enriched indexes
+#
+# Copyright (C) 2018 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+import json
+import logging
+
+import requests
+
+from .study_state import StudyState, scroll_docs
+
+logger = logging.getLogger(__name__)
+
+HEADER_JSON = {"Content-Type": "application/json"}
+
+DEMOGRAPHY_COMMIT_MIN_DATE = '1980-01-01'
+DEMOGRAPHY_STUDY = 'demography'
+
+# Authors in each page of the composite aggregation
+AUTHORS_PAGE_SIZE = 1000
+# Max number of authors in ES < 6, which don't support composite aggregations
+# https://github.com/elastic/elasticsearch/issues/18838
+MAX_AUTHORS_TERMS = 10000
+
+
+def get_bucket_state(bucket):
+    """ State of an author from the bucket with the min and max dates of
+    its commits """
+
+    return {
+        "min": bucket['min']['value'],
+        "min_date": bucket['min']['value_as_string'],
+        "max": bucket['max']['value'],
+        "max_date": bucket['max']['value_as_string']
+    }
+
+
+def merge_states(state, new_state):
+    """ State with the min and max dates of both states """
+
+    merged = dict(state)
+    if new_state['min'] < state['min']:
+        merged['min'] = new_state['min']
+        merged['min_date'] = new_state['min_date']
+    if new_state['max'] > state['max']:
+        merged['max'] = new_state['max']
+        merged['max_date'] = new_state['max_date']
+
+    return merged
+
+
+def demography(enrich, no_incremental=False):
+
+    """ Demography study: first and last commit date for each author.
+
+    The min and max commit date of each author are kept in the study state,
+    so only the commits not processed yet are aggregated. The commits of
+    the authors whose dates change are updated with partial bulk updates.
+    """
+
+    def get_date_filter():
+        # Don't use commits before DEMOGRAPHY_COMMIT_MIN_DATE
+        return {"range": {enrich.get_incremental_date(): {"gte": DEMOGRAPHY_COMMIT_MIN_DATE}}}
+
+    def get_new_commits_filter():
+        # Commits not already processed by the study don't have the
+        # author_min_date/author_max_date fields
+        return {"bool": {"must_not": [{"exists": {"field": "author_min_date"}},
+                                      {"exists": {"field": "author_max_date"}}]}}
+
+    def get_dates_aggs():
+        return {
+            "min": {"min": {"field": "utc_commit"}},
+            "max": {"max": {"field": "utc_commit"}}
+        }
+
+    def search(query):
+        res = enrich.requests.post(enrich.elastic.index_url + "/_search", data=json.dumps(query),
+                                   headers=HEADER_JSON, verify=False)
+        res.raise_for_status()
+        return res.json()
+
+    def get_authors_pages():
+        """ Pages of author buckets with the min and max dates of their commits """
+
+        query_filter = [get_date_filter()]
+        if not no_incremental:
+            query_filter.append(get_new_commits_filter())
+
+        query = {
+            "query": {"bool": {"filter": query_filter}},
+            "size": 0
+        }
+
+        if enrich.elastic.major in ['2', '5']:
+            query["aggs"] = {
+                "author": {
+                    "terms": {"field": "Author", "size": MAX_AUTHORS_TERMS},
+                    "aggs": get_dates_aggs()
+                }
+            }
+            buckets = search(query)['aggregations']['author']['buckets']
+            if len(buckets) >= MAX_AUTHORS_TERMS:
+                logger.warning("Demography limited to %i authors in %s", MAX_AUTHORS_TERMS,
+                               enrich.elastic.index_url)
+            yield [(bucket['key'], bucket) for bucket in buckets]
+            return
+
+        composite = {
+            "size": AUTHORS_PAGE_SIZE,
+            "sources": [{"author": {"terms": {"field": "Author"}}}]
+        }
+        query["aggs"] = {
+            "authors": {
+                "composite": composite,
+                "aggs": get_dates_aggs()
+            }
+        }
+
+        while True:
+            authors = search(query)['aggregations']['authors']
+            buckets = authors['buckets']
+            if not buckets:
+                break
+            yield [(bucket['key']['author'], bucket) for bucket in buckets]
+            # after_key is only returned since ES 6.3
+            composite['after'] = authors.get('after_key', buckets[-1]['key'])
+
+    def get_authors_dates(authors):
+        """ Min and max dates of all the commits of authors """
+
+        query = {
+            "query": {
+                "bool": {
+                    "filter": [get_date_filter(), {"terms": {"Author": authors}}]
+                }
+            },
+            "size": 0,
+            "aggs": {
+                "author": {
+                    "terms": {"field": "Author", "size": len(authors)},
+                    "aggs": get_dates_aggs()
+                }
+            }
+        }
+
+        buckets = search(query)['aggregations']['author']['buckets']
+
+        return {bucket['key']: get_bucket_state(bucket) for bucket in buckets}
+
+    def update_commits(new_authors, changed_authors, states):
+        """ Add the author dates to the new commits of new_authors and
+        to all the commits of changed_authors """
+
+        should = [{"terms": {"Author": changed_authors}}] if changed_authors else []
+        if not no_incremental:
+            should.append({"bool": {"filter": [{"terms": {"Author": new_authors}},
+                                               get_new_commits_filter()]}})
+
+        query = {
+            "query": {
+                "bool": {
+                    "filter": [get_date_filter()],
+                    "should": should,
+                    "minimum_should_match": 1
+                }
+            },
+            "_source": ["Author"]
+        }
+
+        with enrich.elastic.bulk_writer() as writer:
+            for hit in scroll_docs(enrich.elastic, query):
+                state = states[hit['_source']['Author']]
+                doc = {
+                    "author_min_date": state['min_date'],
+                    "author_max_date": state['max_date']
+                }
+                writer.add({"doc": doc}, hit['_id'], action="update")
+
+        return writer.inserted
+
+    logger.info("Doing demography enrich for %s", enrich.elastic.index_url)
+
+    study_state = StudyState(enrich.elastic, DEMOGRAPHY_STUDY)
+
+    nauthors = 0
+    ncommits = 0
+    try:
+        for page in get_authors_pages():
+            authors = [author for author, _ in page]
+            states = {} if no_incremental else study_state.get(authors)
+
+            # Authors without state, i.e. processed before the state was
+            # stored, need the dates of all their commits
+            missing = [author for author in authors if author not in states]
+            if missing and not no_incremental:
+                states.update(get_authors_dates(missing))
+            missing = set(missing)
+
+            changed = []
+            for author, bucket in page:
+                new_state = get_bucket_state(bucket)
+                state = merge_states(states[author], new_state) if author in states else new_state
+                if author in missing or state != states[author]:
+                    changed.append(author)
+                states[author] = state
+
+            ncommits += update_commits(authors, changed, states)
+            study_state.set({author: states[author] for author in authors})
+
+            nauthors += len(authors)
+            logger.info("Authors processed %i (%i with new dates)", nauthors, len(changed))
+    except requests.exceptions.HTTPError as ex:
+        logger.error("Error getting authors min and max date. Demography aborted.")
+        logger.error(ex)
+        return
+
+    logger.debug("Completed demography enrich from %s (%i commits updated)",
+                 enrich.elastic.index_url, ncommits)
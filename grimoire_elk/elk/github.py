@@ -23,7 +23,6 @@
 #   Alvaro del Castillo San Felix <acs@bitergia.com>
 #
 
-import json
 import logging
 import re
 
@@ -32,6 +31,7 @@ from datetime import datetime
 from .utils import get_time_diff_days
 
 from .enrich import Enrich, metadata
+from .geolocation import GeolocationCache, MapsGeocoder
 from ..elastic_mapping import Mapping as BaseMapping
 
 
@@ -94,18 +94,22 @@ class GitHubEnrich(Enrich):
 
     roles = ['assignee_data', 'user_data']
 
+    # Geocoder for the locations not in the cache, Google Maps if None
+    geocoder = None
+
     def __init__(self, db_sortinghat=None, db_projects_map=None, json_projects_map=None,
                  db_user='', db_password='', db_host=''):
         super().__init__(db_sortinghat, db_projects_map, json_projects_map,
                          db_user, db_password, db_host)
         self.users = {}  # cache users
         self.location = {}  # cache users location
-        self.location_not_found = []  # location not found in map api
+        self.geolocations = None  # cache of geolocations, stored in ES
 
     def set_elastic(self, elastic):
         self.elastic = elastic
         # Recover cache data from Elastic
-        self.geolocations = self.geo_locationsfrom__es()
+        self.geolocations = GeolocationCache(elastic, self.geocoder or MapsGeocoder(self.requests))
+        self.geolocations.load()
 
     def get_field_author(self):
         return "user_data"
@@ -151,108 +155,14 @@ class GitHubEnrich(Enrich):
         return identity
 
     def get_geo_point(self, location):
-        geo_point = geo_code = None
-
-        if location is None:
-            return geo_point
-
-        if location in self.geolocations:
-            geo_location = self.geolocations[location]
-            geo_point = {"lat": geo_location['lat'],
-                         "lon": geo_location['lon']
-                         }
-
-        elif location in self.location_not_found:
-            # Don't call the API.
-            pass
-
-        else:
-            url = 'https://maps.googleapis.com/maps/api/geocode/json'
-            params = {'sensor': 'false', 'address': location}
-            r = self.requests.get(url, params=params)
-
-            try:
-                logger.debug("Using Maps API to find %s" % (location))
-                r_json = r.json()
-                geo_code = r_json['results'][0]['geometry']['location']
-            except Exception:
-                if location not in self.location_not_found:
-                    logger.debug("Can't find geocode for " + location)
-                    self.location_not_found.append(location)
-
-            if geo_code:
-                geo_point = {
-                    "lat": geo_code['lat'],
-                    "lon": geo_code['lng']
-                }
-                self.geolocations[location] = geo_point
-
-        return geo_point
-
-    def get_github_cache(self, kind, key_):
-        """ Get cache data for items of _type using key_ as the cache dict key """
-
-        cache = {}
-        res_size = 100  # best size?
-        from_ = 0
-
-        index_github = "github/" + kind
-
-        url = self.elastic.url + "/" + index_github
-        url += "/_search" + "?" + "size=%i" % res_size
-        r = self.requests.get(url)
-        type_items = r.json()
-
-        if 'hits' not in type_items:
-            logger.info("No github %s data in ES" % (kind))
-
-        else:
-            while len(type_items['hits']['hits']) > 0:
-                for hit in type_items['hits']['hits']:
-                    item = hit['_source']
-                    cache[item[key_]] = item
-                from_ += res_size
-                r = self.requests.get(url + "&from=%i" % from_)
-                type_items = r.json()
-                if 'hits' not in type_items:
-                    break
-
-        return cache
-
-    def geo_locationsfrom__es(self):
-        return self.get_github_cache("geolocations", "location")
+        if not self.geolocations:
+            # No cache without Elasticsearch
+            return None
+        return self.geolocations.get_geo_point(location)
 
     def geo_locations_to_es(self):
-        max_items = self.elastic.max_items_bulk
-        current = 0
-        bulk_json = ""
-
-        url = self.elastic.url + "/github/geolocations/_bulk"
-
-        logger.debug("Adding geoloc to %s (in %i packs)" % (url, max_items))
-
-        for loc in self.geolocations:
-            if current >= max_items:
-                self.requests.put(url, data=bulk_json)
-                bulk_json = ""
-                current = 0
-
-            geopoint = self.geolocations[loc]
-            location = geopoint.copy()
-            location["location"] = loc
-            # First upload the raw issue data to ES
-            data_json = json.dumps(location)
-            # Don't include in URL non ascii codes
-            safe_loc = str(loc.encode('ascii', 'ignore'), 'ascii')
-            geo_id = str("%s-%s-%s" % (location["lat"], location["lon"],
-                                       safe_loc))
-            bulk_json += '{"index" : {"_id" : "%s" } }\n' % (geo_id)
-            bulk_json += data_json + "\n"  # Bulk document
-            current += 1
-
-        self.requests.put(url, data=bulk_json)
-
-        logger.debug("Adding geoloc to ES Done")
+        """ Store the geolocations found since the last time """
+        self.geolocations.save()
 
     def get_project_repository(self, eitem):
         repo = eitem['origin']
@@ -364,6 +274,23 @@ class GitHubEnrich(Enrich):
 
         return rich_issue
 
+    def init_enrich_worker(self):
+        super().init_enrich_worker()
+        if self.geolocations and not self.geocoder:
+            self.geolocations.geocoder = MapsGeocoder(self.requests)
+
+    def get_enrich_updates(self):
+        updates = {
+            "geolocations": self.geolocations.get_new() if self.geolocations else None
+        }
+
+        return updates
+
+    def add_enrich_updates(self, updates):
+        # Geolocations found by the replicas are stored with the rest in ES
+        if self.geolocations:
+            self.geolocations.add_new(updates['geolocations'])
+
     def enrich_items(self, items):
         total = super(GitHubEnrich, self).enrich_items(items)
 
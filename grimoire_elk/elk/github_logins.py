@@ -0,0 +1,269 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# GitHub logins of git authors and committers
+#
+# Copyright (C) 2018 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+import hashlib
+import json
+import logging
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from time import sleep
+
+import requests
+
+from .bulk import BulkWriter
+from .dates import parse_date_utc
+from .study_state import scroll_docs
+from .utils import get_grimoire_con
+from ..errors import ELKError
+
+
+logger = logging.getLogger(__name__)
+
+COMMIT_FIELDS = "... on Commit { author { user { login } } committer { user { login } } }"
+
+
+class GitHubLogins():
+    """GitHub logins of git users ("Name <email>" strings), found in the
+    commits they authored or committed.
+
+    The commits of the users not resolved yet are queued with lookup(),
+    which doesn't wait for GitHub. The queued commits are resolved in
+    batches of batch_size commits with one GraphQL query, in a background
+    thread. When the rate limit is low, only this thread waits for the
+    reset. The logins resolved since the last call are got with
+    get_resolved().
+
+    The logins found, and the users without login, are stored in an
+    Elasticsearch index, so they are not looked up again in later runs.
+
+    :param elastic: ElasticSearch object of the cluster with the logins,
+        None to not store them
+    :param token: GitHub API token
+    :param index: index (and type) with the logins, of their own as ES 6
+        indexes have only one type
+    """
+
+    graphql_url = "https://api.github.com/graphql"
+    batch_size = 50  # commits resolved in each query
+    min_rate_to_sleep = 100  # if pending rate < 100 sleep
+
+    def __init__(self, elastic, token, index="github_logins/items"):
+        self.elastic = elastic
+        self.index = index.split("/")[0]
+        self.url = elastic.url + "/" + index if elastic else None
+        self.headers = {'Authorization': 'bearer ' + token}
+        self.requests = get_grimoire_con()
+
+        self.logins = {}  # user -> login, None if the user has no login
+        self.new_logins = {}  # logins not stored yet
+
+        self.rate_limit = None
+        self.authors_not_found = 0
+        self.committers_not_found = 0
+
+        self._queued = set()  # users with a commit queued
+        self._batch = []
+        self._resolved = []
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._futures = []
+
+    def load(self):
+        """ Read the logins stored """
+
+        if not self.url:
+            return
+
+        res = self.elastic.requests.head(self.url)
+        if res.status_code != 200:
+            logger.info("No GitHub logins data in %s", self.url)
+            return
+
+        for hit in scroll_docs(self.elastic, {"query": {"match_all": {}}}, self.url):
+            self.logins[hit['_source']['user']] = hit['_source']['login']
+
+        logger.debug("GitHub logins loaded from %s: %i", self.url, len(self.logins))
+
+    def lookup(self, user, rol, commit_hash, repo):
+        """ Login of user, if already resolved. If not, the commit_hash in
+        repo ("owner/name") is queued to get the login from its author or
+        committer, depending on rol.
+
+        :returns: (resolved, login)
+        """
+
+        if rol not in ["author", "committer"]:
+            logger.error("Wrong rol: %s" % (rol))
+            raise RuntimeError
+
+        with self._lock:
+            if user in self.logins:
+                return True, self.logins[user]
+            if user in self._queued:
+                return False, None
+            self._queued.add(user)
+
+        self._batch.append((user, rol, commit_hash, repo))
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+        return False, None
+
+    def get_resolved(self):
+        """ (user, login) pairs resolved since the last call """
+
+        self._check_futures()
+
+        with self._lock:
+            resolved = self._resolved
+            self._resolved = []
+
+        return resolved
+
+    def flush(self):
+        """ Hand the queued commits to the background thread """
+
+        if self._batch:
+            self._futures.append(self._executor.submit(self._resolve, self._batch))
+            self._batch = []
+
+    def close(self):
+        """ Wait until all the queued commits are resolved and store the
+        new logins. New commits can be queued after it. """
+
+        try:
+            self.flush()
+            for future in self._futures:
+                future.result()
+            self._futures = []
+        finally:
+            self._executor.shutdown(wait=True)
+            self._executor = ThreadPoolExecutor(max_workers=1)
+
+        self.save()
+
+    def save(self):
+        """ Store the logins found since the last save """
+
+        with self._lock:
+            new_logins = self.new_logins
+            self.new_logins = {}
+
+        if not self.url or not new_logins:
+            return 0
+
+        with BulkWriter(self.elastic, self.url + "/_bulk", index=self.index) as writer:
+            for user, login in new_logins.items():
+                user_id = hashlib.sha1(user.encode('utf-8')).hexdigest()
+                writer.add({"user": user, "login": login}, user_id)
+
+        logger.debug("GitHub logins added to %s: %i", self.url, writer.inserted)
+
+        return writer.inserted
+
+    def _check_futures(self):
+        """ Raise the errors of the batches already resolved """
+
+        done = [future for future in self._futures if future.done()]
+        for future in done:
+            self._futures.remove(future)
+            future.result()
+
+    def _resolve(self, batch):
+        try:
+            commits = self._query(batch)
+        except (requests.exceptions.ConnectionError, requests.exceptions.HTTPError, ELKError) as ex:
+            # The users are not stored, so they are looked up in next runs
+            logger.error("Can't get GitHub logins for %i commits: %s", len(batch), ex)
+            commits = None
+
+        with self._lock:
+            for i, (user, rol, commit_hash, repo) in enumerate(batch):
+                self._queued.discard(user)
+                if commits is None:
+                    continue
+
+                login = self.__get_login(commits.get('c%i' % i), rol)
+                self.logins[user] = login
+                self.new_logins[user] = login
+                self._resolved.append((user, login))
+                logger.debug("%s is %s in github (not found %i authors %i committers)", user, login,
+                             self.authors_not_found, self.committers_not_found)
+
+    def __get_login(self, commit, rol):
+        commit = commit['object'] if commit else None
+
+        logins = {}
+        for field in ["author", "committer"]:
+            user = commit[field]['user'] if commit and commit.get(field) else None
+            logins[field] = user['login'] if user else None
+
+        if not logins["author"]:
+            self.authors_not_found += 1
+        if not logins["committer"]:
+            self.committers_not_found += 1
+
+        return logins[rol]
+
+    def _query(self, batch):
+        """ Commits of the batch, with the aliases c0, c1 ... """
+
+        commits = []
+        for i, (_, _, commit_hash, repo) in enumerate(batch):
+            owner, _, name = repo.partition("/")
+            commits.append('c%i: repository(owner: %s, name: %s) { object(oid: %s) { %s } }' %
+                           (i, json.dumps(owner), json.dumps(name), json.dumps(commit_hash),
+                            COMMIT_FIELDS))
+        query = "query { rateLimit { remaining resetAt } %s }" % " ".join(commits)
+
+        r = self.requests.post(self.graphql_url, data=json.dumps({"query": query}),
+                               headers=self.headers)
+        r.raise_for_status()
+        res = r.json()
+        # GraphQL errors are answered with 200. Commits or repositories
+        # not found have their own error and a null alias, so the rest of
+        # the data is used. Without data nothing is stored for the batch,
+        # so it is resolved again in the next run.
+        if not res.get('data'):
+            raise ELKError(cause="GraphQL answer without data %s" % json.dumps(res.get('errors')))
+        if res.get('errors'):
+            logger.debug("GraphQL errors for %i commits: %s", len(batch), json.dumps(res['errors']))
+
+        data = res['data']
+        self.__check_rate_limit(data.get('rateLimit'))
+
+        return data
+
+    def __check_rate_limit(self, rate_limit):
+        if not rate_limit:
+            return
+
+        self.rate_limit = rate_limit['remaining']
+        logger.debug("Rate limit pending: %s", self.rate_limit)
+        if self.rate_limit <= self.min_rate_to_sleep:
+            reset = parse_date_utc(rate_limit['resetAt'])
+            seconds_to_reset = max((reset - datetime.utcnow()).total_seconds() + 1, 0)
+            cause = "GitHub rate limit exhausted."
+            logger.info("%s Waiting %i secs for rate limit reset.", cause, seconds_to_reset)
+            sleep(seconds_to_reset)
@@ -79,6 +79,9 @@ class JiraEnrich(Enrich):
         repo += "projects/" + eitem['project_key']
         return repo
 
+    def get_project_repository_fields(self):
+        return ['origin', 'project_key']
+
     def get_users_data(self, item):
         """ If user fields are inside the global item dict """
         if 'data' in item:
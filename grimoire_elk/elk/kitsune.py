@@ -22,11 +22,9 @@
 #   Alvaro del Castillo San Felix <acs@bitergia.com>
 #
 
-import json
 import logging
 
-from dateutil import parser
-
+from .dates import parse_date_iso
 from .enrich import Enrich, metadata
 from .utils import get_time_diff_days
 from ..elastic_mapping import Mapping as BaseMapping
@@ -159,8 +157,8 @@ class KitsuneEnrich(Enrich):
             eitem["tags_analyzed"] = tags
 
             # Enrich dates
-            eitem["creation_date"] = parser.parse(question["created"]).isoformat()
-            eitem["last_activity_date"] = parser.parse(question["updated"]).isoformat()
+            eitem["creation_date"] = parse_date_iso(question["created"])
+            eitem["last_activity_date"] = parse_date_iso(question["updated"])
 
             eitem['lifetime_days'] = \
                 get_time_diff_days(question['created'], question['updated'])
@@ -204,8 +202,8 @@ class KitsuneEnrich(Enrich):
             eitem["helpful_answer"] = answer['num_helpful_votes']
 
             # Enrich dates
-            eitem["creation_date"] = parser.parse(answer["created"]).isoformat()
-            eitem["last_activity_date"] = parser.parse(answer["updated"]).isoformat()
+            eitem["creation_date"] = parse_date_iso(answer["created"])
+            eitem["last_activity_date"] = parse_date_iso(answer["updated"])
 
             eitem['lifetime_days'] = \
                 get_time_diff_days(answer['created'], answer['updated'])
@@ -227,47 +225,20 @@ class KitsuneEnrich(Enrich):
 
         return eitem
 
-    def enrich_items(self, ocean_backend):
-        max_items = self.elastic.max_items_bulk
-        current = 0
-        bulk_json = ""
-        total = 0
-
-        url = self.elastic.index_url + '/items/_bulk'
-
-        logger.debug("Adding items to %s (in %i packs)", url, max_items)
-
-        items = ocean_backend.fetch()
-        for item in items:
-            if current >= max_items:
-                self.requests.put(url, data=bulk_json)
-                bulk_json = ""
-                current = 0
-
-            rich_item = self.get_rich_item(item)
-            data_json = json.dumps(rich_item)
-            bulk_json += '{"index" : {"_id" : "%s" } }\n' % \
-                (item[self.get_field_unique_id()])
-            bulk_json += data_json + "\n"  # Bulk document
-            current += 1
-            total += 1
-            # Time to enrich also de answers
-            if 'answers_data' in item['data']:
-                for answer in item['data']['answers_data']:
-                    # Add question title in answers
-                    answer['title'] = item['data']['title']
-                    answer['solution'] = 0
-                    if answer['id'] == item['data']['solution']:
-                        answer['solution'] = 1
-                    rich_answer = self.get_rich_item(answer, kind='answer')
-                    data_json = json.dumps(rich_answer)
-                    bulk_json += '{"index" : {"_id" : "%s_%i" } }\n' % \
-                        (item[self.get_field_unique_id()],
-                         rich_answer['answer_id'])
-                    bulk_json += data_json + "\n"  # Bulk document
-                    current += 1
-                    total += 1
-
-        self.requests.put(url, data=bulk_json)
-
-        return total
+    def get_rich_item_docs(self, item):
+        """ The question and its answers """
+
+        rich_item = self.get_rich_item(item)
+        yield item[self.get_field_unique_id()], rich_item
+        # Time to enrich also de answers
+        if 'answers_data' in item['data']:
+            for answer in item['data']['answers_data']:
+                # Add question title in answers
+                answer['title'] = item['data']['title']
+                answer['solution'] = 0
+                if answer['id'] == item['data']['solution']:
+                    answer['solution'] = 1
+                rich_answer = self.get_rich_item(answer, kind='answer')
+                answer_id = "%s_%i" % (item[self.get_field_unique_id()],
+                                       rich_answer['answer_id'])
+                yield answer_id, rich_answer
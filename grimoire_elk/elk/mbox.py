@@ -22,13 +22,12 @@
 #   Alvaro del Castillo San Felix <acs@bitergia.com>
 #
 
-import json
 import logging
 
-from dateutil import parser
 
 import email.utils
 
+from .dates import parse_date, parse_date_iso
 from .enrich import Enrich, metadata
 from ..elastic_mapping import Mapping as BaseMapping
 from .mbox_study_kip import kafka_kip, MAX_LINES_FOR_VOTE
@@ -168,7 +167,7 @@ class MBoxEnrich(Enrich):
                 eitem[map_fields[fn]] = None
 
         # Enrich dates
-        eitem["email_date"] = parser.parse(item["metadata__updated_on"]).isoformat()
+        eitem["email_date"] = parse_date_iso(item["metadata__updated_on"])
         eitem["list"] = item["origin"]
 
         # Root message
@@ -187,7 +186,7 @@ class MBoxEnrich(Enrich):
 
         # Time zone
         try:
-            message_date = parser.parse(message['Date'])
+            message_date = parse_date(message['Date'])
             eitem["tz"] = int(message_date.strftime("%z")[0:3])
         except Exception:
             eitem["tz"] = None
@@ -202,53 +201,5 @@ class MBoxEnrich(Enrich):
 
         return eitem
 
-    def enrich_items(self, ocean_backend):
-        # items is a generator but we need to reuse it so we store all items
-        # from the generator in a list
-        # items = list(items)
-
-        # Use standard method and if fails, use the old one with Unicode control
-        total = 0
-        try:
-            total = super(MBoxEnrich, self).enrich_items(ocean_backend)
-        except UnicodeEncodeError:
-            total = self.enrich_items_old(ocean_backend.fetch())
-
-        return total
-
-    def enrich_items_old(self, items):
-        max_items = self.elastic.max_items_bulk
-        current = 0
-        total = 0
-        bulk_json = ""
-
-        url = self.elastic.index_url + '/items/_bulk'
-
-        logger.debug("Adding items to %s (in %i packs)" % (url, max_items))
-
-        for item in items:
-            if current >= max_items:
-                self.requests.put(url, data=bulk_json)
-                bulk_json = ""
-                current = 0
-
-            rich_item = self.get_rich_item(item)
-            data_json = json.dumps(rich_item)
-            bulk_json += '{"index" : {"_id" : "%s" } }\n' % \
-                (rich_item[self.get_field_unique_id()])
-            bulk_json += data_json + "\n"  # Bulk document
-            current += 1
-            total += 1
-        try:
-            self.requests.put(url, data=bulk_json)
-        except UnicodeEncodeError:
-            # Related to body.encode('iso-8859-1'). mbox data
-            logger.error("Encoding error ... converting bulk to iso-8859-1")
-            bulk_json = bulk_json.encode('iso-8859-1', 'ignore')
-            self.requests.put(url, data=bulk_json)
-
-        return total
-
     def kafka_kip(self, enrich_backend, no_incremental=False):
-        # KIP study is not incremental
-        kafka_kip(self)
+        kafka_kip(self, no_incremental)
@@ -26,18 +26,32 @@ import logging
 
 from datetime import datetime
 
-from dateutil import parser
-
+from .dates import parse_date
+from .study_state import StudyState, scroll_docs
 from .utils import get_time_diff_days
 
 logger = logging.getLogger(__name__)
 
 MAX_LINES_FOR_VOTE = 10
+MAX_INACTIVE_DAYS = 90
+
+KIP_STUDY = 'kafka_kip'
+KIP_DATE_FIELDS = ["kip_min_discuss", "kip_max_discuss", "kip_min_vote", "kip_max_vote"]
+# Key of the study state with the incremental date of the last message read
+LAST_DATE_KEY = 'last_date'
+
+
+def kafka_kip(enrich, no_incremental=False):
 
+    """ Kafka Improvement Proposals process study
 
-def kafka_kip(enrich):
+    The dates and votes of each KIP are kept in the study state, so only
+    the messages added since the last execution are read. The KIP fields
+    are added to the KIP messages with partial updates.
 
-    """ Kafka Improvement Proposals process study """
+    Like the enrichment, the study only reads the messages of the mailing
+    list being enriched, so each list in the index has its own state.
+    """
 
     def extract_vote_and_binding(body):
         """ Extracts the vote and binding for a KIP process included in message body """
@@ -221,230 +235,261 @@ def kafka_kip(enrich):
 
         return result
 
-    def add_kip_final_status_field(enrich):
-        """ Add kip final status field """
+    def load_kips(states):
+        """ Dates and votes of each KIP from the stored study state """
+
+        kips = {}
+        for kip, state in states.items():
+            kip_state = {"votes": state.get("votes", {})}
+            for field in KIP_DATE_FIELDS:
+                if field in state:
+                    kip_state[field] = parse_date(state[field])
+            kips[int(kip)] = kip_state
+
+        return kips
+
+    def dump_kip(kip_state):
+        """ Study state for the dates and votes of a KIP """
+
+        state = {"votes": kip_state["votes"]}
+        for field in KIP_DATE_FIELDS:
+            if field in kip_state:
+                state[field] = kip_state[field].isoformat()
+
+        return state
+
+    def update_kip_dates(kip_state, kind, kip_date):
+        min_field = "kip_min_" + kind
+        max_field = "kip_max_" + kind
+
+        if min_field not in kip_state:
+            kip_state.update({
+                min_field: kip_date,
+                max_field: kip_date
+            })
+        else:
+            if kip_state[min_field] >= kip_date:
+                kip_state[min_field] = kip_date
+            if kip_state[max_field] <= kip_date:
+                kip_state[max_field] = kip_date
+
+    def get_kip_fields(eitem, kips):
+        """ Extra fields needed for kip analysis, updating the dates and
+        votes of its KIP in kips. None if it is not a KIP message """
+
+        kip_fields = {
+            "kip_is_vote": 0,
+            "kip_is_discuss": 0,
+            "kip_vote": 0,
+            "kip_binding": 0,
+            "kip": 0,
+            "kip_type": "general"
+        }
 
-        total = 0
+        kip = extract_kip(eitem['Subject'])
+        if not kip:
+            # It is not a KIP message
+            return None
+        if kip not in kips:
+            kips[kip] = {"votes": {}}
+
+        kip_date = parse_date(eitem["email_date"])
+        subject = eitem['Subject'].lower()
+
+        # Analyze the subject to fill the kip fields
+        if '[discuss]' in subject or '[kip-discussion]' in subject or '[discussion]' in subject:
+            kip_fields['kip_is_discuss'] = 1
+            kip_fields['kip_type'] = "discuss"
+            kip_fields['kip'] = kip
+            update_kip_dates(kips[kip], "discuss", kip_date)
+
+        if '[vote]' in subject:
+            kip_fields['kip_is_vote'] = 1
+            kip_fields['kip_type'] = "vote"
+            kip_fields['kip'] = kip
+            if 'body_extract' in eitem:
+                (vote, binding) = extract_vote_and_binding(eitem['body_extract'])
+                # Votes are kept by message so reading it again doesn't count it twice
+                kips[kip]["votes"][eitem[enrich.get_field_unique_id()]] = [vote, binding]
+                kip_fields['kip_vote'] = vote
+                kip_fields['kip_binding'] = binding
+            else:
+                logger.debug("Message %s without body", eitem['Subject'])
+            update_kip_dates(kips[kip], "vote", kip_date)
+
+        return kip_fields
+
+    def get_kip_time_status_fields(kip_state, kip_date, is_discuss, is_vote, now):
+        """ Kip fields with status and times for a message """
+
+        # kip_status: adopted (closed), discussion (open), voting (open),
+        #             inactive (open), discarded (closed)
+        # kip_start_end: discuss_start, discuss_end, voting_start, voting_end
+        kip_fields = {
+            "kip_status": None,
+            "kip_discuss_time_days": None,
+            "kip_discuss_inactive_days": None,
+            "kip_voting_time_days": None,
+            "kip_voting_inactive_days": None,
+            "kip_is_first_discuss": 0,
+            "kip_is_first_vote": 0,
+            "kip_is_last_discuss": 0,
+            "kip_is_last_vote": 0,
+            "kip_result": None,
+            "kip_start_end": None
+        }
 
-        for eitem in enrich.fetch():
-            if "kip" not in eitem:
-                # It is not a KIP message
-                continue
+        if is_discuss:
+            kip_fields["kip_discuss_time_days"] = \
+                get_time_diff_days(kip_state['kip_min_discuss'], kip_state['kip_max_discuss'])
+
+            # Detect first and last discuss messages
+            if kip_date == kip_state['kip_min_discuss']:
+                kip_fields['kip_is_first_discuss'] = 1
+                kip_fields['kip_start_end'] = 'discuss_start'
+            elif kip_date == kip_state['kip_max_discuss']:
+                kip_fields['kip_is_last_discuss'] = 1
+                kip_fields['kip_start_end'] = 'discuss_end'
+
+            # Detect discussion status
+            if "kip_min_vote" not in kip_state:
+                kip_fields['kip_status'] = 'discussion'
+            max_discuss_date = kip_state['kip_max_discuss']
+            kip_fields['kip_discuss_inactive_days'] = \
+                get_time_diff_days(max_discuss_date.replace(tzinfo=None), now)
+
+        if is_vote:
+            kip_fields["kip_voting_time_days"] = \
+                get_time_diff_days(kip_state['kip_min_vote'], kip_state['kip_max_vote'])
+
+            # Detect first and last discuss messages
+            if kip_date == kip_state['kip_min_vote']:
+                kip_fields['kip_is_first_vote'] = 1
+                kip_fields['kip_start_end'] = 'voting_start'
+            elif kip_date == kip_state['kip_max_vote']:
+                kip_fields['kip_is_last_vote'] = 1
+                kip_fields['kip_start_end'] = 'voting_end'
+
+            # Detect discussion status
+            kip_fields['kip_status'] = 'voting'
+            max_vote_date = kip_state['kip_max_vote']
+            kip_fields['kip_voting_inactive_days'] = \
+                get_time_diff_days(max_vote_date.replace(tzinfo=None), now)
+
+            # Now check if there is a result from the votes
+            kip_fields['kip_result'] = lazy_result(kip_state['votes'].values())
+
+            if kip_fields['kip_result'] == 1:
+                kip_fields['kip_status'] = 'adopted'
+            elif kip_fields['kip_result'] == -1:
+                kip_fields['kip_status'] = 'discarded'
+
+        # And now change the status inactive
+        if kip_fields['kip_status'] not in ['adopted', 'discarded']:
+            inactive_days = kip_fields['kip_discuss_inactive_days']
+
+            if inactive_days and inactive_days > MAX_INACTIVE_DAYS:
+                kip_fields['kip_status'] = 'inactive'
+
+            inactive_days = kip_fields['kip_voting_inactive_days']
+            if inactive_days and inactive_days > MAX_INACTIVE_DAYS:
+                kip_fields['kip_status'] = 'inactive'
+
+        return kip_fields
+
+    def get_kip_final_status(kip_state, now):
+        """ The final status is the one of the last vote message or, if
+        there isn't one, the one of the last discuss message """
+
+        for kind, is_discuss, is_vote in [("vote", 0, 1), ("discuss", 1, 0)]:
+            min_date = kip_state.get("kip_min_" + kind)
+            max_date = kip_state.get("kip_max_" + kind)
+            if min_date and min_date != max_date:
+                fields = get_kip_time_status_fields(kip_state, max_date, is_discuss, is_vote, now)
+                return fields['kip_status']
+
+        return None
+
+    def add_kip_fields(enrich, kips):
+        """ Add the kip fields to the messages not processed yet, updating kips
+
+        :returns: incremental date of the last message processed
+        """
 
-            if eitem['kip'] in enrich.kips_final_status:
-                eitem.update({"kip_final_status":
-                              enrich.kips_final_status[eitem['kip']]})
-            else:
-                logger.warning("No final status for kip: %i", eitem['kip'])
-                eitem.update({"kip_final_status": None})
-            yield eitem
-            total += 1
+        total = 0
+        last_date = None
+        date_field = enrich.get_incremental_date()
 
-        logger.info("Total eitems with kafka final status kip field %i", total)
+        with enrich.elastic.bulk_writer(refresh='wait_for') as writer:
+            for eitem in enrich.fetch():
+                if not last_date or parse_date(eitem[date_field]) > parse_date(last_date):
+                    last_date = eitem[date_field]
 
-    def add_kip_time_status_fields(enrich):
-        """ Add kip fields with final status and times """
+                kip_fields = get_kip_fields(eitem, kips)
+                if kip_fields is None:
+                    continue
 
-        total = 0
-        max_inactive_days = 90  # days
-
-        enrich.kips_final_status = {}  # final status for each kip
-
-        for eitem in enrich.fetch():
-            # kip_status: adopted (closed), discussion (open), voting (open),
-            #             inactive (open), discarded (closed)
-            # kip_start_end: discuss_start, discuss_end, voting_start, voting_end
-            kip_fields = {
-                "kip_status": None,
-                "kip_discuss_time_days": None,
-                "kip_discuss_inactive_days": None,
-                "kip_voting_time_days": None,
-                "kip_voting_inactive_days": None,
-                "kip_is_first_discuss": 0,
-                "kip_is_first_vote": 0,
-                "kip_is_last_discuss": 0,
-                "kip_is_last_vote": 0,
-                "kip_result": None,
-                "kip_start_end": None
-            }
-
-            if "kip" not in eitem:
-                # It is not a KIP message
-                continue
-            kip = eitem["kip"]
-            kip_date = parser.parse(eitem["email_date"])
-
-            if eitem['kip_is_discuss']:
-                kip_fields["kip_discuss_time_days"] = \
-                    get_time_diff_days(enrich.kips_dates[kip]['kip_min_discuss'],
-                                       enrich.kips_dates[kip]['kip_max_discuss'])
-
-                # Detect first and last discuss messages
-                if kip_date == enrich.kips_dates[kip]['kip_min_discuss']:
-                    kip_fields['kip_is_first_discuss'] = 1
-                    kip_fields['kip_start_end'] = 'discuss_start'
-                elif kip_date == enrich.kips_dates[kip]['kip_max_discuss']:
-                    kip_fields['kip_is_last_discuss'] = 1
-                    kip_fields['kip_start_end'] = 'discuss_end'
-
-                # Detect discussion status
-                if "kip_min_vote" not in enrich.kips_dates[kip]:
-                    kip_fields['kip_status'] = 'discussion'
-                max_discuss_date = enrich.kips_dates[kip]['kip_max_discuss']
-                kip_fields['kip_discuss_inactive_days'] = \
-                    get_time_diff_days(max_discuss_date.replace(tzinfo=None),
-                                       datetime.utcnow())
-
-            if eitem['kip_is_vote']:
-                kip_fields["kip_voting_time_days"] = \
-                    get_time_diff_days(enrich.kips_dates[kip]['kip_min_vote'],
-                                       enrich.kips_dates[kip]['kip_max_vote'])
-
-                # Detect first and last discuss messages
-                if kip_date == enrich.kips_dates[kip]['kip_min_vote']:
-                    kip_fields['kip_is_first_vote'] = 1
-                    kip_fields['kip_start_end'] = 'voting_start'
-                elif kip_date == enrich.kips_dates[kip]['kip_max_vote']:
-                    kip_fields['kip_is_last_vote'] = 1
-                    kip_fields['kip_start_end'] = 'voting_end'
-
-                # Detect discussion status
-                kip_fields['kip_status'] = 'voting'
-                max_vote_date = enrich.kips_dates[kip]['kip_max_vote']
-                kip_fields['kip_voting_inactive_days'] = \
-                    get_time_diff_days(max_vote_date.replace(tzinfo=None),
-                                       datetime.utcnow())
-
-                # Now check if there is a result from enrich.kips_scores
-                kip_fields['kip_result'] = lazy_result(enrich.kips_scores[kip])
-
-                if kip_fields['kip_result'] == 1:
-                    kip_fields['kip_status'] = 'adopted'
-                elif kip_fields['kip_result'] == -1:
-                    kip_fields['kip_status'] = 'discarded'
-
-            # And now change the status inactive
-            if kip_fields['kip_status'] not in ['adopted', 'discarded']:
-                inactive_days = kip_fields['kip_discuss_inactive_days']
-
-                if inactive_days and inactive_days > max_inactive_days:
-                    kip_fields['kip_status'] = 'inactive'
-
-                inactive_days = kip_fields['kip_voting_inactive_days']
-                if inactive_days and inactive_days > max_inactive_days:
-                    kip_fields['kip_status'] = 'inactive'
-
-            # The final status is in the kip_is_last_discuss or kip_is_last_vote
-            # It will be filled in the next enrichment round
-            eitem.update(kip_fields)
-            if eitem['kip'] not in enrich.kips_final_status:
-                enrich.kips_final_status[kip] = None
-            if eitem['kip_is_last_discuss'] and not enrich.kips_final_status[kip]:
-                enrich.kips_final_status[kip] = kip_fields['kip_status']
-            if eitem['kip_is_last_vote']:
-                enrich.kips_final_status[kip] = kip_fields['kip_status']
-
-            yield eitem
-            total += 1
-
-        logger.info("Total eitems with kafka extra kip fields %i", total)
-
-    def add_kip_fields(enrich):
-        """ Add extra fields needed for kip analysis"""
+                writer.add({"doc": kip_fields}, eitem[enrich.get_field_unique_id()], action="update")
+                total += 1
 
-        total = 0
+        logger.info("Total eitems with kafka kip fields %i", total)
 
-        enrich.kips_dates = {
-            0: {
-                "kip_min_discuss": None,
-                "kip_max_discuss": None,
-                "kip_min_vote": None,
-                "kip_max_vote": None,
-            }
-        }
+        return last_date
 
-        enrich.kips_scores = {}
-
-        # First iteration
-        for eitem in enrich.fetch():
-            kip_fields = {
-                "kip_is_vote": 0,
-                "kip_is_discuss": 0,
-                "kip_vote": 0,
-                "kip_binding": 0,
-                "kip": 0,
-                "kip_type": "general"
-            }
-
-            kip = extract_kip(eitem['Subject'])
-            if not kip:
-                # It is not a KIP message
-                continue
-            if kip not in enrich.kips_dates:
-                enrich.kips_dates[kip] = {}
-            if kip not in enrich.kips_scores:
-                enrich.kips_scores[kip] = []
-
-            kip_date = parser.parse(eitem["email_date"])
-
-            # Analyze the subject to fill the kip fields
-            if '[discuss]' in eitem['Subject'].lower() or \
-               '[kip-discussion]'in eitem['Subject'].lower() or \
-               '[discussion]'in eitem['Subject'].lower():
-                kip_fields['kip_is_discuss'] = 1
-                kip_fields['kip_type'] = "discuss"
-                kip_fields['kip'] = kip
-                # Update kip discuss dates
-                if "kip_min_discuss" not in enrich.kips_dates[kip]:
-                    enrich.kips_dates[kip].update({
-                        "kip_min_discuss": kip_date,
-                        "kip_max_discuss": kip_date
-                    })
-                else:
-                    if enrich.kips_dates[kip]["kip_min_discuss"] >= kip_date:
-                        enrich.kips_dates[kip]["kip_min_discuss"] = kip_date
-                    if enrich.kips_dates[kip]["kip_max_discuss"] <= kip_date:
-                        enrich.kips_dates[kip]["kip_max_discuss"] = kip_date
-
-            if '[vote]' in eitem['Subject'].lower():
-                kip_fields['kip_is_vote'] = 1
-                kip_fields['kip_type'] = "vote"
-                kip_fields['kip'] = kip
-                if 'body_extract' in eitem:
-                    (vote, binding) = extract_vote_and_binding(eitem['body_extract'])
-                    enrich.kips_scores[kip] += [(vote, binding)]
-                    kip_fields['kip_vote'] = vote
-                    kip_fields['kip_binding'] = binding
-                else:
-                    logger.debug("Message %s without body", eitem['Subject'])
-                # Update kip discuss dates
-                if "kip_min_vote" not in enrich.kips_dates[kip]:
-                    enrich.kips_dates[kip].update({
-                        "kip_min_vote": kip_date,
-                        "kip_max_vote": kip_date
-                    })
-                else:
-                    if enrich.kips_dates[kip]["kip_min_vote"] >= kip_date:
-                        enrich.kips_dates[kip]["kip_min_vote"] = kip_date
-                    if enrich.kips_dates[kip]["kip_max_vote"] <= kip_date:
-                        enrich.kips_dates[kip]["kip_max_vote"] = kip_date
+    def add_kip_time_status_fields(enrich, kips, repository):
+        """ Add kip fields with status, times and the final status to all
+        the KIP messages of the repository, as the inactive days change in
+        each execution """
 
-            eitem.update(kip_fields)
-            yield eitem
-            total += 1
+        now = datetime.utcnow()
+        final_status = {kip: get_kip_final_status(kip_state, now) for kip, kip_state in kips.items()}
 
-        logger.info("Total eitems with kafka kip fields %i", total)
+        query = {
+            "query": {"bool": {"filter": [{"exists": {"field": "kip"}}]}},
+            "_source": ["kip", "email_date", "kip_is_discuss", "kip_is_vote"]
+        }
+        if repository:
+            query['query']['bool']['filter'].append({"term": {repository['name']: repository['value']}})
 
-    logger.debug("Doing kafka_kip study from %s", enrich.elastic.index_url)
+        with enrich.elastic.bulk_writer() as writer:
+            for hit in scroll_docs(enrich.elastic, query):
+                eitem = hit['_source']
+                kip = eitem['kip']
+                kip_fields = get_kip_time_status_fields(kips.get(kip, {"votes": {}}),
+                                                        parse_date(eitem["email_date"]),
+                                                        eitem['kip_is_discuss'], eitem['kip_is_vote'], now)
+                kip_fields["kip_final_status"] = final_status.get(kip)
+                writer.add({"doc": kip_fields}, hit['_id'], action="update")
 
-    # First iteration with the basic fields
-    eitems = add_kip_fields(enrich)
-    enrich.elastic.bulk_upload_sync(eitems, enrich.get_field_unique_id())
+        logger.info("Total eitems with kafka extra kip fields %i", writer.inserted)
 
-    # Second iteration with the final time and status fields
-    eitems = add_kip_time_status_fields(enrich)
-    enrich.elastic.bulk_upload_sync(eitems, enrich.get_field_unique_id())
+    logger.debug("Doing kafka_kip study from %s", enrich.elastic.index_url)
 
-    # Third iteration to compute the end status field for all KIPs
-    eitems = add_kip_final_status_field(enrich)
-    enrich.elastic.bulk_upload_sync(eitems, enrich.get_field_unique_id())
+    # Same messages than enrich.fetch(), the ones of the repository enriched
+    repository = enrich.get_repository_filter_raw()
+    origin = repository['value'] if repository else None
+    study_state = StudyState(enrich.elastic, KIP_STUDY, origin)
+
+    kips = {}
+    from_date = None
+    if not no_incremental:
+        states = study_state.get_all()
+        last_date = states.pop(LAST_DATE_KEY, None)
+        if last_date:
+            from_date = parse_date(last_date['date'])
+        kips = load_kips(states)
+
+    # Only the messages added since the last execution are read
+    enrich_from_date = enrich.from_date
+    enrich.from_date = from_date
+    try:
+        last_date = add_kip_fields(enrich, kips)
+    finally:
+        enrich.from_date = enrich_from_date
+
+    states = {str(kip): dump_kip(kip_state) for kip, kip_state in kips.items()}
+    if last_date:
+        states[LAST_DATE_KEY] = {"date": last_date}
+    study_state.set(states)
+
+    add_kip_time_status_fields(enrich, kips, repository)
@@ -22,12 +22,13 @@
 #   Alvaro del Castillo San Felix <acs@bitergia.com>
 #
 
-import json
 import logging
 
-from dateutil import parser
+from time import time
 
+from .dates import parse_date, parse_date_iso
 from .enrich import Enrich, metadata
+from .metrics import metrics
 from ..elastic_mapping import Mapping as BaseMapping
 
 
@@ -121,7 +122,7 @@ class MediaWikiEnrich(Enrich):
         """ Add sorting hat enrichment fields for the author of the revision """
 
         identity = self.get_sh_identity(revision)
-        update = parser.parse(item[self.get_field_date()])
+        update = parse_date(item[self.get_field_date()])
         erevision = self.get_item_sh_fields(identity, update)
 
         return erevision
@@ -206,7 +207,7 @@ class MediaWikiEnrich(Enrich):
             eitem[map_fields[fn]] = page[fn]
 
         # Enrich dates
-        eitem["update_date"] = parser.parse(item["metadata__updated_on"]).isoformat()
+        eitem["update_date"] = parse_date_iso(item["metadata__updated_on"])
         # Revisions
         eitem["last_edited_date"] = None
         eitem["nrevisions"] = 0
@@ -232,29 +233,17 @@ class MediaWikiEnrich(Enrich):
             super(MediaWikiEnrich, self).enrich_items(items)
 
     def enrich_events(self, ocean_backend):
-        max_items = self.elastic.max_items_bulk
-        current = 0
-        bulk_json = ""
-        total = 0
-
-        url = self.elastic.index_url + '/items/_bulk'
-
-        logger.debug("Adding items to %s (in %i packs)" % (url, max_items))
-
-        items = ocean_backend.fetch()
-        for item in items:
-            rich_item_reviews = self.get_rich_item_reviews(item)
-            for enrich_review in rich_item_reviews:
-                if current >= max_items:
-                    self.requests.put(url, data=bulk_json)
-                    bulk_json = ""
-                    current = 0
-                data_json = json.dumps(enrich_review)
-                bulk_json += '{"index" : {"_id" : "%s" } }\n' % \
-                    (enrich_review[self.get_field_unique_id_review()])
-                bulk_json += data_json + "\n"  # Bulk document
-                current += 1
-                total += 1
-        self.requests.put(url, data=bulk_json)
+
+        def rich_docs():
+            for item in self.prefetch_sh_identities(ocean_backend.fetch()):
+                start = time()
+                rich_item_reviews = self.get_rich_item_reviews(item)
+                metrics.observe("rich_events", time() - start)
+                metrics.inc("rich_docs", len(rich_item_reviews))
+                for enrich_review in rich_item_reviews:
+                    yield enrich_review[self.get_field_unique_id_review()], enrich_review
+                self.enriched_items += 1
+
+        total = self.elastic.bulk_upload_docs(rich_docs(), checkpoint=self.enrich_checkpoint)
 
         return total
@@ -128,6 +128,9 @@ class MeetupEnrich(Enrich):
     def get_project_repository(self, eitem):
         return eitem['tag']
 
+    def get_project_repository_fields(self):
+        return ['tag', 'origin']
+
     @metadata
     def get_rich_item(self, item):
         # We need to detect the category of item: activities (report), events or users
@@ -355,28 +358,12 @@ class MeetupEnrich(Enrich):
     def get_field_unique_id_rsvps(self):
         return "id"
 
-    def enrich_items(self, ocean_backend):
-        items = ocean_backend.fetch()
-
-        super(MeetupEnrich, self).enrich_items(ocean_backend)
-
-        # And now for each item we want also the rsvps and comments items
-        items = ocean_backend.fetch()
-        ncom = 0
-        nrsvps = 0
-        rich_item_comments = []
-        rich_item_rsvps = []
-
-        for item in items:
-            rich_item_comments += self.get_rich_item_comments(item)
-            rich_item_rsvps += self.get_rich_item_rsvps(item)
+    def get_rich_item_docs(self, item):
+        """ The event with its comments and rsvps """
 
-        if rich_item_comments:
-            ncom += self.elastic.bulk_upload(rich_item_comments,
-                                             self.get_field_unique_id_comment())
-        if rich_item_rsvps:
-            nrsvps += self.elastic.bulk_upload(rich_item_rsvps,
-                                               self.get_field_unique_id_rsvps())
+        yield item[self.get_field_unique_id()], self.get_rich_item(item)
 
-        logger.info("Total comments enriched: %i", ncom)
-        logger.info("Total nrsvps enriched: %i", nrsvps)
+        for ecomment in self.get_rich_item_comments(item):
+            yield ecomment[self.get_field_unique_id_comment()], ecomment
+        for ersvp in self.get_rich_item_rsvps(item):
+            yield ersvp[self.get_field_unique_id_rsvps()], ersvp
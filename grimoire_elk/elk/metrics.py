@@ -0,0 +1,243 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Counters and latency histograms of the stages of feeding and enriching
+#
+# Copyright (C) 2018 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+import bisect
+import logging
+import threading
+
+from contextlib import contextmanager
+from datetime import datetime
+from time import time
+
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds, in seconds, of the buckets of the latency histograms
+BUCKETS = (0.0001, 0.001, 0.01, 0.1, 0.5, 1, 5, 10, 60)
+
+PROMETHEUS_PREFIX = "grimoire_elk_"
+
+
+class Metrics():
+    """Counters and latency histograms of the stages of feeding and
+    enriching: scroll pages read, identities loaded, rich items, SortingHat
+    and projects lookups, bulk packs encoded and sent...
+
+    All of them are labelled with the labels of the task being run (the
+    connector, origin and task set with set_labels) and optionally with
+    labels of their own. Counters with a "result" label, "hit" or "miss",
+    are reported with their hit rate.
+
+    All the objects of a process use the same Metrics, metrics below. The
+    enrich worker processes send theirs to the main process with pop()
+    and merge().
+    """
+
+    def __init__(self):
+        self.labels = ()
+        self.counters = {}  # (name, labels) -> value
+        self.timers = {}  # (name, labels) -> [count, seconds, max seconds, buckets]
+        self.started = datetime.utcnow()
+        self._lock = threading.Lock()
+
+    def set_labels(self, **labels):
+        """ Labels of the task being run, added to all the values """
+
+        self.labels = self.__get_labels(labels)
+
+    @staticmethod
+    def __get_labels(labels):
+        return tuple(sorted((name, str(value) if value is not None else "")
+                            for name, value in labels.items()))
+
+    def __get_key(self, name, labels):
+        if labels:
+            return name, self.labels + tuple(sorted(labels.items()))
+        return name, self.labels
+
+    def inc(self, name, value=1, **labels):
+        """ Increase a counter """
+
+        key = self.__get_key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        """ Add the seconds spent in a stage to its histogram """
+
+        key = self.__get_key(name, labels)
+        with self._lock:
+            timer = self.timers.get(key)
+            if timer is None:
+                timer = self.timers[key] = [0, 0, 0, [0] * (len(BUCKETS) + 1)]
+            timer[0] += 1
+            timer[1] += seconds
+            timer[2] = max(timer[2], seconds)
+            timer[3][bisect.bisect_left(BUCKETS, seconds)] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """ Observe the seconds spent running the with block """
+
+        start = time()
+        try:
+            yield
+        finally:
+            self.observe(name, time() - start, **labels)
+
+    def pop(self):
+        """ Values added since the last call, to be merged in other Metrics """
+
+        with self._lock:
+            values = (self.counters, self.timers)
+            self.counters = {}
+            self.timers = {}
+
+        return values
+
+    def merge(self, values):
+        """ Add the values got with pop() from other Metrics """
+
+        counters, timers = values
+        with self._lock:
+            for key, value in counters.items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            for key, (count, seconds, max_seconds, buckets) in timers.items():
+                timer = self.timers.get(key)
+                if timer is None:
+                    timer = self.timers[key] = [0, 0, 0, [0] * (len(BUCKETS) + 1)]
+                timer[0] += count
+                timer[1] += seconds
+                timer[2] = max(timer[2], max_seconds)
+                timer[3] = [a + b for a, b in zip(timer[3], buckets)]
+
+    def reset(self):
+        """ Remove all the values """
+
+        self.pop()
+        self.started = datetime.utcnow()
+
+    def __get_values(self, labels):
+        """ Sorted counters and timers with all the labels """
+
+        def match(key):
+            return all(label in key[1] for label in labels)
+
+        with self._lock:
+            counters = sorted((key, value) for key, value in self.counters.items() if match(key))
+            timers = sorted((key, list(timer)) for key, timer in self.timers.items() if match(key))
+
+        return counters, timers
+
+    def get_report(self, **labels):
+        """ Report with the values, only those with labels if provided,
+        which can be serialized to JSON """
+
+        labels = self.__get_labels(labels)
+        counters, timers = self.__get_values(labels)
+
+        report = {
+            "labels": dict(labels),
+            "started": self.started.isoformat(),
+            "finished": datetime.utcnow().isoformat(),
+            "counters": [],
+            "timers": [],
+            "hit_rates": []
+        }
+
+        hits = {}  # (name, labels without result) -> [hits, misses]
+        for (name, key_labels), value in counters:
+            report["counters"].append({"name": name, "labels": dict(key_labels), "value": value})
+
+            result = dict(key_labels).get("result")
+            if result in ["hit", "miss"]:
+                rate_key = (name, tuple(label for label in key_labels if label[0] != "result"))
+                hits.setdefault(rate_key, [0, 0])[result == "miss"] += value
+
+        for (name, key_labels), (nhits, nmisses) in sorted(hits.items()):
+            report["hit_rates"].append({
+                "name": name,
+                "labels": dict(key_labels),
+                "hits": nhits,
+                "misses": nmisses,
+                "rate": nhits / (nhits + nmisses) if nhits + nmisses else None
+            })
+
+        for (name, key_labels), (count, seconds, max_seconds, buckets) in timers:
+            report["timers"].append({
+                "name": name,
+                "labels": dict(key_labels),
+                "count": count,
+                "seconds": seconds,
+                "max_seconds": max_seconds,
+                "mean_seconds": seconds / count if count else None,
+                # Same buckets than in Prometheus, with the counts not accumulated
+                "buckets": [{"le": str(le), "count": n} for le, n in zip(BUCKETS + ("+Inf",), buckets)]
+            })
+
+        return report
+
+    def to_prometheus(self, **labels):
+        """ Values in the Prometheus text exposition format """
+
+        counters, timers = self.__get_values(self.__get_labels(labels))
+
+        lines = []
+        last_name = None
+        for (name, key_labels), value in counters:
+            metric = PROMETHEUS_PREFIX + name + "_total"
+            if name != last_name:
+                lines.append("# TYPE %s counter" % metric)
+                last_name = name
+            lines.append("%s%s %s" % (metric, self.__prometheus_labels(key_labels), value))
+
+        last_name = None
+        for (name, key_labels), (count, seconds, _, buckets) in timers:
+            metric = PROMETHEUS_PREFIX + name + "_seconds"
+            if name != last_name:
+                lines.append("# TYPE %s histogram" % metric)
+                last_name = name
+            total = 0
+            for le, n in zip(BUCKETS + ("+Inf",), buckets):
+                total += n
+                bucket_labels = key_labels + (("le", str(le)),)
+                lines.append("%s_bucket%s %i" % (metric, self.__prometheus_labels(bucket_labels), total))
+            lines.append("%s_sum%s %s" % (metric, self.__prometheus_labels(key_labels), repr(seconds)))
+            lines.append("%s_count%s %i" % (metric, self.__prometheus_labels(key_labels), count))
+
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def __prometheus_labels(labels):
+        if not labels:
+            return ""
+
+        values = []
+        for name, value in labels:
+            value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+            values.append('%s="%s"' % (name, value))
+
+        return "{" + ",".join(values) + "}"
+
+
+# Metrics of this process
+metrics = Metrics()
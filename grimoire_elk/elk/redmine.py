@@ -26,8 +26,7 @@ import logging
 
 from datetime import datetime
 
-from dateutil import parser
-
+from .dates import parse_date
 from .enrich import Enrich
 from ..elastic_mapping import Mapping as BaseMapping
 
@@ -105,7 +104,7 @@ class RedmineEnrich(Enrich):
         eitem = {}  # Item enriched
 
         identity = self.get_sh_identity(item['data'], 'author')
-        eitem = self.get_item_sh_fields(identity, parser.parse(item[self.get_field_date()]))
+        eitem = self.get_item_sh_fields(identity, parse_date(item[self.get_field_date()]))
 
         return eitem
 
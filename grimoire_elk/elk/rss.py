@@ -24,8 +24,7 @@
 
 import logging
 
-from dateutil import parser
-
+from .dates import parse_date_iso
 from .enrich import Enrich, metadata
 from ..elastic_mapping import Mapping as BaseMapping
 
@@ -126,7 +125,7 @@ class RSSEnrich(Enrich):
                 eitem[map_fields[f]] = entry[f]
 
         # Enrich dates
-        eitem["publish_date"] = parser.parse(eitem["published"]).isoformat()
+        eitem["publish_date"] = parse_date_iso(eitem["published"])
 
         if self.sortinghat:
             eitem.update(self.get_item_sh(item))
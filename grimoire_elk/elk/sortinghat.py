@@ -23,12 +23,16 @@
 #   Alvaro del Castillo San Felix <acs@bitergia.com>
 #
 
+import bisect
 from datetime import datetime
 import logging
 import traceback
+from time import time
 
-from sortinghat import api
-from sortinghat.db.model import Identity
+from sqlalchemy import func
+
+from sortinghat import api, utils
+from sortinghat.db.model import Enrollment, Identity, Organization, Profile, UniqueIdentity
 from sortinghat.exceptions import AlreadyExistsError, WrappedValueError
 
 
@@ -37,6 +41,106 @@ logger = logging.getLogger(__name__)
 
 class SortingHat(object):
 
+    max_ids_query = 1000  # max ids in the IN clause of a query
+    known_ids = set()  # ids of identities already in Sorting Hat loaded in this process
+
+    @classmethod
+    def __chunks(cls, ids):
+        ids = list(ids)
+        for i in range(0, len(ids), cls.max_ids_query):
+            yield ids[i:i + cls.max_ids_query]
+
+    @classmethod
+    def get_uuids_from_ids(cls, db, sh_ids):
+        """ Get the uuids for a list of SH identity ids
+
+        :returns: dict with the uuid for each id found
+        """
+        uuids = {}
+
+        with db.connect() as session:
+            for chunk in cls.__chunks(sh_ids):
+                query = session.query(Identity.id, Identity.uuid).\
+                    filter(Identity.id.in_(chunk))
+                for sh_id, uuid in query.all():
+                    uuids[sh_id] = uuid
+        return uuids
+
+    @classmethod
+    def get_profiles(cls, db, uuids):
+        """ Get the profiles for a list of unique identities
+
+        :returns: dict with the name, email and is_bot for each uuid with profile
+        """
+        profiles = {}
+
+        with db.connect() as session:
+            for chunk in cls.__chunks(uuids):
+                query = session.query(Profile.uuid, Profile.name, Profile.email, Profile.is_bot).\
+                    filter(Profile.uuid.in_(chunk))
+                for uuid, name, email, is_bot in query.all():
+                    profiles[uuid] = {"name": name, "email": email, "is_bot": is_bot}
+        return profiles
+
+    @classmethod
+    def get_enrollments(cls, db, uuids):
+        """ Get the enrollments for a list of unique identities
+
+        Enrollments are sorted in the same way api.enrollments does.
+
+        :returns: dict with the list of (start, end, organization name)
+            for each uuid with enrollments
+        """
+        enrollments = {}
+
+        with db.connect() as session:
+            for chunk in cls.__chunks(uuids):
+                query = session.query(Enrollment.uuid, Enrollment.start, Enrollment.end, Organization.name).\
+                    join(Organization, Enrollment.organization_id == Organization.id).\
+                    filter(Enrollment.uuid.in_(chunk)).\
+                    order_by(Enrollment.uuid, Organization.name, Enrollment.start, Enrollment.end)
+                for uuid, start, end, org_name in query.all():
+                    enrollments.setdefault(uuid, []).append((start, end, org_name))
+        return enrollments
+
+    @classmethod
+    def get_modified_ids(cls, db, after):
+        """ Get the ids of the identities modified on or after a date, or
+        whose unique identity was modified then (merges, profiles and
+        enrollments changes)
+
+        :returns: set with the identity ids
+        """
+        with db.connect() as session:
+            query = session.query(Identity.id).\
+                filter(Identity.last_modified >= after)
+            sh_ids = set(sh_id for (sh_id,) in query.all())
+
+            query = session.query(Identity.id).\
+                join(UniqueIdentity, Identity.uuid == UniqueIdentity.uuid).\
+                filter(UniqueIdentity.last_modified >= after)
+            sh_ids.update(sh_id for (sh_id,) in query.all())
+
+        return sh_ids
+
+    @classmethod
+    def get_version(cls, db):
+        """ Fingerprint of the SortingHat data which changes when identities,
+        profiles or enrollments are added, merged or removed, and when the
+        dates of enrollments are edited """
+
+        with db.connect() as session:
+            identities = session.query(func.count(Identity.id), func.max(Identity.last_modified)).one()
+            uidentities = session.query(func.count(UniqueIdentity.uuid),
+                                        func.max(UniqueIdentity.last_modified)).one()
+            profiles = session.query(func.count(Profile.uuid)).one()
+            enrollments = session.query(func.count(Enrollment.id), func.max(Enrollment.id),
+                                        func.min(Enrollment.start), func.max(Enrollment.start),
+                                        func.min(Enrollment.end), func.max(Enrollment.end),
+                                        func.sum(Enrollment.organization_id)).one()
+
+        return tuple(str(value) for value in identities + uidentities + profiles + enrollments)
+
     @classmethod
     def get_uuid_from_id(cls, db, sh_id):
         uuid = None
@@ -108,14 +212,189 @@ class SortingHat(object):
 
     @classmethod
     def add_identities(cls, db, identities, backend):
-        """ Load identities list from backend in Sorting Hat """
+        """ Load identities list from backend in Sorting Hat
 
-        logger.info("Adding the identities to SortingHat")
+        The identities already in Sorting Hat are found with a few bulk
+        queries, or skipped if they were already loaded by this process,
+        and only the new ones are added.
 
-        total = 0
+        :returns: number of identities added
+        """
 
+        logger.info("Adding the identities to SortingHat")
+        init = time()
+
+        ids = {}  # identity id -> identity
         for identity in identities:
-            cls.add_identity(db, identity, backend)
+            try:
+                sh_id = utils.uuid(backend, email=identity['email'],
+                                   name=identity['name'], username=identity['username'])
+            except ValueError:
+                logger.warning("Trying to add a None identity. Ignoring it.")
+                continue
+            if sh_id not in ids:
+                ids[sh_id] = identity
+
+        known = set(cls.get_uuids_from_ids(db, [sh_id for sh_id in ids
+                                                if sh_id not in cls.known_ids]))
+        known.update(cls.known_ids.intersection(ids))
+
+        total = 0
+        for sh_id, identity in ids.items():
+            # Enrollments from the company must be added also to known identities
+            if sh_id in known and identity.get('company') is None:
+                continue
+            if cls.add_identity(db, identity, backend):
+                cls.known_ids.add(sh_id)
             total += 1
+        cls.known_ids.update(known)
+
+        logger.info("Total identities added to SH: %i (%i already in SH) in %.2f sec",
+                    total, len(known), time() - init)
+
+        return total
+
+
+class SortingHatSnapshot():
+    """In memory copy of the SortingHat data needed to enrich items.
+
+    Identity ids, profiles and enrollments are loaded once, so enriching
+    items or refreshing their identities doesn't query the database per
+    identity. The enrollments of each unique identity are converted to
+    the organization of each period between the starts and ends of its
+    enrollments, so the organization when an item was done is found with
+    a binary search.
+
+    The snapshot is reloaded by update() when the version of the SortingHat
+    data is not the one loaded.
+
+    :param db: SortingHat database
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.version = None
+        self.checked = None  # last time the version was checked
+
+        self.uuids = {}  # identity id -> uuid
+        self.profiles = {}  # uuid -> (name, email, is_bot)
+        self.enrollments = {}  # uuid -> (first org name, bounds, org name of each period)
+
+    def load(self):
+        """ Load all the SortingHat data """
+
+        logger.info("Loading SortingHat snapshot")
+        init = time()
+
+        self.version = SortingHat.get_version(self.db)
+        self.checked = time()
+
+        uuids = {}
+        profiles = {}
+        enrollments = {}
+
+        with self.db.connect() as session:
+            query = session.query(Identity.id, Identity.uuid).yield_per(10000)
+            for sh_id, uuid in query:
+                uuids[sh_id] = uuid
+
+            query = session.query(Profile.uuid, Profile.name, Profile.email, Profile.is_bot).yield_per(10000)
+            for uuid, name, email, is_bot in query:
+                profiles[uuid] = (name, email, is_bot)
+
+            # Same order than api.enrollments, the first organization is
+            # used when there is not a date to find the enrollment
+            query = session.query(Enrollment.uuid, Enrollment.start, Enrollment.end, Organization.name).\
+                join(Organization, Enrollment.organization_id == Organization.id).\
+                order_by(Enrollment.uuid, Organization.name, Enrollment.start, Enrollment.end).\
+                yield_per(10000)
+            for uuid, start, end, org_name in query:
+                if uuid not in enrollments:
+                    enrollments[uuid] = (org_name, [])
+                enrollments[uuid][1].append((start, end, org_name))
+
+        for uuid, (_, intervals) in enrollments.items():
+            enrollments[uuid] = self.get_periods(intervals)
+
+        self.uuids = uuids
+        self.profiles = profiles
+        self.enrollments = enrollments
+
+        logger.info("SortingHat snapshot loaded in %.2f sec: %i identities, %i profiles, "
+                    "%i enrolled identities", time() - init, len(uuids), len(profiles), len(enrollments))
+
+    @staticmethod
+    def get_periods(intervals):
+        """ Organization of each period between the starts and ends of
+        the enrollments of a unique identity
+
+        The periods start at each enrollment start and just after each
+        end, as ends are inclusive. Their bounds are (date, 0) for starts
+        and (date, 1) for ends, so (item_date, 0.5) is placed with bisect
+        after the starts and before the ends of item_date.
+
+        :param intervals: list of (start, end, org name), in api.enrollments order
+        :returns: (first org name, bounds, org names), with org names[i] the
+            organization before bounds[i], None if not enrolled then
+        """
+        bounds = set((start, 0) for start, _, _ in intervals)
+        bounds.update((end, 1) for _, end, _ in intervals)
+        bounds = sorted(bounds)
+
+        # Not enrolled before the first start
+        org_names = [None]
+        for bound in bounds:
+            # Enrollments active in the period starting at bound. If several
+            # are active, the first one in api.enrollments order.
+            org_name = None
+            for start, end, name in intervals:
+                if (start, 0) <= bound < (end, 1):
+                    org_name = name
+                    break
+            org_names.append(org_name)
+
+        return intervals[0][2], bounds, org_names
+
+    def update(self):
+        """ Reload the snapshot if SortingHat data has changed
+
+        :returns: True if the snapshot was reloaded
+        """
+        self.checked = time()
+        if self.version == SortingHat.get_version(self.db):
+            return False
+
+        self.load()
+        return True
+
+    def get_uuid(self, sh_id):
+        """ uuid for an identity id, None if not found """
+        return self.uuids.get(sh_id)
+
+    def get_profile(self, uuid):
+        """ Profile with name and email for a uuid, empty if not found """
+
+        profile = {}
+        if uuid in self.profiles:
+            name, email, _ = self.profiles[uuid]
+            profile = {"name": name, "email": email}
+        return profile
+
+    def is_bot(self, uuid):
+        if uuid in self.profiles:
+            return self.profiles[uuid][2]
+        return False
+
+    def get_enrollment(self, uuid, item_date, default):
+        """ Organization of uuid when item_date, default if none found """
+
+        if uuid not in self.enrollments:
+            return default
+
+        first, bounds, org_names = self.enrollments[uuid]
+        if not item_date:
+            return first
+
+        org_name = org_names[bisect.bisect(bounds, (item_date, 0.5))]
 
-        logger.info("Total identities added to SH: %i", total)
+        return org_name if org_name else default
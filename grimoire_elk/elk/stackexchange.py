@@ -22,7 +22,6 @@
 #   Alvaro del Castillo San Felix <acs@bitergia.com>
 #
 
-import json
 import logging
 
 from .enrich import Enrich, metadata
@@ -215,42 +214,16 @@ class StackExchangeEnrich(Enrich):
 
         return eitem
 
-    def enrich_items(self, ocean_backend):
-        max_items = self.elastic.max_items_bulk
-        current = 0
-        total = 0
-        bulk_json = ""
-
-        url = self.elastic.index_url + '/items/_bulk'
-
-        logger.debug("Adding items to %s (in %i packs)", url, max_items)
-
-        items = ocean_backend.fetch()
-        for item in items:
-            if current >= max_items:
-                self.requests.put(url, data=bulk_json)
-                bulk_json = ""
-                current = 0
-
-            rich_item = self.get_rich_item(item)
-            data_json = json.dumps(rich_item)
-            bulk_json += '{"index" : {"_id" : "%s" } }\n' % \
-                (rich_item[self.get_field_unique_id()])
-            bulk_json += data_json + "\n"  # Bulk document
-            current += 1
-            total += 1
-            # Time to enrich also de answers
-            if 'answers' in item['data']:
-                for answer in item['data']['answers']:
-                    rich_answer = self.get_rich_item(answer, kind='answer', question_tags=rich_item['question_tags'])
-                    data_json = json.dumps(rich_answer)
-                    bulk_json += '{"index" : {"_id" : "%i_%i" } }\n' % \
-                        (rich_answer[self.get_field_unique_id()],
-                         rich_answer['answer_id'])
-                    bulk_json += data_json + "\n"  # Bulk document
-                    current += 1
-                    total += 1
-
-        self.requests.put(url, data=bulk_json)
-
-        return total
+    def get_rich_item_docs(self, item):
+        """ The question and its answers """
+
+        rich_item = self.get_rich_item(item)
+        yield rich_item[self.get_field_unique_id()], rich_item
+        # Time to enrich also de answers
+        if 'answers' in item['data']:
+            for answer in item['data']['answers']:
+                rich_answer = self.get_rich_item(answer, kind='answer',
+                                                 question_tags=rich_item['question_tags'])
+                answer_id = "%i_%i" % (rich_answer[self.get_field_unique_id()],
+                                       rich_answer['answer_id'])
+                yield answer_id, rich_answer
@@ -0,0 +1,244 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Persisted state of incremental studies
+#
+# Copyright (C) 2018 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+import hashlib
+import json
+import logging
+
+from datetime import datetime
+
+from .bulk import BulkWriter
+from ..elastic_mapping import Mapping as BaseMapping
+from ..ocean.conf import ConfOcean
+
+
+logger = logging.getLogger(__name__)
+
+HEADER_JSON = {"Content-Type": "application/json"}
+
+SCROLL_SIZE = 1000
+SCROLL_WAIT = '5m'
+# Only the fields of the hits used by the callers
+SCROLL_FILTER_PATH = "filter_path=_scroll_id,hits.hits._id,hits.hits._source"
+
+
+def scroll_docs(elastic, query, index_url=None, size=SCROLL_SIZE):
+    """ Scroll the hits of a query in the index of elastic (or in
+    index_url), clearing the scroll context once done """
+
+    query = dict(query, size=size)
+    if not index_url:
+        index_url = elastic.index_url
+
+    url = elastic.url + "/_search/scroll"
+    res = elastic.requests.post(index_url + "/_search?scroll=%s&%s" % (SCROLL_WAIT, SCROLL_FILTER_PATH),
+                                data=json.dumps(query), headers=HEADER_JSON)
+    scroll_id = None
+    try:
+        while True:
+            res.raise_for_status()
+            rjson = res.json()
+            scroll_id = rjson['_scroll_id']
+            # filter_path removes the hits when there are none
+            hits = rjson['hits']['hits'] if 'hits' in rjson else []
+            if not hits:
+                break
+            for hit in hits:
+                yield hit
+
+            res = elastic.requests.post(url + "?" + SCROLL_FILTER_PATH,
+                                        data=json.dumps({"scroll": SCROLL_WAIT, "scroll_id": scroll_id}),
+                                        headers=HEADER_JSON)
+    finally:
+        if scroll_id:
+            elastic.requests.delete(url, data=json.dumps({"scroll_id": [scroll_id]}),
+                                    headers=HEADER_JSON)
+
+
+class Mapping(BaseMapping):
+
+    @staticmethod
+    def get_elastic_mappings(es_major):
+        """Get Elasticsearch mapping.
+
+        :param es_major: major version of Elasticsearch, as string
+        :returns:        dictionary with a key, 'items', with the mapping
+        """
+
+        # study, index, origin and key are searched with term queries
+        if es_major == '2':
+            mapping = """
+            {
+                "properties": {
+                   "study": {"type": "string", "index": "not_analyzed"},
+                   "index": {"type": "string", "index": "not_analyzed"},
+                   "origin": {"type": "string", "index": "not_analyzed"},
+                   "key": {"type": "string", "index": "not_analyzed"},
+                   "state": {"type": "string", "index": "no"}
+               }
+            }"""
+        else:
+            mapping = """
+            {
+                "properties": {
+                   "study": {"type": "keyword"},
+                   "index": {"type": "keyword"},
+                   "origin": {"type": "keyword"},
+                   "key": {"type": "keyword"},
+                   "state": {"type": "text", "index": false}
+               }
+            }"""
+
+        return {"items": mapping}
+
+
+class StudyState():
+    """State of an incremental study over an enriched index.
+
+    The state of each key of the study (an author, a KIP...) is stored as
+    a document in the conf studies index of the same cluster, so the next
+    execution of the study only needs to process the new items. States are
+    stored as JSON strings so studies don't share a mapping.
+
+    Studies reading only the items of an origin, in indexes shared by
+    several origins, keep a state for each origin.
+
+    :param elastic: ElasticSearch object for the enriched index
+    :param study: name of the study
+    :param origin: origin of the items read by the study, None for all
+    """
+
+    max_ids_mget = 1000
+
+    def __init__(self, elastic, study, origin=None):
+        self.elastic = elastic
+        self.study = study
+        self.origin = origin
+        self.index_url = elastic.url + "/" + ConfOcean.conf_studies.split("/")[0]
+        self.url = elastic.url + "/" + ConfOcean.conf_studies
+        self.index_ready = False
+
+    def __setup_index(self):
+        """ Create the studies index with its mapping, if it doesn't exist """
+
+        if self.index_ready:
+            return
+
+        res = self.elastic.requests.head(self.index_url)
+        if res.status_code == 404:
+            mappings = {_type: json.loads(mapping) for _type, mapping
+                        in Mapping.get_elastic_mappings(self.elastic.major).items()}
+            res = self.elastic.requests.put(self.index_url, data=json.dumps({"mappings": mappings}),
+                                            headers=HEADER_JSON)
+            res.raise_for_status()
+            logger.info("Created index %s", self.index_url)
+        else:
+            res.raise_for_status()
+
+        self.index_ready = True
+
+    def __get_id(self, key):
+        scope = [self.study, self.elastic.index]
+        if self.origin:
+            scope.append(self.origin)
+        key = " ".join(scope + [str(key)])
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def get(self, keys):
+        """ Get the state for keys
+
+        :returns: dict with the state of the keys found
+        """
+        states = {}
+
+        keys = list(keys)
+        for i in range(0, len(keys), self.max_ids_mget):
+            ids = {self.__get_id(key): key for key in keys[i:i + self.max_ids_mget]}
+
+            res = self.elastic.requests.post(self.url + "/_mget", data=json.dumps({"ids": list(ids)}),
+                                             headers=HEADER_JSON)
+            if res.status_code == 404:
+                # No state stored yet
+                break
+            res.raise_for_status()
+
+            for doc in res.json()['docs']:
+                if doc.get('found'):
+                    states[ids[doc['_id']]] = json.loads(doc['_source']['state'])
+
+        return states
+
+    def get_all(self):
+        """ Get the state of all the keys of the study
+
+        :returns: dict with the state of each key
+        """
+        states = {}
+
+        query = {
+            "query": {
+                "bool": {
+                    "must": [
+                        {"term": {"study": self.study}},
+                        {"term": {"index": self.elastic.index}}
+                    ]
+                }
+            }
+        }
+        if self.origin:
+            query['query']['bool']['must'].append({"term": {"origin": self.origin}})
+
+        res = self.elastic.requests.head(self.url)
+        if res.status_code == 404:
+            # No state stored yet
+            return states
+
+        for hit in scroll_docs(self.elastic, query, self.url, self.max_ids_mget):
+            states[hit['_source']['key']] = json.loads(hit['_source']['state'])
+
+        return states
+
+    def set(self, states):
+        """ Store the state of each key in the states dict
+
+        :returns: number of states stored
+        """
+        now = datetime.utcnow().isoformat()
+
+        self.__setup_index()
+
+        with BulkWriter(self.elastic, self.url + "/_bulk", index=ConfOcean.conf_studies.split("/")[0]) as writer:
+            for key, state in states.items():
+                doc = {
+                    "study": self.study,
+                    "index": self.elastic.index,
+                    "key": key,
+                    "state": json.dumps(state),
+                    "metadata__updated_on": now
+                }
+                if self.origin:
+                    doc['origin'] = self.origin
+                writer.add(doc, self.__get_id(key))
+
+        logger.debug("Stored the state of %i keys for %s in %s", writer.inserted, self.study, self.url)
+
+        return writer.inserted
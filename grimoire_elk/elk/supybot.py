@@ -24,8 +24,7 @@
 
 import logging
 
-from dateutil import parser
-
+from .dates import parse_date_iso
 from .enrich import Enrich, metadata
 from ..elastic_mapping import Mapping as BaseMapping
 
@@ -124,7 +123,7 @@ class SupybotEnrich(Enrich):
             eitem[map_fields[fn]] = message[fn]
 
         # Enrich dates
-        eitem["update_date"] = parser.parse(item["metadata__updated_on"]).isoformat()
+        eitem["update_date"] = parse_date_iso(item["metadata__updated_on"])
         eitem["channel"] = eitem["origin"]
 
         eitem.update(self.get_grimoire_fields(eitem["update_date"], "message"))
@@ -24,9 +24,8 @@
 
 import logging
 
-from dateutil import parser
-
-from .enrich import Enrich, metadata, DEFAULT_PROJECT
+from .dates import parse_date_iso
+from .enrich import Enrich, metadata
 from ..elastic_mapping import Mapping as BaseMapping
 
 
@@ -108,6 +107,10 @@ class TwitterEnrich(Enrich):
 
         return identities
 
+    def get_project_repository_fields(self):
+        # The project depends on the list of hashtags
+        return None
+
     def get_item_project(self, eitem):
         """ Get project mapping enrichment field.
 
@@ -127,14 +130,7 @@ class TwitterEnrich(Enrich):
                 project = self.prjs_map[ds_name][tag]
                 break
 
-        if project is None:
-            project = DEFAULT_PROJECT
-
-        eitem_project = {"project": project}
-
-        eitem_project.update(self.add_project_levels(project))
-
-        return eitem_project
+        return self.get_project_fields(project)
 
     @metadata
     def get_rich_item(self, item):
@@ -153,7 +149,7 @@ class TwitterEnrich(Enrich):
             else:
                 eitem[f] = None
         # Date fields
-        eitem["created_at"] = parser.parse(tweet["created_at"]).isoformat()
+        eitem["created_at"] = parse_date_iso(tweet["created_at"])
         # Fields which names are translated
         map_fields = {"@timestamp": "timestamp",
                       "@version": "version"
@@ -27,6 +27,7 @@ import datetime
 import inspect
 import json
 import logging
+import os
 
 import requests
 
@@ -35,9 +36,16 @@ from requests.packages.urllib3.exceptions import InsecureRequestWarning
 
 from dateutil import parser, tz
 
+from .dates import parse_date
 
 logger = logging.getLogger(__name__)
 
+# Connection pools of the HTTP sessions
+HTTP_POOL_CONNECTIONS = 10  # hosts with a pool in a session
+HTTP_POOL_MAXSIZE = 10  # connections kept alive with each host
+
+_shared_cons = {}  # sessions shared in each process
+
 
 def get_repository_filter(perceval_backend, perceval_backend_name,
                           term=False):
@@ -90,9 +98,9 @@ def get_time_diff_days(start, end):
         return None
 
     if type(start) is not datetime.datetime:
-        start = parser.parse(start).replace(tzinfo=None)
+        start = parse_date(start).replace(tzinfo=None)
     if type(end) is not datetime.datetime:
-        end = parser.parse(end).replace(tzinfo=None)
+        end = parse_date(end).replace(tzinfo=None)
 
     seconds_day = float(60 * 60 * 24)
     diff_days = (end - start).total_seconds() / seconds_day
@@ -125,7 +133,9 @@ def grimoire_con(insecure=True, conn_retries=21, total=21):
     # Retry when there are errors in HTTP connections
     retries = Retry(total=total, connect=conn_retries, read=8, redirect=5, backoff_factor=0.2,
                     method_whitelist=False)
-    adapter = requests.adapters.HTTPAdapter(max_retries=retries)
+    adapter = requests.adapters.HTTPAdapter(max_retries=retries,
+                                            pool_connections=HTTP_POOL_CONNECTIONS,
+                                            pool_maxsize=HTTP_POOL_MAXSIZE)
     conn.mount('http://', adapter)
     conn.mount('https://', adapter)
 
@@ -136,6 +146,18 @@ def grimoire_con(insecure=True, conn_retries=21, total=21):
     return conn
 
 
+def get_grimoire_con(insecure=True):
+    """ Session shared by all the users of this process, so the connections
+    kept alive with each host are reused. Forked processes get their own
+    session, connections can't be shared with other processes. """
+
+    key = (os.getpid(), insecure)
+    if key not in _shared_cons:
+        _shared_cons[key] = grimoire_con(insecure)
+
+    return _shared_cons[key]
+
+
 def get_last_enrich(backend_cmd, enrich_backend):
     last_enrich = None
 
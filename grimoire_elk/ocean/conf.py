@@ -28,7 +28,7 @@
 import json
 import logging
 
-from grimoire_elk.elk.utils import grimoire_con
+from grimoire_elk.elk.utils import get_grimoire_con
 
 
 logger = logging.getLogger(__name__)
@@ -38,8 +38,14 @@ class ConfOcean(object):
 
     conf_index = "conf"
     conf_repos = conf_index + "/repos"
+    # ES 6 indexes have only one type, so checkpoints need their own index
+    conf_checkpoints = conf_index + "_checkpoints/items"
+    conf_studies = conf_index + "_studies/items"
+    conf_metrics = conf_index + "_metrics/items"
     elastic = None
-    requests_ses = grimoire_con()
+    requests_ses = None
+    # Store the metrics report of each feed and enrich task
+    store_metrics = False
 
     @classmethod
     def get_index(cls):
@@ -48,6 +54,7 @@ class ConfOcean(object):
     @classmethod
     def set_elastic(cls, elastic):
         cls.elastic = elastic
+        cls.requests_ses = get_grimoire_con()
 
         # Check conf index
         url = elastic.url + "/" + cls.conf_index
@@ -71,6 +78,25 @@ class ConfOcean(object):
 
         cls.requests_ses.post(url, data=json.dumps(repo))
 
+    @classmethod
+    def add_metrics(cls, unique_id, report):
+        ''' Add the metrics report of a task done with the repository unique_id.
+        The reports of all the tasks are kept. '''
+
+        if cls.elastic is None:
+            logger.error("Can't add metrics to conf. Ocean elastic is not configured")
+            return
+
+        url = cls.elastic.url + "/" + cls.conf_metrics
+        headers = {"Content-Type": "application/json"}
+
+        logger.debug("Adding metrics to Ocean %s %s" % (url, unique_id))
+
+        report = dict(report, unique_id=unique_id)
+        r = cls.requests_ses.post(url, data=json.dumps(report), headers=headers)
+        if r.status_code not in [200, 201]:
+            logger.error("Can't add metrics to %s: %s", url, r.text)
+
     @classmethod
     def get_repos(cls):
         ''' List of repos data in Ocean '''
@@ -113,3 +139,35 @@ class ConfOcean(object):
             [repos_ids.append(rep['_id']) for rep in repos_raw]
 
         return repos_ids
+
+    @classmethod
+    def get_checkpoint(cls, checkpoint_id):
+        ''' Get the checkpoint with checkpoint_id or None if not found '''
+
+        if cls.elastic is None:
+            logger.error("Can't get checkpoint. Ocean elastic is not configured")
+            return None
+
+        url = cls.elastic.url + "/" + cls.conf_checkpoints + "/" + checkpoint_id
+
+        r = cls.requests_ses.get(url)
+        if r.status_code != 200:
+            return None
+
+        return r.json()['_source']
+
+    @classmethod
+    def set_checkpoint(cls, checkpoint_id, checkpoint):
+        ''' Add or update the checkpoint with checkpoint_id '''
+
+        if cls.elastic is None:
+            logger.error("Can't set checkpoint. Ocean elastic is not configured")
+            return
+
+        url = cls.elastic.url + "/" + cls.conf_checkpoints + "/" + checkpoint_id
+        headers = {"Content-Type": "application/json"}
+
+        logger.debug("Setting checkpoint in Ocean %s %s" % (url, checkpoint))
+
+        r = cls.requests_ses.put(url, data=json.dumps(checkpoint), headers=headers)
+        r.raise_for_status()
@@ -30,6 +30,7 @@ import inspect
 import logging
 
 from datetime import datetime
+from ..elk.metrics import metrics
 from ..elk.utils import unixtime_to_datetime, get_repository_filter
 from ..elastic_items import ElasticItems
 from ..elastic_mapping import Mapping
@@ -40,6 +41,7 @@ logger = logging.getLogger(__name__)
 class ElasticOcean(ElasticItems):
 
     mapping = Mapping
+    raw_items = True
 
     @classmethod
     def add_params(cls, cmdline_parser):
@@ -207,26 +209,32 @@ class ElasticOcean(ElasticItems):
 
         task_init = datetime.now()
 
-        items_pack = []  # to feed item in packs
         drop = 0
         added = 0
 
-        for item in items:
-            # print("%s %s" % (item['url'], item['lastUpdated_date']))
-            # Add date field for incremental analysis if needed
-            self.add_update_date(item)
-            self._fix_item(item)
-            if self.project:
-                item['project'] = self.project
-            if len(items_pack) >= self.elastic.max_items_bulk:
-                self._items_to_es(items_pack)
-                items_pack = []
-            if not self.drop_item(item):
-                items_pack.append(item)
-                added += 1
-            else:
-                drop += 1
-        self._items_to_es(items_pack)
+        def items_to_feed():
+            """ Items prepared to be added to Ocean. The packs sent to ES
+            are controlled by the bulk size limits of the elastic object """
+            nonlocal drop, added
+
+            for item in items:
+                # print("%s %s" % (item['url'], item['lastUpdated_date']))
+                # Add date field for incremental analysis if needed
+                self.add_update_date(item)
+                self._fix_item(item)
+                if self.project:
+                    item['project'] = self.project
+                if not self.drop_item(item):
+                    added += 1
+                    yield item
+                else:
+                    drop += 1
+
+        self._items_to_es(items_to_feed())
+
+        metrics.observe("feed", (datetime.now() - task_init).total_seconds())
+        metrics.inc("feed_items", added)
+        metrics.inc("feed_dropped", drop)
 
         total_time_min = (datetime.now() - task_init).total_seconds() / 60
 
@@ -239,13 +247,12 @@ class ElasticOcean(ElasticItems):
     def _items_to_es(self, json_items):
         """ Append items JSON to ES (data source state) """
 
-        if len(json_items) == 0:
-            return
-
-        logger.info("Adding items to Ocean for %s (%i items)" %
-                    (self, len(json_items)))
+        logger.info("Adding items to Ocean for %s" % (self))
 
         field_id = self.get_field_unique_id()
 
         inserted = self.elastic.bulk_upload_sync(json_items, field_id)
+
+        logger.info("Added %i items to Ocean for %s" % (inserted, self))
+
         return inserted
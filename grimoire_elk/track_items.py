@@ -31,12 +31,10 @@ import requests
 from grimoire_elk.arthur import load_identities
 from grimoire_elk.elk.gerrit import GerritEnrich
 from grimoire_elk.elk.git import GitEnrich
-from grimoire_elk.elk.utils import grimoire_con
+from grimoire_elk.elk.utils import get_grimoire_con
 
 logger = logging.getLogger(__name__)
 
-requests_ses = grimoire_con()
-
 
 def fetch_track_items(upstream_file_url, data_source):
     """ The file format is:
@@ -50,7 +48,7 @@ def fetch_track_items(upstream_file_url, data_source):
     """
 
     track_uris = []
-    req = requests_ses.get(upstream_file_url)
+    req = get_grimoire_con().get(upstream_file_url)
     try:
         req.raise_for_status()
     except requests.exceptions.HTTPError as ex:
@@ -182,8 +180,8 @@ def _get_gerrit_reviews(es, index_gerrit_raw, gerrit_numbers):
         }
     }
 
-    req = requests_ses.post(es + "/" + index_gerrit_raw + "/_search?size=10000",
-                            data=json.dumps(query))
+    req = get_grimoire_con().post(es + "/" + index_gerrit_raw + "/_search?size=10000",
+                                  data=json.dumps(query))
     req.raise_for_status()
     reviews_es = req.json()["hits"]["hits"]
     reviews = []
@@ -221,8 +219,8 @@ def _get_git_commits(es, index_git_raw, commits_sha_list):
         }
     }
 
-    req = requests_ses.post(es + "/" + index_git_raw + "/_search?size=10000",
-                            data=json.dumps(query))
+    req = get_grimoire_con().post(es + "/" + index_git_raw + "/_search?size=10000",
+                                  data=json.dumps(query))
     req.raise_for_status()
     commits_es = req.json()["hits"]["hits"]
     commits = []
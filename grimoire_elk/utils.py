@@ -24,112 +24,17 @@
 #
 
 import argparse
+import importlib
 import logging
 import requests
 import sys
 
+from collections.abc import Mapping
+
 from dateutil import parser
 
 from .ocean.elastic import ElasticOcean
 
-# Connectors for Ocean
-from .ocean.askbot import AskbotOcean
-from .ocean.bugzilla import BugzillaOcean
-from .ocean.bugzillarest import BugzillaRESTOcean
-from .ocean.confluence import ConfluenceOcean
-from .ocean.crates import CratesOcean
-from .ocean.discourse import DiscourseOcean
-from .ocean.dockerhub import DockerHubOcean
-from .ocean.functest import FunctestOcean
-from .ocean.gerrit import GerritOcean
-from .ocean.git import GitOcean
-from .ocean.github import GitHubOcean
-from .ocean.jenkins import JenkinsOcean
-from .ocean.jira import JiraOcean
-from .ocean.kitsune import KitsuneOcean
-from .ocean.mbox import MBoxOcean
-from .ocean.mediawiki import MediaWikiOcean
-from .ocean.meetup import MeetupOcean
-from .ocean.mozillaclub import MozillaClubOcean
-from .ocean.nntp import NNTPOcean
-from .ocean.phabricator import PhabricatorOcean
-from .ocean.pipermail import PipermailOcean
-from .ocean.redmine import RedmineOcean
-from .ocean.remo2 import ReMoOcean
-from .ocean.rss import RSSOcean
-from .ocean.slack import SlackOcean
-from .ocean.stackexchange import StackExchangeOcean
-from .ocean.supybot import SupybotOcean
-from .ocean.telegram import TelegramOcean
-from .ocean.twitter import TwitterOcean
-
-# Connectors for EnrichOcean
-from .elk.askbot import AskbotEnrich
-from .elk.bugzilla import BugzillaEnrich
-from .elk.bugzillarest import BugzillaRESTEnrich
-from .elk.confluence import ConfluenceEnrich
-from .elk.crates import CratesEnrich
-from .elk.dockerhub import DockerHubEnrich
-from .elk.discourse import DiscourseEnrich
-from .elk.functest import FunctestEnrich
-from .elk.git import GitEnrich
-from .elk.github import GitHubEnrich
-from .elk.gerrit import GerritEnrich
-from .elk.gmane import GmaneEnrich
-from .elk.hyperkitty import HyperKittyEnrich
-from .elk.jenkins import JenkinsEnrich
-from .elk.jira import JiraEnrich
-from .elk.kitsune import KitsuneEnrich
-from .elk.mbox import MBoxEnrich
-from .elk.mediawiki import MediaWikiEnrich
-from .elk.meetup import MeetupEnrich
-from .elk.mozillaclub import MozillaClubEnrich
-from .elk.nntp import NNTPEnrich
-from .elk.phabricator import PhabricatorEnrich
-from .elk.redmine import RedmineEnrich
-# from .elk.remo import ReMoEnrich
-from .elk.remo2 import ReMoEnrich
-from .elk.rss import RSSEnrich
-from .elk.pipermail import PipermailEnrich
-from .elk.slack import SlackEnrich
-from .elk.stackexchange import StackExchangeEnrich
-from .elk.supybot import SupybotEnrich
-from .elk.telegram import TelegramEnrich
-from .elk.twitter import TwitterEnrich
-
-# Connectors for Perceval
-from perceval.backends.core.askbot import Askbot, AskbotCommand
-from perceval.backends.core.bugzilla import Bugzilla, BugzillaCommand
-from perceval.backends.core.bugzillarest import BugzillaREST, BugzillaRESTCommand
-from perceval.backends.core.discourse import Discourse, DiscourseCommand
-from perceval.backends.core.confluence import Confluence, ConfluenceCommand
-from perceval.backends.core.dockerhub import DockerHub, DockerHubCommand
-from perceval.backends.core.gerrit import Gerrit, GerritCommand
-from perceval.backends.core.git import Git, GitCommand
-from perceval.backends.core.github import GitHub, GitHubCommand
-from perceval.backends.core.gmane import Gmane, GmaneCommand
-from perceval.backends.core.jenkins import Jenkins, JenkinsCommand
-from perceval.backends.core.jira import Jira, JiraCommand
-from perceval.backends.core.hyperkitty import HyperKitty, HyperKittyCommand
-from perceval.backends.core.mbox import MBox, MBoxCommand
-from perceval.backends.core.mediawiki import MediaWiki, MediaWikiCommand
-from perceval.backends.core.meetup import Meetup, MeetupCommand
-from perceval.backends.core.nntp import NNTP, NNTPCommand
-from perceval.backends.core.phabricator import Phabricator, PhabricatorCommand
-from perceval.backends.core.pipermail import Pipermail, PipermailCommand
-from perceval.backends.core.redmine import Redmine, RedmineCommand
-from perceval.backends.core.rss import RSS, RSSCommand
-from perceval.backends.core.slack import Slack, SlackCommand
-from perceval.backends.core.stackexchange import StackExchange, StackExchangeCommand
-from perceval.backends.core.supybot import Supybot, SupybotCommand
-from perceval.backends.core.telegram import Telegram, TelegramCommand
-from perceval.backends.mozilla.crates import Crates, CratesCommand
-from perceval.backends.mozilla.kitsune import Kitsune, KitsuneCommand
-from perceval.backends.mozilla.mozillaclub import MozillaClub, MozillaClubCommand
-from perceval.backends.mozilla.remo import ReMo, ReMoCommand
-from perceval.backends.opnfv.functest import Functest, FunctestCommand
-
-
 from .elk.elastic import ElasticSearch
 from .elk.elastic import ElasticConnectException
 
@@ -139,24 +44,122 @@ logger = logging.getLogger(__name__)
 kibiter_version = None
 
 
-def get_connector_from_name(name):
-    found = None
-    connectors = get_connectors()
+# Classes of each connector: Perceval backend, Ocean, Enrich and Perceval
+# command. They are imported only when the connector is used, so loading
+# GrimoireELK doesn't import all the data sources.
+CONNECTORS = {
+    "askbot": ["perceval.backends.core.askbot.Askbot", ".ocean.askbot.AskbotOcean",
+               ".elk.askbot.AskbotEnrich", "perceval.backends.core.askbot.AskbotCommand"],
+    "bugzilla": ["perceval.backends.core.bugzilla.Bugzilla", ".ocean.bugzilla.BugzillaOcean",
+                 ".elk.bugzilla.BugzillaEnrich", "perceval.backends.core.bugzilla.BugzillaCommand"],
+    "bugzillarest": ["perceval.backends.core.bugzillarest.BugzillaREST", ".ocean.bugzillarest.BugzillaRESTOcean",
+                     ".elk.bugzillarest.BugzillaRESTEnrich", "perceval.backends.core.bugzillarest.BugzillaRESTCommand"],
+    "confluence": ["perceval.backends.core.confluence.Confluence", ".ocean.confluence.ConfluenceOcean",
+                   ".elk.confluence.ConfluenceEnrich", "perceval.backends.core.confluence.ConfluenceCommand"],
+    "crates": ["perceval.backends.mozilla.crates.Crates", ".ocean.crates.CratesOcean",
+               ".elk.crates.CratesEnrich", "perceval.backends.mozilla.crates.CratesCommand"],
+    "discourse": ["perceval.backends.core.discourse.Discourse", ".ocean.discourse.DiscourseOcean",
+                  ".elk.discourse.DiscourseEnrich", "perceval.backends.core.discourse.DiscourseCommand"],
+    "dockerhub": ["perceval.backends.core.dockerhub.DockerHub", ".ocean.dockerhub.DockerHubOcean",
+                  ".elk.dockerhub.DockerHubEnrich", "perceval.backends.core.dockerhub.DockerHubCommand"],
+    "functest": ["perceval.backends.opnfv.functest.Functest", ".ocean.functest.FunctestOcean",
+                 ".elk.functest.FunctestEnrich", "perceval.backends.opnfv.functest.FunctestCommand"],
+    "gerrit": ["perceval.backends.core.gerrit.Gerrit", ".ocean.gerrit.GerritOcean",
+               ".elk.gerrit.GerritEnrich", "perceval.backends.core.gerrit.GerritCommand"],
+    "git": ["perceval.backends.core.git.Git", ".ocean.git.GitOcean",
+            ".elk.git.GitEnrich", "perceval.backends.core.git.GitCommand"],
+    "github": ["perceval.backends.core.github.GitHub", ".ocean.github.GitHubOcean",
+               ".elk.github.GitHubEnrich", "perceval.backends.core.github.GitHubCommand"],
+    "gmane": ["perceval.backends.core.gmane.Gmane", ".ocean.mbox.MBoxOcean",
+              ".elk.gmane.GmaneEnrich", "perceval.backends.core.gmane.GmaneCommand"],
+    "hyperkitty": ["perceval.backends.core.hyperkitty.HyperKitty", ".ocean.mbox.MBoxOcean",
+                   ".elk.hyperkitty.HyperKittyEnrich", "perceval.backends.core.hyperkitty.HyperKittyCommand"],
+    "jenkins": ["perceval.backends.core.jenkins.Jenkins", ".ocean.jenkins.JenkinsOcean",
+                ".elk.jenkins.JenkinsEnrich", "perceval.backends.core.jenkins.JenkinsCommand"],
+    "jira": ["perceval.backends.core.jira.Jira", ".ocean.jira.JiraOcean",
+             ".elk.jira.JiraEnrich", "perceval.backends.core.jira.JiraCommand"],
+    "kitsune": ["perceval.backends.mozilla.kitsune.Kitsune", ".ocean.kitsune.KitsuneOcean",
+                ".elk.kitsune.KitsuneEnrich", "perceval.backends.mozilla.kitsune.KitsuneCommand"],
+    "mbox": ["perceval.backends.core.mbox.MBox", ".ocean.mbox.MBoxOcean",
+             ".elk.mbox.MBoxEnrich", "perceval.backends.core.mbox.MBoxCommand"],
+    "mediawiki": ["perceval.backends.core.mediawiki.MediaWiki", ".ocean.mediawiki.MediaWikiOcean",
+                  ".elk.mediawiki.MediaWikiEnrich", "perceval.backends.core.mediawiki.MediaWikiCommand"],
+    "meetup": ["perceval.backends.core.meetup.Meetup", ".ocean.meetup.MeetupOcean",
+               ".elk.meetup.MeetupEnrich", "perceval.backends.core.meetup.MeetupCommand"],
+    "mozillaclub": ["perceval.backends.mozilla.mozillaclub.MozillaClub", ".ocean.mozillaclub.MozillaClubOcean",
+                    ".elk.mozillaclub.MozillaClubEnrich", "perceval.backends.mozilla.mozillaclub.MozillaClubCommand"],
+    "nntp": ["perceval.backends.core.nntp.NNTP", ".ocean.nntp.NNTPOcean",
+             ".elk.nntp.NNTPEnrich", "perceval.backends.core.nntp.NNTPCommand"],
+    "phabricator": ["perceval.backends.core.phabricator.Phabricator", ".ocean.phabricator.PhabricatorOcean",
+                    ".elk.phabricator.PhabricatorEnrich", "perceval.backends.core.phabricator.PhabricatorCommand"],
+    "pipermail": ["perceval.backends.core.pipermail.Pipermail", ".ocean.pipermail.PipermailOcean",
+                  ".elk.pipermail.PipermailEnrich", "perceval.backends.core.pipermail.PipermailCommand"],
+    "redmine": ["perceval.backends.core.redmine.Redmine", ".ocean.redmine.RedmineOcean",
+                ".elk.redmine.RedmineEnrich", "perceval.backends.core.redmine.RedmineCommand"],
+    "remo": ["perceval.backends.mozilla.remo.ReMo", ".ocean.remo2.ReMoOcean",
+             ".elk.remo2.ReMoEnrich", "perceval.backends.mozilla.remo.ReMoCommand"],
+    "rss": ["perceval.backends.core.rss.RSS", ".ocean.rss.RSSOcean",
+            ".elk.rss.RSSEnrich", "perceval.backends.core.rss.RSSCommand"],
+    "slack": ["perceval.backends.core.slack.Slack", ".ocean.slack.SlackOcean",
+              ".elk.slack.SlackEnrich", "perceval.backends.core.slack.SlackCommand"],
+    "stackexchange": ["perceval.backends.core.stackexchange.StackExchange", ".ocean.stackexchange.StackExchangeOcean",
+                      ".elk.stackexchange.StackExchangeEnrich",
+                      "perceval.backends.core.stackexchange.StackExchangeCommand"],
+    "supybot": ["perceval.backends.core.supybot.Supybot", ".ocean.supybot.SupybotOcean",
+                ".elk.supybot.SupybotEnrich", "perceval.backends.core.supybot.SupybotCommand"],
+    "telegram": ["perceval.backends.core.telegram.Telegram", ".ocean.telegram.TelegramOcean",
+                 ".elk.telegram.TelegramEnrich", "perceval.backends.core.telegram.TelegramCommand"],
+    "twitter": [None, ".ocean.twitter.TwitterOcean", ".elk.twitter.TwitterEnrich", None]
+}
+
+
+def _get_class_path(path):
+    """ Absolute path (module.Class) of a connector class path """
+    return __package__ + path if path and path.startswith('.') else path
+
+
+def _load_class(path):
+    if not path:
+        return None
+    module_name, cls_name = _get_class_path(path).rsplit('.', 1)
+    return getattr(importlib.import_module(module_name), cls_name)
 
-    for cname in connectors:
-        if cname == name:
-            found = connectors[cname]
 
-    return found
+class Connectors(Mapping):
+    """Read only dict with the classes of each connector, which are
+    imported the first time the connector is got"""
+
+    def __init__(self, paths):
+        self.paths = paths
+        self.loaded = {}
+
+    def __getitem__(self, name):
+        if name not in self.loaded:
+            self.loaded[name] = [_load_class(path) for path in self.paths[name]]
+        return self.loaded[name]
+
+    def __iter__(self):
+        return iter(self.paths)
+
+    def __len__(self):
+        return len(self.paths)
+
+
+_connectors = Connectors(CONNECTORS)
+
+
+def get_connector_from_name(name):
+    return _connectors.get(name)
 
 
 def get_connector_name(cls):
     found = None
-    connectors = get_connectors()
+    cls_path = cls.__module__ + "." + cls.__name__
 
-    for cname in connectors:
-        for con in connectors[cname]:
-            if cls == con:
+    # Compare the paths, so the connectors are not imported
+    for cname, paths in CONNECTORS.items():
+        for path in paths:
+            if cls_path == _get_class_path(path):
                 if found:
                     # The canonical name is included in the classname
                     if cname in cls.__name__.lower():
@@ -168,16 +171,16 @@ def get_connector_name(cls):
 
 def get_connector_name_from_cls_name(cls_name):
     found = None
-    connectors = get_connectors()
 
-    for cname in connectors:
-        for con in connectors[cname]:
-            if not con:
+    for cname, paths in CONNECTORS.items():
+        for path in paths:
+            if not path:
                 continue
-            if cls_name == con.__name__:
+            con_name = path.rsplit('.', 1)[1]
+            if cls_name == con_name:
                 if found:
                     # The canonical name is included in the classname
-                    if cname in con.__name__.lower():
+                    if cname in con_name.lower():
                         found = cname
                 else:
                     found = cname
@@ -185,40 +188,8 @@ def get_connector_name_from_cls_name(cls_name):
 
 
 def get_connectors():
-
-    return {"askbot": [Askbot, AskbotOcean, AskbotEnrich, AskbotCommand],
-            "bugzilla": [Bugzilla, BugzillaOcean, BugzillaEnrich, BugzillaCommand],
-            "bugzillarest": [BugzillaREST, BugzillaRESTOcean, BugzillaRESTEnrich, BugzillaRESTCommand],
-            "confluence": [Confluence, ConfluenceOcean, ConfluenceEnrich, ConfluenceCommand],
-            "crates": [Crates, CratesOcean, CratesEnrich, CratesCommand],
-            "discourse": [Discourse, DiscourseOcean, DiscourseEnrich, DiscourseCommand],
-            "dockerhub": [DockerHub, DockerHubOcean, DockerHubEnrich, DockerHubCommand],
-            "functest": [Functest, FunctestOcean, FunctestEnrich, FunctestCommand],
-            "gerrit": [Gerrit, GerritOcean, GerritEnrich, GerritCommand],
-            "git": [Git, GitOcean, GitEnrich, GitCommand],
-            "github": [GitHub, GitHubOcean, GitHubEnrich, GitHubCommand],
-            "gmane": [Gmane, MBoxOcean, GmaneEnrich, GmaneCommand],
-            "hyperkitty": [HyperKitty, MBoxOcean, HyperKittyEnrich, HyperKittyCommand],
-            "jenkins": [Jenkins, JenkinsOcean, JenkinsEnrich, JenkinsCommand],
-            "jira": [Jira, JiraOcean, JiraEnrich, JiraCommand],
-            "kitsune": [Kitsune, KitsuneOcean, KitsuneEnrich, KitsuneCommand],
-            "mbox": [MBox, MBoxOcean, MBoxEnrich, MBoxCommand],
-            "mediawiki": [MediaWiki, MediaWikiOcean, MediaWikiEnrich, MediaWikiCommand],
-            "meetup": [Meetup, MeetupOcean, MeetupEnrich, MeetupCommand],
-            "mozillaclub": [MozillaClub, MozillaClubOcean, MozillaClubEnrich, MozillaClubCommand],
-            "nntp": [NNTP, NNTPOcean, NNTPEnrich, NNTPCommand],
-            "phabricator": [Phabricator, PhabricatorOcean, PhabricatorEnrich, PhabricatorCommand],
-            "pipermail": [Pipermail, PipermailOcean, PipermailEnrich, PipermailCommand],
-            "redmine": [Redmine, RedmineOcean, RedmineEnrich, RedmineCommand],
-            "remo": [ReMo, ReMoOcean, ReMoEnrich, ReMoCommand],
-            "rss": [RSS, RSSOcean, RSSEnrich, RSSCommand],
-            "slack": [Slack, SlackOcean, SlackEnrich, SlackCommand],
-            "stackexchange": [StackExchange, StackExchangeOcean,
-                              StackExchangeEnrich, StackExchangeCommand],
-            "supybot": [Supybot, SupybotOcean, SupybotEnrich, SupybotCommand],
-            "telegram": [Telegram, TelegramOcean, TelegramEnrich, TelegramCommand],
-            "twitter": [None, TwitterOcean, TwitterEnrich, None]
-            }  # Will come from Registry
+    """ Classes of all the connectors, imported on first use of each one """
+    return _connectors
 
 
 def get_elastic(url, es_index, clean=None, backend=None):
@@ -333,6 +304,13 @@ def get_params_parser():
     parser.add_argument('--db-sortinghat', help="SortingHat DB")
     parser.add_argument('--only-identities', action='store_true', help="Only add identities to SortingHat DB")
     parser.add_argument('--refresh-identities', action='store_true', help="Refresh identities in enriched items")
+    parser.add_argument('--refresh-identities-changes', action='store_true',
+                        help="Refresh in enriched items only the identities changed in SortingHat "
+                             "since the last refresh")
+    parser.add_argument('--enrich-workers', default=1, type=int,
+                        help="Number of processes getting the enriched items in parallel")
+    parser.add_argument('--sh-snapshot', action='store_true',
+                        help="Load all SortingHat data in memory instead of querying it per identity")
     parser.add_argument('--author_id', nargs='*', help="Field author_ids to be refreshed")
     parser.add_argument('--author_uuid', nargs='*', help="Field author_uuids to be refreshed")
     parser.add_argument('--github-token', help="If provided, github usernames will be retrieved in git enrich.")
@@ -341,8 +319,32 @@ def get_params_parser():
     parser.add_argument('--only-studies', action='store_true', help="Execute only studies.")
     parser.add_argument('--bulk-size', default=1000, type=int,
                         help="Number of items per bulk request to Elasticsearch.")
+    parser.add_argument('--bulk-mb', default=10, type=float,
+                        help="Max size in MB of a bulk request to Elasticsearch.")
+    parser.add_argument('--bulk-seconds', default=30, type=int,
+                        help="Max seconds collecting items before sending a bulk request.")
+    parser.add_argument('--bulk-workers', default=1, type=int,
+                        help="Number of bulk requests sent at the same time to Elasticsearch.")
+    parser.add_argument('--bulk-gzip', action='store_true',
+                        help="Compress the bulk requests to Elasticsearch with gzip.")
+    parser.add_argument('--http-pool-size', default=10, type=int,
+                        help="Max connections kept alive with each host, like Elasticsearch. "
+                        "Use at least the number of bulk workers plus scroll slices.")
     parser.add_argument('--scroll-size', default=100, type=int,
                         help="Number of items to get from Elasticsearch when scrolling.")
+    parser.add_argument('--scroll-slices', default=1, type=int,
+                        help="Number of slices of the scroll read in parallel (ES >= 5). "
+                        "Use at most the number of shards of the index.")
+    parser.add_argument('--scroll-unordered', action='store_true',
+                        help="Don't keep the incremental order of the items read from slices.")
+    parser.add_argument('--search-after', action='store_true',
+                        help="Read raw items with search_after instead of scroll (ES >= 5) "
+                        "and resume the enrichment from the last item enriched.")
+    parser.add_argument('--metrics-file', help="JSON file to write the metrics of the stages of the run.")
+    parser.add_argument('--metrics-prometheus',
+                        help="File to write the metrics of the stages of the run in Prometheus text format.")
+    parser.add_argument('--metrics-conf', action='store_true',
+                        help="Store the metrics of each feed and enrich task in the conf index.")
     parser.add_argument('--arthur', action='store_true', help="Read items from arthur redis queue")
     parser.add_argument('backend', help=argparse.SUPPRESS)
     parser.add_argument('backend_args', nargs=argparse.REMAINDER,
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+import json
+import logging
+import os.path
+import sys
+import unittest
+
+from unittest import mock
+
+if '..' not in sys.path:
+    sys.path.insert(0, '..')
+
+from grimoire_elk.arthur import EnrichCheckpoint, refresh_projects_groups, use_projects_groups
+from grimoire_elk.elk.bulk import BulkWriter
+from grimoire_elk.elk.git import GitEnrich
+from grimoire_elk.ocean.git import GitOcean
+
+
+class MockResponse:
+
+    def __init__(self, status_code, result=None):
+        self.status_code = status_code
+        self.result = result
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(self.status_code)
+
+    def json(self):
+        return self.result
+
+
+class MockElastic:
+    """Enriched index keeping the ids of the docs written"""
+
+    index = "git_enrich"
+    max_items_bulk = 3
+    max_bytes_bulk = None
+    max_seconds_bulk = None
+
+    def __init__(self):
+        self.requests = self
+        self.written = []
+
+    def put(self, url, data=None, headers=None):
+        lines = data.decode('ascii').splitlines()
+        items = [{"index": {"_id": json.loads(line)['index']['_id'], "status": 201}}
+                 for line in lines[0::2]]
+        self.written.extend(item['index']['_id'] for item in items)
+        return MockResponse(200, {"errors": False, "items": items})
+
+
+class MockProjectsIndex:
+    """Enriched index answering the composite aggregations and the
+    updates by query used to refresh the projects"""
+
+    url = "http://es"
+    index_url = "http://es/bugzilla_enrich"
+    major = '6'
+    minor = '4'
+    max_items_clause = 2
+
+    def __init__(self, items):
+        self.requests = self
+        self.items = items
+        self.updates = []
+
+    def post(self, url, data=None, headers=None):
+        query = json.loads(data)
+
+        if "/_update_by_query" in url:
+            items = [item for item in self.items if self.match(query['query'], item)]
+            for item in items:
+                item.update(query['script']['params']['project'])
+            self.updates.append(query['query'])
+            return MockResponse(200, {"updated": len(items)})
+
+        if 'stale' in query['aggs']:
+            filters = query['aggs']['stale']['filters']['filters']
+            buckets = {name: {"doc_count": len([item for item in self.items if self.match(stale, item)])}
+                       for name, stale in filters.items()}
+            return MockResponse(200, {"aggregations": {"stale": {"buckets": buckets}}})
+
+        composite = query['aggs']['groups']['composite']
+        groups = set()
+        for item in self.items:
+            groups.add(tuple((field, item.get(field)) for source in composite['sources'] for field in source))
+
+        buckets = [{"key": dict(key)} for key in sorted(groups, key=lambda key: [str(value) for _, value in key])]
+        if 'after' in composite:
+            after = [bucket['key'] for bucket in buckets].index(composite['after'])
+            buckets = buckets[after + 1:]
+        buckets = buckets[:composite['size']]
+
+        return MockResponse(200, {"aggregations": {"groups": {"buckets": buckets}}})
+
+    def match(self, query, item):
+        if 'bool' in query:
+            must_not = query['bool'].get('must_not', [])
+            must_not = must_not if isinstance(must_not, list) else [must_not]
+            return all(self.match(clause, item) for clause in query['bool'].get('filter', [])) and \
+                not any(self.match(clause, item) for clause in must_not)
+        if 'exists' in query:
+            return query['exists']['field'] in item
+        field, value = list(query['term'].items())[0]
+        return item.get(field) == value
+
+
+class ProjectsEnrich:
+    """Enricher with the project of each product"""
+
+    projects = {"Firefox": "mozilla.firefox", "Thunderbird": "mozilla.thunderbird"}
+
+    def __init__(self, elastic):
+        self.elastic = elastic
+
+    def get_project_repository_fields(self):
+        return ['origin', 'product']
+
+    def get_item_project(self, eitem):
+        project = self.projects.get(eitem.get('product'), "Main")
+        levels = project.split(".")
+        fields = {"project": project}
+        for i in range(len(levels)):
+            fields["project_%i" % (i + 1)] = ".".join(levels[:i + 1])
+        return fields
+
+
+class MockOcean:
+    """Raw items read with search_after, sorted by their position"""
+
+    def __init__(self, items):
+        self.items = items
+        self.positions = None
+
+    def fetch(self):
+        for i, item in enumerate(self.items):
+            if self.positions is not None:
+                self.positions.append([i])
+            yield item
+
+
+class TestEnrichCheckpoint(unittest.TestCase):
+    """Unit tests for EnrichCheckpoint class"""
+
+    def setUp(self):
+        ocean = GitOcean(None)
+        with open(os.path.join("data", "git.json")) as f:
+            self.items = json.load(f)
+        for item in self.items:
+            ocean.add_update_date(item)
+            ocean._fix_item(item)
+
+    def enrich(self, workers):
+        """ Enrich the items and get the checkpoints saved and the
+        docs written when each of them was saved """
+
+        elastic = MockElastic()
+        ocean = MockOcean(json.loads(json.dumps(self.items)))
+        enrich = GitEnrich()
+        enrich.enrich_workers = workers
+        enrich.enrich_batch_size = 2
+
+        saved = []
+
+        def save_checkpoint(ocean_backend, enrich_backend, search_after):
+            saved.append((search_after, list(elastic.written)))
+
+        checkpoint = EnrichCheckpoint(ocean, enrich)
+        checkpoint.save_packs = 1
+        with mock.patch('grimoire_elk.arthur.save_checkpoint', side_effect=save_checkpoint):
+            with BulkWriter(elastic, 'http://es/git_enrich/items/_bulk', workers=2,
+                            checkpoint=checkpoint) as writer:
+                for doc_id, doc in enrich.enrich_docs(ocean.fetch()):
+                    writer.add(doc, doc_id)
+
+        self.assertEqual(len(elastic.written), len(self.items))
+        self.assertEqual(enrich.enriched_items, len(self.items))
+
+        return saved
+
+    def test_marks(self):
+        """Test that the checkpoints saved only include items already written"""
+
+        for workers in [1, 3]:
+            saved = self.enrich(workers)
+            self.assertGreater(len(saved), 1)
+
+            positions = [search_after[0] for search_after, _ in saved]
+            self.assertListEqual(positions, sorted(positions))
+            # The last item can be in the last pack, saved by arthur at the end
+            self.assertGreaterEqual(positions[-1], len(self.items) - 1 - MockElastic.max_items_bulk)
+            for position, written in saved:
+                for item in self.items[:position[0] + 1]:
+                    self.assertIn(item['uuid'], written)
+
+    def test_save_packs(self):
+        """Test that the checkpoint is stored every save_packs packs"""
+
+        checkpoint = EnrichCheckpoint(MockOcean([]), GitEnrich())
+        checkpoint.save_packs = 3
+
+        with mock.patch('grimoire_elk.arthur.save_checkpoint') as save_checkpoint:
+            for mark in range(7):
+                checkpoint.save([mark])
+
+        self.assertListEqual([call[0][2] for call in save_checkpoint.call_args_list], [[2], [5]])
+
+
+class TestRefreshProjects(unittest.TestCase):
+    """Unit tests for the refresh of the projects per group of items"""
+
+    def test_refresh_projects_groups(self):
+        """Test that the items of the groups with other project are updated"""
+
+        items = [
+            {"origin": "https://bugzilla.mozilla.org", "product": "Firefox", "project": "Main", "project_1": "Main"},
+            {"origin": "https://bugzilla.mozilla.org", "product": "Firefox", "project": "Main", "project_1": "Main"},
+            {"origin": "https://bugzilla.mozilla.org", "product": "Thunderbird",
+             "project": "mozilla.thunderbird", "project_1": "mozilla", "project_2": "mozilla.thunderbird"},
+            {"origin": "https://bugzilla.mozilla.org", "product": "Thunderbird",
+             "project": "mozilla.thunderbird", "project_1": "thunderbird", "project_2": "mozilla.thunderbird"},
+            {"origin": "https://bugzilla.mozilla.org", "project": "Other", "project_1": "Other"},
+            {"origin": "https://bugzilla.mozilla.org", "product": "Other", "project": "Main", "project_1": "Main"}
+        ]
+        elastic = MockProjectsIndex(items)
+
+        self.assertEqual(refresh_projects_groups(ProjectsEnrich(elastic)), 3)
+
+        self.assertEqual(items[0]['project'], "mozilla.firefox")
+        self.assertEqual(items[1]['project_2'], "mozilla.firefox")
+        # Items with the same project but other project levels are refreshed
+        self.assertEqual(items[3]['project_1'], "mozilla")
+        # Items without some of the fields are refreshed too
+        self.assertEqual(items[4]['project'], "Main")
+        self.assertEqual(items[4]['project_1'], "Main")
+        self.assertIn({"bool": {"must_not": {"exists": {"field": "product"}}}},
+                      elastic.updates[1]['bool']['filter'])
+        # Only the items with other project fields are updated
+        self.assertEqual([len([item for item in items if elastic.match(update, item)]) for update in elastic.updates],
+                         [0, 0, 0])
+
+        # Nothing changed, nothing updated
+        self.assertEqual(refresh_projects_groups(ProjectsEnrich(elastic)), 0)
+
+    def test_use_projects_groups(self):
+        """Test that groups are only used with missing buckets (ES >= 6.4)"""
+
+        elastic = MockProjectsIndex([])
+        enrich = ProjectsEnrich(elastic)
+        for major, minor, groups in [('5', '6', False), ('6', '0', False), ('6', '3', False),
+                                     ('6', '4', True), ('7', '0', True)]:
+            elastic.major, elastic.minor = major, minor
+            self.assertEqual(use_projects_groups(enrich), groups)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    unittest.main()
@@ -34,7 +34,7 @@ if '..' not in sys.path:
     sys.path.insert(0, '..')
 
 from grimoire_elk.arthur import load_identities
-from grimoire_elk.utils import get_connectors, get_elastic
+from grimoire_elk.utils import get_connectors, get_connector_name, get_elastic
 
 
 CONFIG_FILE = 'tests.conf'
@@ -50,6 +50,17 @@ class TestBackends(unittest.TestCase):
         """Test whether the backends can be loaded """
         self.assertEqual(len(get_connectors()), NUMBER_BACKENDS)
 
+    def test_connector_name(self):
+        """Test the names of the connectors classes"""
+
+        git = get_connectors()['git']
+        self.assertEqual(git[2].__name__, 'GitEnrich')
+        for cls in git:
+            self.assertEqual(get_connector_name(cls), 'git')
+
+        # MBoxOcean is used by several connectors
+        self.assertEqual(get_connector_name(get_connectors()['hyperkitty'][1]), 'mbox')
+
     def test_read_data(self):
         """Test load all sources JSON"""
         config = configparser.ConfigParser()
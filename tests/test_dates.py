@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+import datetime
+import sys
+import unittest
+
+from dateutil import parser
+
+if '..' not in sys.path:
+    sys.path.insert(0, '..')
+
+from grimoire_elk.elk.dates import (parse_date,
+                                    parse_date_all,
+                                    parse_date_iso,
+                                    parse_date_utc)
+
+
+class TestDates(unittest.TestCase):
+    """Unit tests for the dates module"""
+
+    def test_parse_date(self):
+        """Test that dates are parsed as dateutil does"""
+
+        dates = ['2016-07-27T10:43:25.467921+00:00',
+                 '2016-07-27T10:43:25Z',
+                 '2016-07-27T10:43:25.4679-05:30',
+                 '2016-07-27T10:43:25+0200',
+                 '2016-07-27 10:43:25',
+                 '2016-07-27T10:43',
+                 '2016-07-27',
+                 'Fri Jul 1 17:48:15 2016 +0200',
+                 'Mon, 01 Dec 2014 10:14:44 +0100',
+                 'Mon, 1 Dec 2014 10:14:44 -0000',
+                 'Tue, 2 Feb 2016 10:11:12 +0530 (IST)',
+                 '27 July 2016']
+
+        for date in dates:
+            expected = parser.parse(date)
+            parsed = parse_date(date)
+            self.assertEqual(parsed, expected)
+            self.assertEqual(parsed.utcoffset(), expected.utcoffset())
+            self.assertEqual(parsed.isoformat(), expected.isoformat())
+
+    def test_parse_date_datetime(self):
+        """Test that datetimes are not parsed"""
+
+        date = datetime.datetime(2016, 7, 27)
+        self.assertIs(parse_date(date), date)
+
+    def test_parse_date_invalid(self):
+        """Test that invalid dates raise ValueError"""
+
+        with self.assertRaises(ValueError):
+            parse_date('2017-02-30T10:00:00')
+        with self.assertRaises(ValueError):
+            parse_date('not a date')
+
+    def test_helpers(self):
+        """Test the UTC and ISO helpers"""
+
+        date = 'Fri Jul 1 17:48:15 2016 +0200'
+
+        self.assertEqual(parse_date_utc(date), datetime.datetime(2016, 7, 1, 15, 48, 15))
+        self.assertEqual(parse_date_utc('2016-07-01 17:48:15'), datetime.datetime(2016, 7, 1, 17, 48, 15))
+        self.assertEqual(parse_date_iso(date), '2016-07-01T17:48:15+02:00')
+
+        parsed, utc, iso = parse_date_all(date)
+        self.assertEqual(parsed, parse_date(date))
+        self.assertEqual(utc, parse_date_utc(date))
+        self.assertEqual(iso, parse_date_iso(date))
+
+
+if __name__ == "__main__":
+    unittest.main()
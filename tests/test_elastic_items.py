@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+import json
+import logging
+import sys
+import unittest
+
+if '..' not in sys.path:
+    sys.path.insert(0, '..')
+
+from grimoire_elk.elastic_items import ElasticItems
+
+
+class MockElastic:
+
+    major = '6'
+    url = 'http://es'
+    index_url = 'http://es/items'
+
+
+class MockResponse:
+
+    def __init__(self, rjson):
+        self.rjson = rjson
+        self.text = json.dumps(rjson)
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.rjson
+
+
+class MockRequests:
+    """Search items sorted with search_after in an in memory index"""
+
+    def __init__(self, nitems):
+        self.items = [{"uuid": "%04i" % i, "metadata__timestamp": i // 3} for i in range(nitems)]
+        self.queries = []
+
+    def post(self, url, data, headers):
+        query = json.loads(data)
+        self.queries.append(query)
+        size = int(url.split("size=")[1])
+
+        hits = [{"_source": item, "sort": [item["metadata__timestamp"], item["uuid"]]}
+                for item in self.items]
+        if "search_after" in query:
+            hits = [hit for hit in hits if hit["sort"] > query["search_after"]]
+
+        return MockResponse({"hits": {"hits": hits[:size]}})
+
+
+class MockBackend:
+
+    origin = 'https://github.com/grimoirelab/perceval.git'
+    tag = origin
+
+
+class SlicedItems(ElasticItems):
+    """ElasticItems reading from an in memory index sliced by item number"""
+
+    raw_items = True
+
+    def __init__(self, nitems, perceval_backend=None):
+        super().__init__(perceval_backend)
+        self.elastic = MockElastic()
+        self.nitems = nitems
+        self.scrolls = {}
+        self.cleared = []
+
+    def get_connector_name(self):
+        return "git"
+
+    def get_elastic_items(self, elastic_scroll_id=None, _filter=None, slice_=None):
+        if not elastic_scroll_id:
+            slice_id = slice_['id'] if slice_ else 0
+            nslices = slice_['max'] if slice_ else 1
+            hits = [{"_source": {"id": i}, "sort": [i]} for i in range(self.nitems)
+                    if i % nslices == slice_id]
+            elastic_scroll_id = "scroll_%i" % slice_id
+            self.scrolls[elastic_scroll_id] = hits
+
+        hits = self.scrolls[elastic_scroll_id][:self.scroll_size]
+        self.scrolls[elastic_scroll_id] = self.scrolls[elastic_scroll_id][self.scroll_size:]
+
+        return {"_scroll_id": elastic_scroll_id, "hits": {"hits": hits}}
+
+    def clear_scroll(self, elastic_scroll_id):
+        self.cleared.append(elastic_scroll_id)
+
+
+class TestElasticItems(unittest.TestCase):
+    """Unit tests for ElasticItems class"""
+
+    def test_fetch(self):
+        """Test fetch with only one scroll"""
+
+        items = SlicedItems(25)
+        items.scroll_size = 10
+
+        ids = [item['id'] for item in items.fetch()]
+        self.assertListEqual(ids, list(range(25)))
+        self.assertListEqual(items.cleared, ["scroll_0"])
+
+    def test_fetch_sliced_ordered(self):
+        """Test fetch merging the slices in order"""
+
+        items = SlicedItems(250, perceval_backend=MockBackend())
+        items.scroll_size = 10
+        items.scroll_slices = 4
+
+        ids = [item['id'] for item in items.fetch()]
+        self.assertListEqual(ids, list(range(250)))
+        self.assertListEqual(sorted(items.cleared), ["scroll_0", "scroll_1", "scroll_2", "scroll_3"])
+
+    def test_fetch_sliced_unordered(self):
+        """Test fetch generating the items of the slices as they arrive"""
+
+        items = SlicedItems(250, perceval_backend=MockBackend())
+        items.scroll_size = 10
+        items.scroll_slices = 3
+        items.scroll_ordered = False
+
+        ids = [item['id'] for item in items.fetch()]
+        self.assertEqual(len(ids), 250)
+        self.assertSetEqual(set(ids), set(range(250)))
+
+    def test_fetch_sliced_close(self):
+        """Test that a sliced fetch can be stopped before reading all items"""
+
+        items = SlicedItems(1000, perceval_backend=MockBackend())
+        items.scroll_size = 10
+        items.scroll_slices = 2
+
+        fetched = items.fetch()
+        ids = [next(fetched)['id'] for _ in range(5)]
+        fetched.close()
+        self.assertListEqual(ids, list(range(5)))
+
+    def test_fetch_sliced_es2(self):
+        """Test that ES 2 uses only one scroll"""
+
+        items = SlicedItems(25)
+        items.elastic.major = '2'
+        items.scroll_slices = 4
+
+        ids = [item['id'] for item in items.fetch()]
+        self.assertListEqual(ids, list(range(25)))
+
+    def test_fetch_search_after(self):
+        """Test fetch using search_after pages"""
+
+        items = SlicedItems(25, perceval_backend=MockBackend())
+        items.requests = MockRequests(25)
+        items.search_after = True
+        items.scroll_size = 10
+
+        uuids = [item['uuid'] for item in items.fetch()]
+        self.assertListEqual(uuids, ["%04i" % i for i in range(25)])
+        self.assertListEqual(items.last_sort, [8, "0024"])
+        self.assertListEqual(items.cleared, [])
+
+        queries = items.requests.queries
+        self.assertEqual(len(queries), 3)
+        self.assertListEqual(queries[0]['sort'], [{"metadata__timestamp": {"order": "asc"}},
+                                                  {"uuid": {"order": "asc"}}])
+        self.assertNotIn('search_after', queries[0])
+        self.assertListEqual(queries[1]['search_after'], [3, "0009"])
+        self.assertListEqual(queries[2]['search_after'], [6, "0019"])
+
+    def test_fetch_search_after_checkpoint(self):
+        """Test fetch using search_after starting after a checkpoint"""
+
+        items = SlicedItems(25, perceval_backend=MockBackend())
+        items.requests = MockRequests(25)
+        items.search_after = True
+        items.checkpoint = [5, "0017"]
+
+        uuids = [item['uuid'] for item in items.fetch()]
+        self.assertListEqual(uuids, ["%04i" % i for i in range(18, 25)])
+        self.assertListEqual(items.requests.queries[0]['search_after'], [5, "0017"])
+
+    def test_fetch_search_after_positions(self):
+        """Test that the positions of the items fetched are tracked if requested"""
+
+        items = SlicedItems(25, perceval_backend=MockBackend())
+        items.requests = MockRequests(25)
+        items.search_after = True
+        items.scroll_size = 10
+
+        list(items.fetch())
+        self.assertIsNone(items.positions)
+
+        items.positions = []
+        list(items.fetch())
+        self.assertListEqual(items.positions, [[i // 3, "%04i" % i] for i in range(25)])
+
+    def test_fetch_search_after_enriched(self):
+        """Test that enriched items are read with scroll also with search_after"""
+
+        items = SlicedItems(25, perceval_backend=MockBackend())
+        items.raw_items = False
+        items.requests = MockRequests(25)
+        items.search_after = True
+
+        ids = [item['id'] for item in items.fetch()]
+        self.assertListEqual(ids, list(range(25)))
+        self.assertListEqual(items.requests.queries, [])
+        self.assertListEqual(items.cleared, ["scroll_0"])
+
+    def test_fetch_source(self):
+        """Test fetch reading only some fields of the items"""
+
+        items = SlicedItems(5, perceval_backend=MockBackend())
+        items.requests = MockRequests(5)
+        items.search_after = True
+        items.fetch_source = ["uuid"]
+
+        self.assertEqual(len(list(items.fetch())), 5)
+        self.assertListEqual(items.requests.queries[0]['_source'], ["uuid"])
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    unittest.main()
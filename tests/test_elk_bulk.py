@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+import json
+import logging
+import sys
+import unittest
+
+if '..' not in sys.path:
+    sys.path.insert(0, '..')
+
+from grimoire_elk.elk.bulk import BulkBody, BulkWriter
+from grimoire_elk.elk.metrics import metrics
+
+
+class MockResponse:
+
+    def __init__(self, status_code, result=None):
+        self.status_code = status_code
+        self.result = result
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(self.status_code)
+
+    def json(self):
+        return self.result
+
+
+class MockSession:
+    """Answers bulk requests with the statuses configured for each doc id"""
+
+    def __init__(self, statuses=None, rejected_requests=0):
+        self.statuses = statuses if statuses else {}
+        self.rejected_requests = rejected_requests
+        self.bodies = []
+
+    def put(self, url, data=None, headers=None):
+        self.bodies.append(data)
+
+        if self.rejected_requests:
+            self.rejected_requests -= 1
+            return MockResponse(429)
+
+        lines = data.decode('ascii').splitlines()
+        items = []
+        for line in lines[0::2]:
+            doc_id = json.loads(line)['index']['_id']
+            status = self.statuses.get(doc_id, [201]).pop(0) if doc_id in self.statuses else 201
+            item = {"_id": doc_id, "status": status}
+            if status >= 400:
+                item['error'] = {"type": "error_%i" % status}
+            items.append({"index": item})
+        errors = any('error' in item['index'] for item in items)
+
+        return MockResponse(200, {"errors": errors, "items": items})
+
+
+class MockElastic:
+
+    index = "i"
+    max_items_bulk = 2
+    max_bytes_bulk = None
+    max_seconds_bulk = None
+
+    def __init__(self, session):
+        self.requests = session
+
+
+class MockCheckpoint:
+    """Checkpoint marking the packs with the number of docs added"""
+
+    def __init__(self):
+        self.added = 0
+        self.saved = []
+
+    def get_mark(self):
+        return self.added
+
+    def save(self, mark):
+        self.saved.append(mark)
+
+
+class TestBulkBody(unittest.TestCase):
+    """Unit tests for BulkBody class"""
+
+    def test_add(self):
+        """Test the NDJSON generated when adding documents"""
+
+        bulk = BulkBody()
+        bulk.add({"a": 1}, "id1")
+        bulk.add({"b": "Dueñas"}, 2)
+
+        self.assertEqual(len(bulk), 2)
+
+        lines = bulk.getvalue().decode('ascii').split("\n")
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(lines[-1], '')
+        self.assertDictEqual(json.loads(lines[0]), {"index": {"_id": "id1"}})
+        self.assertDictEqual(json.loads(lines[1]), {"a": 1})
+        self.assertDictEqual(json.loads(lines[2]), {"index": {"_id": "2"}})
+        self.assertDictEqual(json.loads(lines[3]), {"b": "Dueñas"})
+        self.assertEqual(bulk.size, len(bulk.getvalue()))
+
+    def test_clear(self):
+        """Test that the buffer is reused after clearing it"""
+
+        bulk = BulkBody()
+        bulk.add({"a": 1}, "id1")
+        bulk.clear()
+
+        self.assertEqual(len(bulk), 0)
+        self.assertEqual(bulk.size, 0)
+        self.assertEqual(bulk.getvalue(), b'')
+
+        bulk.add({"c": 3}, "id3")
+        self.assertEqual(bulk.getvalue(), b'{"index": {"_id": "id3"}}\n{"c": 3}\n')
+
+    def test_is_full(self):
+        """Test the limits of items, bytes and time of a pack"""
+
+        bulk = BulkBody()
+        self.assertFalse(bulk.is_full())
+        bulk.add({"a": 1}, "id1")
+        self.assertFalse(bulk.is_full())
+
+        bulk = BulkBody(max_items=2)
+        bulk.add({"a": 1}, "id1")
+        self.assertFalse(bulk.is_full())
+        bulk.add({"a": 2}, "id2")
+        self.assertTrue(bulk.is_full())
+        bulk.clear()
+        self.assertFalse(bulk.is_full())
+
+        bulk = BulkBody(max_bytes=100)
+        bulk.add({"a": "x" * 10}, "id1")
+        self.assertFalse(bulk.is_full())
+        bulk.add({"a": "x" * 100}, "id2")
+        self.assertTrue(bulk.is_full())
+
+        bulk = BulkBody(max_seconds=0)
+        self.assertFalse(bulk.is_full())
+        bulk.add({"a": 1}, "id1")
+        self.assertTrue(bulk.is_full())
+
+
+class TestBulkWriter(unittest.TestCase):
+    """Unit tests for BulkWriter class"""
+
+    def setUp(self):
+        self.retry_backoff = BulkWriter.retry_backoff
+        BulkWriter.retry_backoff = 0
+
+    def tearDown(self):
+        BulkWriter.retry_backoff = self.retry_backoff
+
+    def test_write(self):
+        """Test that all packs are sent in order"""
+
+        session = MockSession()
+        with BulkWriter(MockElastic(session), 'http://es/i/items/_bulk') as writer:
+            for i in range(5):
+                writer.add({"value": i}, str(i))
+
+        self.assertEqual(writer.inserted, 5)
+        self.assertEqual(writer.failed, 0)
+        self.assertEqual(len(session.bodies), 3)
+        ids = [json.loads(line)['index']['_id']
+               for body in session.bodies
+               for line in body.decode('ascii').splitlines()[0::2]]
+        self.assertListEqual(ids, ['0', '1', '2', '3', '4'])
+
+    def test_retries(self):
+        """Test that rejected requests and items are retried"""
+
+        session = MockSession(statuses={'1': [429, 201]}, rejected_requests=1)
+        writer = BulkWriter(MockElastic(session), 'http://es/i/items/_bulk', workers=2)
+        for i in range(4):
+            writer.add({"value": i}, str(i))
+        inserted = writer.close()
+
+        self.assertEqual(inserted, 4)
+        self.assertEqual(writer.failed, 0)
+        # 2 packs, one request rejected and one item retried
+        self.assertEqual(len(session.bodies), 4)
+        retried = [body for body in session.bodies if body.count(b"\n") == 2]
+        self.assertEqual(retried, [b'{"index": {"_id": "1"}}\n{"value": 1}\n'])
+
+    def test_errors(self):
+        """Test that items failing are collected"""
+
+        session = MockSession(statuses={'1': [400], '2': [429] * 10})
+        with BulkWriter(MockElastic(session), 'http://es/i/items/_bulk') as writer:
+            for i in range(3):
+                writer.add({"value": i}, str(i))
+
+        self.assertEqual(writer.inserted, 1)
+        self.assertEqual(writer.failed, 2)
+        self.assertListEqual(writer.errors,
+                             [{"_id": "1", "status": 400, "error": {"type": "error_400"}},
+                              {"_id": "2", "status": 429, "error": {"type": "error_429"}}])
+
+    def test_metrics_index(self):
+        """Test that the metrics are labelled with the index, also behind a proxy path"""
+
+        metrics.pop()
+
+        session = MockSession()
+        with BulkWriter(MockElastic(session), 'https://es/proxy/i/items/_bulk') as writer:
+            writer.add({"value": 1}, "1")
+        with BulkWriter(MockElastic(session), 'https://es/proxy/other/items/_bulk', index="other") as writer:
+            writer.add({"value": 1}, "1")
+
+        counters, _ = metrics.pop()
+        indexes = sorted(dict(labels)['index'] for name, labels in counters if name == 'bulk_docs')
+        self.assertListEqual(indexes, ['i', 'other'])
+
+    def test_checkpoint(self):
+        """Test that the marks of the packs are saved in order once written"""
+
+        session = MockSession(statuses={'0': [429, 201]})
+        checkpoint = MockCheckpoint()
+        with BulkWriter(MockElastic(session), 'http://es/i/items/_bulk', workers=2,
+                        checkpoint=checkpoint) as writer:
+            for i in range(5):
+                writer.add({"value": i}, str(i))
+                checkpoint.added += 1
+
+        self.assertListEqual(checkpoint.saved, sorted(checkpoint.saved))
+        self.assertEqual(checkpoint.saved[-1], 5)
+
+        # Nothing is saved if a pack fails
+        session = MockSession(rejected_requests=10)
+        checkpoint = MockCheckpoint()
+        writer = BulkWriter(MockElastic(session), 'http://es/i/items/_bulk', checkpoint=checkpoint)
+        writer.add({"value": 1}, "1")
+        with self.assertRaises(RuntimeError):
+            writer.close()
+        self.assertListEqual(checkpoint.saved, [])
+
+    def test_request_error(self):
+        """Test that errors in the requests are raised when closing"""
+
+        session = MockSession(rejected_requests=10)
+        writer = BulkWriter(MockElastic(session), 'http://es/i/items/_bulk')
+        writer.add({"value": 1}, "1")
+
+        with self.assertRaises(RuntimeError):
+            writer.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    unittest.main()
@@ -21,6 +21,8 @@
 #     Jesus M. Gonzalez-Barahona <jgb@bitergia.com>
 #
 
+import gzip
+import json
 import logging
 import sys
 import unittest
@@ -33,6 +35,9 @@ if '..' not in sys.path:
 from grimoire_elk.elk.elastic import ElasticSearch, ElasticConnectException
 
 
+BULK_FILTER_PATH = "errors,items.*._id,items.*.status,items.*.error"
+
+
 class TestElasticSearch(unittest.TestCase):
     """Functional unit tests for ElasticSearch class"""
 
@@ -67,6 +72,10 @@ class TestElasticSearch(unittest.TestCase):
           "tagline" : "You Know, for Search"
         }"""
 
+        self.bulk_bodies = []
+        self.bulk_queries = []
+        self.refreshes = 0
+
         status_err = 400
         self.url_es5 = 'http://es5.com'
         self.url_es5_err = 'http://es5_err.com'
@@ -82,10 +91,34 @@ class TestElasticSearch(unittest.TestCase):
                                body=self.body_es6)
         httpretty.register_uri(httpretty.GET, self.url_es6_err,
                                status=status_err)
+        httpretty.register_uri(httpretty.GET, self.url_es6 + '/test',
+                               body='{}')
+        httpretty.register_uri(httpretty.PUT, self.url_es6 + '/test/items/_bulk',
+                               body=self.bulk_callback)
+        httpretty.register_uri(httpretty.POST, self.url_es6 + '/test/_refresh',
+                               body=self.refresh_callback)
+
+        ElasticSearch.clear_bootstrap_cache()
+
+    def bulk_callback(self, request, uri, headers):
+        body = request.body
+        if request.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        self.bulk_bodies.append(body)
+        self.bulk_queries.append(request.querystring)
+        lines = body.decode('ascii').splitlines()
+        items = [{"index": {"_id": json.loads(line)["index"]["_id"], "status": 201}}
+                 for line in lines[0::2]]
+        return 200, headers, json.dumps({"errors": False, "items": items})
+
+    def refresh_callback(self, request, uri, headers):
+        self.refreshes += 1
+        return 200, headers, '{}'
 
     def tearDown(self):
 
         httpretty.disable()
+        httpretty.reset()
 
     def test_check_instance(self):
         """Test _check_instance function"""
@@ -98,6 +131,98 @@ class TestElasticSearch(unittest.TestCase):
         with self.assertRaises(ElasticConnectException):
             major = ElasticSearch._check_instance(self.url_es6_err, False)
 
+    def test_bootstrap_cache(self):
+        """Test that the cluster and the index are checked only once"""
+
+        def get_requests():
+            return [(request.method, request.path) for request in httpretty.latest_requests()]
+
+        elastic = ElasticSearch(self.url_es6, 'test')
+        self.assertEqual(elastic.major, '6')
+        self.assertListEqual(get_requests(), [('GET', '/'), ('GET', '/test')])
+
+        elastic = ElasticSearch(self.url_es6, 'test')
+        self.assertEqual(elastic.major, '6')
+        self.assertEqual(len(get_requests()), 2)
+
+        # A new index in the same cluster is created, the version is known
+        httpretty.register_uri(httpretty.GET, self.url_es6 + '/test2', status=404)
+        httpretty.register_uri(httpretty.PUT, self.url_es6 + '/test2', body='{}')
+        ElasticSearch(self.url_es6, 'test2')
+        self.assertListEqual(get_requests()[2:], [('GET', '/test2'), ('PUT', '/test2')])
+
+        # The index is checked again if the analyzers change
+        ElasticSearch(self.url_es6, 'test', analyzers='{"settings": {}}')
+        self.assertListEqual(get_requests()[4:], [('GET', '/test')])
+
+    def test_bulk_upload(self):
+        """Test bulk_upload function sending several packs"""
+
+        elastic = ElasticSearch(self.url_es6, 'test')
+        elastic.max_items_bulk = 2
+
+        items = [{"uuid": str(i), "value": i} for i in range(5)]
+        inserted = elastic.bulk_upload(items, "uuid")
+        self.assertEqual(inserted, 5)
+
+        self.assertEqual(len(self.bulk_bodies), 3)
+        last_lines = self.bulk_bodies[-1].decode('ascii').splitlines()
+        self.assertEqual(json.loads(last_lines[0]), {"index": {"_id": "4"}})
+        self.assertEqual(json.loads(last_lines[1]), items[4])
+
+        self.assertEqual(elastic.bulk_upload([], "uuid"), 0)
+
+    def test_bulk_upload_max_bytes(self):
+        """Test bulk_upload function sending packs limited by size"""
+
+        elastic = ElasticSearch(self.url_es6, 'test')
+        elastic.max_bytes_bulk = 1024
+
+        items = [{"uuid": str(i), "value": "x" * 500} for i in range(5)]
+        inserted = elastic.bulk_upload(items, "uuid")
+        self.assertEqual(inserted, 5)
+        self.assertEqual(len(self.bulk_bodies), 3)
+        for body in self.bulk_bodies[:-1]:
+            self.assertGreaterEqual(len(body), 1024)
+
+    def test_bulk_upload_refresh(self):
+        """Test the refresh modes of bulk_upload and bulk_upload_sync"""
+
+        elastic = ElasticSearch(self.url_es6, 'test')
+        elastic.max_items_bulk = 2
+        items = [{"uuid": str(i), "value": i} for i in range(3)]
+
+        elastic.bulk_upload(items, "uuid")
+        self.assertEqual(self.refreshes, 0)
+        self.assertEqual(self.bulk_queries, [{'filter_path': [BULK_FILTER_PATH]}] * 2)
+
+        elastic.bulk_upload_sync(items, "uuid")
+        self.assertEqual(self.refreshes, 1)
+
+        elastic.bulk_upload_sync(items, "uuid", sync=False)
+        self.assertEqual(self.refreshes, 1)
+
+        self.bulk_queries = []
+        elastic.bulk_upload(items, "uuid", refresh='wait_for')
+        self.assertEqual(self.refreshes, 1)
+        self.assertEqual(self.bulk_queries, [{'refresh': ['wait_for'],
+                                              'filter_path': [BULK_FILTER_PATH]}] * 2)
+
+    def test_bulk_upload_gzip(self):
+        """Test bulk_upload sending the packs compressed"""
+
+        elastic = ElasticSearch(self.url_es6, 'test')
+        elastic.max_items_bulk = 2
+        elastic.bulk_gzip = True
+
+        items = [{"uuid": str(i), "value": i} for i in range(3)]
+        inserted = elastic.bulk_upload(items, "uuid")
+        self.assertEqual(inserted, 3)
+
+        self.assertEqual(len(self.bulk_bodies), 2)
+        last_lines = self.bulk_bodies[-1].decode('ascii').splitlines()
+        self.assertEqual(json.loads(last_lines[1]), items[2])
+
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
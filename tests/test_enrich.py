@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+import json
+import logging
+import os.path
+import sys
+import unittest
+
+from datetime import datetime
+from unittest import mock
+
+if '..' not in sys.path:
+    sys.path.insert(0, '..')
+
+from grimoire_elk.elk.enrich import Enrich, SORTINGHAT_LIBS
+from grimoire_elk.elk.git import GitEnrich
+from grimoire_elk.ocean.git import GitOcean
+from grimoire_elk.utils import get_connectors
+
+if SORTINGHAT_LIBS:
+    from sortinghat import utils as sh_utils
+
+
+class IdentitiesEnrich(Enrich):
+    """Enricher of items with a list of identities"""
+
+    def get_connector_name(self):
+        return "test"
+
+    def get_identities(self, item):
+        for identity in item['identities']:
+            yield identity
+
+
+class ProjectsEnrich(Enrich):
+    """Enricher of items whose repository is their origin"""
+
+    def get_connector_name(self):
+        return "git"
+
+    def get_project_repository(self, eitem):
+        return eitem['origin']
+
+
+class RepositoriesMap(dict):
+    """Projects map with a project for any repository"""
+
+    def __contains__(self, repository):
+        return True
+
+    def __getitem__(self, repository):
+        return "project " + repository
+
+
+def get_rich_docs(name):
+    """ Rich docs of the items in tests/data for a connector """
+
+    connector = get_connectors()[name]
+    ocean = connector[1](None)
+    enrich = connector[2]()
+    if name == "discourse":
+        # Don't read the categories from the site
+        enrich.categories = {21: "General", 22: "Support", 25: "Events", 51: "Firefox", 58: "Web"}
+        enrich.categories_tree = {22: [51, 58]}
+
+    with open(os.path.join("data", name + ".json")) as f:
+        items = json.load(f)
+
+    docs = []
+    for item in items:
+        ocean.add_update_date(item)
+        ocean._fix_item(item)
+        docs.extend(doc for _, doc in enrich.get_rich_item_docs(item))
+
+    return enrich, docs
+
+
+class TestEnrich(unittest.TestCase):
+    """Unit tests for Enrich class"""
+
+    @unittest.skipIf(not SORTINGHAT_LIBS, "SortingHat not available")
+    def test_resolve_sh_identities(self):
+        """Test that the identities of the items are resolved in bulk once"""
+
+        john = {"name": "John", "email": "john@example.com", "username": None}
+        jane = {"name": "Jane", "email": None, "username": "jane"}
+        empty = {"name": None, "email": None, "username": None}
+        items = [
+            {"identities": [john, empty]},
+            {"identities": [jane, john]}
+        ]
+        john_id = sh_utils.uuid("test", email=john['email'], name=john['name'], username=None)
+        jane_id = sh_utils.uuid("test", email=None, name=jane['name'], username=jane['username'])
+        enrollments = [(datetime(2010, 1, 1), datetime(2012, 1, 1), "Bitergia")]
+
+        enrich = IdentitiesEnrich()
+        enrich.sortinghat = True
+
+        with mock.patch('grimoire_elk.elk.enrich.SortingHat') as sortinghat:
+            sortinghat.get_uuids_from_ids.return_value = {john_id: "john_uuid"}
+            sortinghat.get_profiles.return_value = {
+                "john_uuid": {"name": "John Smith", "email": "jsmith@bitergia.com", "is_bot": False}
+            }
+            sortinghat.get_enrollments.return_value = {"john_uuid": enrollments}
+
+            self.assertListEqual(list(enrich.prefetch_sh_identities(items)), items)
+
+            # One query for all the identities, empty ones are not in SortingHat
+            sortinghat.get_uuids_from_ids.assert_called_once()
+            self.assertCountEqual(sortinghat.get_uuids_from_ids.call_args[0][1], [john_id, jane_id])
+            self.assertSetEqual(sortinghat.get_profiles.call_args[0][1], {"john_uuid"})
+
+            # The fields are got from the identities resolved
+            fields = enrich.get_item_sh_fields(john, datetime(2011, 1, 1))
+            self.assertEqual(fields['author_id'], john_id)
+            self.assertEqual(fields['author_uuid'], "john_uuid")
+            self.assertEqual(fields['author_name'], "John Smith")
+            self.assertEqual(fields['author_domain'], "bitergia.com")
+            self.assertEqual(fields['author_org_name'], "Bitergia")
+            self.assertEqual(fields['author_bot'], False)
+            fields = enrich.get_item_sh_fields(john, datetime(2013, 1, 1))
+            self.assertEqual(fields['author_org_name'], "Unknown")
+
+            # Only the identities not found before are queried again
+            sortinghat.reset_mock()
+            list(enrich.prefetch_sh_identities(items))
+            self.assertListEqual(list(sortinghat.get_uuids_from_ids.call_args[0][1]), [jane_id])
+            self.assertSetEqual(sortinghat.get_profiles.call_args[0][1], set())
+
+    def test_enrich_docs_parallel(self):
+        """Test that enriching in several processes gives the same docs"""
+
+        ocean = GitOcean(None)
+        with open(os.path.join("data", "git.json")) as f:
+            items = json.load(f)
+        for item in items:
+            ocean.add_update_date(item)
+            ocean._fix_item(item)
+
+        def get_docs(workers):
+            enrich = GitEnrich()
+            enrich.enrich_workers = workers
+            enrich.enrich_batch_size = 5
+            docs = []
+            for doc_id, doc in enrich.enrich_docs(json.loads(json.dumps(items))):
+                doc.pop('metadata__enriched_on')
+                docs.append((doc_id, doc))
+            return docs
+
+        serial = get_docs(1)
+        self.assertEqual(len(serial), len(items))
+        self.assertListEqual(get_docs(3), serial)
+
+    def test_find_origin_project(self):
+        """Test the project of the first repository containing the origin"""
+
+        enrich = ProjectsEnrich()
+        enrich.prjs_map = {
+            "git": {
+                "https://github.com/chaoss/grimoirelab-perceval": "grimoirelab.perceval",
+                "https://github.com/chaoss/grimoirelab-elk": "grimoirelab",
+                "https://github.com/chaoss/grimoirelab-elk.git": "grimoirelab.other"
+            },
+            "discourse": {12: "community", 3: "support"}
+        }
+
+        self.assertEqual(enrich.find_origin_project("git", "chaoss/grimoirelab-perceval"),
+                         "grimoirelab.perceval")
+        self.assertEqual(enrich.find_origin_project("git", "grimoirelab-elk"), "grimoirelab")
+        self.assertEqual(enrich.find_origin_project("git", "grimoirelab-elk.git"), "grimoirelab.other")
+        self.assertIsNone(enrich.find_origin_project("git", "grimoirelab-sirmordred"))
+        self.assertEqual(enrich.find_origin_project("discourse", "3"), "support")
+        self.assertEqual(enrich.find_origin_project("discourse", "2"), "community")
+
+    def test_get_item_project(self):
+        """Test that the project of each repository is found once"""
+
+        enrich = ProjectsEnrich()
+        enrich.prjs_map = {
+            "git": {
+                "https://github.com/chaoss/grimoirelab-perceval": "grimoirelab.perceval",
+                "https://github.com/chaoss/grimoirelab-elk": "grimoirelab"
+            }
+        }
+
+        with mock.patch.object(enrich, 'find_item_project', wraps=enrich.find_item_project) as find:
+            project = enrich.get_item_project({"origin": "https://github.com/chaoss/grimoirelab-perceval"})
+            self.assertDictEqual(project, {"project": "grimoirelab.perceval", "project_1": "grimoirelab",
+                                           "project_2": "grimoirelab.perceval"})
+            # The project fields are copies of the cached ones
+            project['project'] = "changed"
+
+            project = enrich.get_item_project({"origin": "https://github.com/chaoss/grimoirelab-perceval"})
+            self.assertEqual(project['project'], "grimoirelab.perceval")
+            self.assertEqual(find.call_count, 1)
+
+            project = enrich.get_item_project({"origin": "grimoirelab-elk"})
+            self.assertDictEqual(project, {"project": "grimoirelab", "project_1": "grimoirelab"})
+            project = enrich.get_item_project({"origin": "https://gitlab.com/other"})
+            self.assertDictEqual(project, {"project": "Main", "project_1": "Main"})
+            enrich.get_item_project({"origin": "https://gitlab.com/other"})
+            self.assertEqual(find.call_count, 3)
+
+    def test_get_project_repository_fields(self):
+        """Test that the project of the items is found from their project repository fields"""
+
+        connectors = ["bugzilla", "bugzillarest", "confluence", "discourse", "gerrit", "jira", "meetup"]
+        for name in connectors:
+            enrich, docs = get_rich_docs(name)
+            fields = enrich.get_project_repository_fields()
+            self.assertNotEqual(fields, ['origin'])
+
+            for doc in docs:
+                enrich.prjs_map = {enrich.get_connector_name(): RepositoriesMap()}
+                project = enrich.get_item_project(doc)
+                # Other items with the same fields have the same project
+                enrich.prjs_cache = {}
+                self.assertDictEqual(enrich.get_item_project({field: doc[field] for field in fields}),
+                                     project, name)
+
+        # The project of tweets depends on their hashtags
+        enrich = get_connectors()["twitter"][2]()
+        self.assertIsNone(enrich.get_project_repository_fields())
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    unittest.main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+import copy
+import json
+import logging
+import os.path
+import sys
+import unittest
+
+if '..' not in sys.path:
+    sys.path.insert(0, '..')
+
+from grimoire_elk.utils import get_connectors
+
+
+# Connectors which create several docs for each raw item
+CONNECTORS = ['askbot', 'discourse', 'kitsune', 'meetup', 'stackexchange']
+
+
+class TestEnrichDocs(unittest.TestCase):
+    """Unit tests for the rich docs of the connectors with several docs
+    per item, compared with the docs in data/<connector>_enriched.json"""
+
+    def get_enrich(self, con):
+        enrich = get_connectors()[con][2]()
+        if con == 'discourse':
+            # Don't read the categories from the site
+            enrich.categories = {21: "General", 22: "Support", 25: "Events", 51: "Firefox", 58: "Web"}
+            enrich.categories_tree = {22: [51, 58]}
+        return enrich
+
+    def get_items(self, con):
+        ocean = get_connectors()[con][1](None)
+        with open(os.path.join("data", con + ".json")) as f:
+            items = json.load(f)
+        for item in items:
+            ocean.add_update_date(item)
+            ocean._fix_item(item)
+        return items
+
+    def get_expected(self, con):
+        expected = {}
+        with open(os.path.join("data", con + "_enriched.json")) as f:
+            for line in f:
+                doc = json.loads(line)
+                expected[doc['_id']] = doc['_source']
+        return expected
+
+    def test_rich_docs(self):
+        """Test that the docs are the same, enriching in one or several processes"""
+
+        for con in CONNECTORS:
+            expected = self.get_expected(con)
+            items = self.get_items(con)
+
+            for workers in [1, 2]:
+                enrich = self.get_enrich(con)
+                enrich.enrich_workers = workers
+                enrich.enrich_batch_size = 3
+
+                docs = {}
+                for doc_id, doc in enrich.enrich_docs(copy.deepcopy(items)):
+                    doc.pop('metadata__enriched_on')
+                    docs[str(doc_id)] = doc
+
+                with self.subTest(con=con, workers=workers):
+                    self.assertListEqual(sorted(docs), sorted(expected))
+                    for doc_id, doc in expected.items():
+                        self.assertDictEqual(docs[doc_id], doc, doc_id)
+
+    def test_rich_item_docs(self):
+        """Test that all the docs of each item are generated together"""
+
+        for con in CONNECTORS:
+            expected = self.get_expected(con)
+            enrich = self.get_enrich(con)
+
+            ids = []
+            for item in self.get_items(con):
+                docs = list(enrich.get_rich_item_docs(item))
+                with self.subTest(con=con, item=item['uuid']):
+                    # The rich item first, then the rest of its docs
+                    doc_id, doc = docs[0]
+                    doc.pop('metadata__enriched_on')
+                    self.assertDictEqual(doc, expected[str(doc_id)])
+                    self.assertEqual(doc['metadata__updated_on'], item['metadata__updated_on'])
+                ids.extend(str(doc_id) for doc_id, _ in docs)
+
+            # Each doc has its own id
+            self.assertCountEqual(ids, expected)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    unittest.main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+import json
+import logging
+import os.path
+import sys
+import unittest
+
+if '..' not in sys.path:
+    sys.path.insert(0, '..')
+
+from grimoire_elk.elk.git import GitEnrich
+from grimoire_elk.ocean.git import GitOcean
+
+
+class TestEnrichGit(unittest.TestCase):
+    """Unit tests for the rich docs of GitEnrich"""
+
+    def setUp(self):
+        ocean = GitOcean(None)
+        with open(os.path.join("data", "git.json")) as f:
+            self.items = json.load(f)
+        for item in self.items:
+            ocean.add_update_date(item)
+            ocean._fix_item(item)
+
+        self.enrich = GitEnrich()
+
+    def test_rich_item_docs(self):
+        """Test that there is one doc per commit, with its uuid as id"""
+
+        for item in self.items:
+            docs = list(self.enrich.get_rich_item_docs(item))
+            self.assertEqual(len(docs), 1)
+            self.assertEqual(docs[0][0], item['uuid'])
+            self.assertEqual(docs[0][1]['git_uuid'], item['uuid'])
+
+    def test_multi_author_docs(self):
+        """Test the docs of the authors of pair programming commits"""
+
+        self.enrich.pair_programming = True
+
+        item = self.items[0]
+        item['data']['Author'] = "Jane Doe and John Smith <pair@example.com>"
+        item['data']['Signed-off-by'] = ["Ann Other <ann@example.com>"]
+
+        docs = list(self.enrich.get_rich_item_docs(item))
+
+        uuid = item['uuid']
+        self.assertListEqual([doc_id for doc_id, _ in docs], [uuid, uuid + "_0", uuid + "_0"])
+        # The order of the pair programming authors is not fixed
+        self.assertCountEqual([doc['author_name'] for _, doc in docs[:2]], ["Jane Doe", "John Smith"])
+        self.assertEqual(docs[2][1]['author_name'], "Ann Other")
+        # Same git_uuid than before the docs were generated one by one:
+        # the commit uuid for other authors and the doc id for signers
+        self.assertListEqual([doc['git_uuid'] for _, doc in docs], [uuid, uuid, uuid + "_0"])
+        self.assertEqual(docs[1][1]['is_git_commit_multi_author'], 1)
+        self.assertEqual(docs[2][1]['is_git_commit_signed_off'], 1)
+        self.assertEqual(self.enrich.total_multi_author, 1)
+        self.assertEqual(self.enrich.total_signed_off, 1)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    unittest.main()
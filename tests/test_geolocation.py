@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+import json
+import logging
+import sys
+import unittest
+
+import requests
+
+if '..' not in sys.path:
+    sys.path.insert(0, '..')
+
+from grimoire_elk.elk.geolocation import GeolocationCache, LocalGeocoder, MapsGeocoder
+from grimoire_elk.elk.github import GitHubEnrich
+
+
+GEO_POINTS = {
+    "Madrid": {"lat": 40.41, "lon": -3.70},
+    "Seville": {"lat": 37.38, "lon": -5.98}
+}
+
+
+class MockResponse:
+
+    def __init__(self, status_code, result=None):
+        self.status_code = status_code
+        self.result = result
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(self.status_code)
+
+    def json(self):
+        if self.result is None:
+            raise ValueError("No JSON object could be decoded")
+        return self.result
+
+
+class MockMaps:
+    """Maps API answering each location with the response in answers,
+    or raising it if it is an exception"""
+
+    def __init__(self, answers):
+        self.answers = answers
+
+    def get(self, url, params=None):
+        answer = self.answers[params['address']]
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+
+class MockElastic:
+    """In memory geolocations index"""
+
+    url = "http://localhost:9200"
+    index = "github_enrich"
+    max_items_bulk = 100
+    max_bytes_bulk = None
+    max_seconds_bulk = None
+
+    def __init__(self):
+        self.requests = self
+        self.docs = {}
+        self.bulk_urls = []
+
+    def head(self, url):
+        return MockResponse(200 if self.docs else 404)
+
+    def put(self, url, data=None, headers=None):
+        self.bulk_urls.append(url.split("?")[0])
+        lines = data.decode('utf-8').splitlines()
+        items = []
+        for action, doc in zip(lines[0::2], lines[1::2]):
+            doc_id = json.loads(action)['index']['_id']
+            self.docs[doc_id] = json.loads(doc)
+            items.append({"index": {"_id": doc_id, "status": 201}})
+        return MockResponse(200, {"errors": False, "items": items})
+
+    def post(self, url, data=None, headers=None):
+        if "/_search/scroll" in url:
+            return MockResponse(200, {"_scroll_id": "scroll_0"})
+        hits = [{"_id": doc_id, "_source": doc} for doc_id, doc in self.docs.items()]
+        return MockResponse(200, {"_scroll_id": "scroll_0", "hits": {"hits": hits}})
+
+    def delete(self, url, data=None, headers=None):
+        return MockResponse(200)
+
+
+class CountingGeocoder(LocalGeocoder):
+    """LocalGeocoder counting the locations geocoded"""
+
+    def __init__(self, geo_points=None):
+        super().__init__(geo_points)
+        self.locations = []
+
+    def geocode(self, location):
+        self.locations.append(location)
+        return super().geocode(location)
+
+
+class TestMapsGeocoder(unittest.TestCase):
+    """Unit tests for MapsGeocoder class"""
+
+    def test_geocode(self):
+        """Test that only the locations without results are cached as not found"""
+
+        answers = {
+            "Madrid": MockResponse(200, {"status": "OK", "results": [
+                {"geometry": {"location": {"lat": 40.41, "lng": -3.70}}}
+            ]}),
+            "Atlantis": MockResponse(200, {"status": "ZERO_RESULTS", "results": []}),
+            "Seville": MockResponse(200, {"status": "OVER_QUERY_LIMIT", "results": []}),
+            "Paris": MockResponse(200, {"status": "REQUEST_DENIED", "results": []}),
+            "Rome": MockResponse(500),
+            "Lisbon": MockResponse(200),
+            "Berlin": requests.exceptions.ConnectionError("Connection refused")
+        }
+        geocoder = MapsGeocoder(MockMaps(answers))
+        elastic = MockElastic()
+        cache = GeolocationCache(elastic, geocoder)
+
+        for location in answers:
+            geo_point = cache.get_geo_point(location)
+            if location == "Madrid":
+                self.assertDictEqual(geo_point, GEO_POINTS["Madrid"])
+            else:
+                self.assertIsNone(geo_point)
+
+        self.assertEqual(cache.save(), 2)
+        self.assertListEqual(sorted(doc['location'] for doc in elastic.docs.values()), ["Atlantis", "Madrid"])
+
+        # The locations not geocoded are tried again
+        answers["Seville"] = MockResponse(200, {"status": "OK", "results": [
+            {"geometry": {"location": {"lat": 37.38, "lng": -5.98}}}
+        ]})
+        self.assertDictEqual(cache.get_geo_point("Seville"), GEO_POINTS["Seville"])
+
+
+class TestGeolocationCache(unittest.TestCase):
+    """Unit tests for GeolocationCache class"""
+
+    def test_get_geo_point(self):
+        """Test that each location is geocoded once"""
+
+        geocoder = CountingGeocoder(GEO_POINTS)
+        cache = GeolocationCache(MockElastic(), geocoder)
+
+        self.assertIsNone(cache.get_geo_point(None))
+        for _ in range(2):
+            self.assertDictEqual(cache.get_geo_point("Madrid"), GEO_POINTS["Madrid"])
+            self.assertIsNone(cache.get_geo_point("Atlantis"))
+        self.assertListEqual(geocoder.locations, ["Madrid", "Atlantis"])
+
+        # The geo points of the cache can't be changed by the callers
+        cache.get_geo_point("Madrid")["lat"] = 0
+        self.assertDictEqual(cache.get_geo_point("Madrid"), GEO_POINTS["Madrid"])
+
+    def test_save_load(self):
+        """Test that the entries saved, also not found ones, are loaded"""
+
+        elastic = MockElastic()
+        cache = GeolocationCache(elastic, CountingGeocoder(GEO_POINTS))
+        cache.load()
+        cache.get_geo_point("Madrid")
+        cache.get_geo_point("Atlantis")
+
+        self.assertEqual(cache.save(), 2)
+        self.assertListEqual(elastic.bulk_urls, ["http://localhost:9200/github/geolocations/_bulk"])
+        self.assertIn({"location": "Atlantis", "not_found": True}, elastic.docs.values())
+
+        # Only the new entries are saved
+        self.assertEqual(cache.save(), 0)
+        cache.get_geo_point("Seville")
+        self.assertEqual(cache.save(), 1)
+        self.assertEqual(len(elastic.docs), 3)
+
+        geocoder = CountingGeocoder(GEO_POINTS)
+        cache = GeolocationCache(elastic, geocoder)
+        cache.load()
+        self.assertDictEqual(cache.get_geo_point("Seville"), GEO_POINTS["Seville"])
+        self.assertIsNone(cache.get_geo_point("Atlantis"))
+        self.assertListEqual(geocoder.locations, [])
+        self.assertEqual(cache.save(), 0)
+
+    def test_add_new(self):
+        """Test merging the entries found by other cache"""
+
+        elastic = MockElastic()
+        cache = GeolocationCache(elastic, CountingGeocoder(GEO_POINTS))
+        cache.get_geo_point("Madrid")
+        cache.save()
+
+        worker = GeolocationCache(elastic, CountingGeocoder(GEO_POINTS))
+        worker.get_geo_point("Seville")
+        worker.get_geo_point("Atlantis")
+        worker.add("Madrid", None)
+
+        new = worker.get_new()
+        self.assertEqual(worker.get_new(), ({}, []))
+        cache.add_new(new)
+
+        self.assertDictEqual(cache.get_geo_point("Seville"), GEO_POINTS["Seville"])
+        self.assertIsNone(cache.get_geo_point("Atlantis"))
+        # Locations already found are not set as not found
+        self.assertDictEqual(cache.get_geo_point("Madrid"), GEO_POINTS["Madrid"])
+
+        self.assertEqual(cache.save(), 2)
+        self.assertEqual(worker.save(), 0)
+
+    def test_enrich_without_elastic(self):
+        """Test that GitHub enrichers without Elasticsearch don't geocode"""
+
+        enrich = GitHubEnrich()
+        self.assertIsNone(enrich.get_geo_point(None))
+        self.assertIsNone(enrich.get_geo_point("Madrid"))
+
+        enrich.add_enrich_updates(enrich.get_enrich_updates())
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    unittest.main()
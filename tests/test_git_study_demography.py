@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+import json
+import logging
+import sys
+import unittest
+
+from datetime import datetime, timezone
+
+if '..' not in sys.path:
+    sys.path.insert(0, '..')
+
+from grimoire_elk.elk.bulk import BulkWriter
+from grimoire_elk.elk.git_study_demography import demography, merge_states
+
+
+ES_URL = "http://localhost:9200"
+INDEX_URL = ES_URL + "/git_enrich"
+STUDIES_URL = ES_URL + "/conf_studies"
+
+
+class MockResponse:
+
+    def __init__(self, status_code, result=None):
+        self.status_code = status_code
+        self.result = result
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(self.status_code)
+
+    def json(self):
+        return self.result
+
+
+class MockCluster:
+    """In memory git enriched index and conf studies index, answering
+    the queries and aggregations done by the demography study"""
+
+    def __init__(self, commits):
+        self.commits = {str(i): dict(commit) for i, commit in enumerate(commits)}
+        self.studies = {}
+        self.studies_created = False
+        self.updated = []  # ids of the commits updated in each run
+
+    def head(self, url):
+        return MockResponse(200 if self.studies_created else 404)
+
+    def put(self, url, data=None, headers=None, verify=None):
+        if url == STUDIES_URL:
+            self.studies_created = True
+            return MockResponse(200)
+
+        docs = self.studies if url.startswith(STUDIES_URL) else self.commits
+        lines = data.decode('utf-8').splitlines()
+        items = []
+        for action, doc in zip(lines[0::2], lines[1::2]):
+            action_name, action = list(json.loads(action).items())[0]
+            doc = json.loads(doc)
+            if action_name == "update":
+                docs[action['_id']].update(doc['doc'])
+                self.updated.append(action['_id'])
+            else:
+                docs[action['_id']] = doc
+            items.append({action_name: {"_id": action['_id'], "status": 200}})
+        return MockResponse(200, {"errors": False, "items": items})
+
+    def post(self, url, data=None, headers=None, verify=None):
+        query = json.loads(data)
+
+        if url.startswith(STUDIES_URL) and url.endswith("/_mget"):
+            docs = [{"_id": doc_id, "found": doc_id in self.studies, "_source": self.studies.get(doc_id)}
+                    for doc_id in query['ids']]
+            return MockResponse(200, {"docs": docs})
+
+        if "/_search/scroll" in url:
+            return MockResponse(200, {"_scroll_id": "scroll_0"})
+
+        commits = [(commit_id, commit) for commit_id, commit in self.commits.items()
+                   if self.match(query['query'], commit)]
+
+        if "scroll=" in url:
+            hits = [{"_id": commit_id, "_source": {"Author": commit['Author']}}
+                    for commit_id, commit in commits]
+            return MockResponse(200, {"_scroll_id": "scroll_0", "hits": {"hits": hits}})
+
+        buckets = self.get_buckets([commit for _, commit in commits])
+        if 'authors' in query['aggs']:
+            # Composite aggregation, all the authors in the first page
+            if 'after' in query['aggs']['authors']['composite']:
+                buckets = []
+            for bucket in buckets:
+                bucket['key'] = {"author": bucket['key']}
+            return MockResponse(200, {"aggregations": {"authors": {"buckets": buckets}}})
+
+        return MockResponse(200, {"aggregations": {"author": {"buckets": buckets}}})
+
+    def delete(self, url, data=None, headers=None):
+        return MockResponse(200)
+
+    def match(self, query, commit):
+        if 'bool' in query:
+            query = query['bool']
+            should = [self.match(clause, commit) for clause in query.get('should', [])]
+            return all(self.match(clause, commit) for clause in query.get('filter', [])) and \
+                not any(self.match(clause, commit) for clause in query.get('must_not', [])) and \
+                sum(should) >= query.get('minimum_should_match', 0)
+        if 'terms' in query:
+            return commit['Author'] in query['terms']['Author']
+        if 'exists' in query:
+            return query['exists']['field'] in commit
+        # Date range, all the commits are after the min date
+        return True
+
+    @staticmethod
+    def get_buckets(commits):
+        dates = {}
+        for commit in commits:
+            dates.setdefault(commit['Author'], []).append(commit['utc_commit'])
+
+        buckets = []
+        for author, author_dates in sorted(dates.items()):
+            bucket = {"key": author}
+            for agg, date in [("min", min(author_dates)), ("max", max(author_dates))]:
+                value = datetime.strptime(date, "%Y-%m-%d").replace(tzinfo=timezone.utc).timestamp() * 1000
+                bucket[agg] = {"value": value, "value_as_string": date}
+            buckets.append(bucket)
+
+        return buckets
+
+
+class MockElastic:
+
+    url = ES_URL
+    index = "git_enrich"
+    index_url = INDEX_URL
+    major = '6'
+    max_items_bulk = 100
+    max_bytes_bulk = None
+    max_seconds_bulk = None
+
+    def __init__(self, cluster):
+        self.requests = cluster
+
+    def bulk_writer(self):
+        return BulkWriter(self, self.index_url + "/items/_bulk")
+
+
+class MockEnrich:
+
+    def __init__(self, cluster):
+        self.requests = cluster
+        self.elastic = MockElastic(cluster)
+
+    def get_incremental_date(self):
+        return "metadata__timestamp"
+
+
+def get_state(min_date, max_date):
+    state = {}
+    for field, date in [("min", min_date), ("max", max_date)]:
+        state[field] = datetime.strptime(date, "%Y-%m-%d").replace(tzinfo=timezone.utc).timestamp() * 1000
+        state[field + "_date"] = date
+    return state
+
+
+class TestGitStudyDemography(unittest.TestCase):
+    """Unit tests for the git demography study"""
+
+    def test_merge_states(self):
+        """Test that merged states have the min and max dates of both"""
+
+        state = get_state("2016-01-01", "2017-01-01")
+
+        self.assertDictEqual(merge_states(state, get_state("2016-06-01", "2016-07-01")), state)
+        self.assertDictEqual(merge_states(state, get_state("2015-01-01", "2016-07-01")),
+                             get_state("2015-01-01", "2017-01-01"))
+        self.assertDictEqual(merge_states(state, get_state("2016-06-01", "2018-01-01")),
+                             get_state("2016-01-01", "2018-01-01"))
+        self.assertDictEqual(merge_states(state, get_state("2015-01-01", "2018-01-01")),
+                             get_state("2015-01-01", "2018-01-01"))
+        self.assertDictEqual(state, get_state("2016-01-01", "2017-01-01"))
+
+    def test_demography(self):
+        """Test that each run only updates the commits of authors with new dates"""
+
+        cluster = MockCluster([
+            {"Author": "jsmith", "utc_commit": "2016-01-01"},
+            {"Author": "jsmith", "utc_commit": "2017-01-01"},
+            {"Author": "jdoe", "utc_commit": "2016-06-01"}
+        ])
+        enrich = MockEnrich(cluster)
+
+        demography(enrich)
+
+        self.assertCountEqual(cluster.updated, ["0", "1", "2"])
+        self.assertEqual(cluster.commits["0"]["author_min_date"], "2016-01-01")
+        self.assertEqual(cluster.commits["0"]["author_max_date"], "2017-01-01")
+        self.assertEqual(cluster.commits["2"]["author_min_date"], "2016-06-01")
+        self.assertEqual(len(cluster.studies), 2)
+
+        # A commit of jsmith within its dates: only the new commit is updated
+        cluster.commits["3"] = {"Author": "jsmith", "utc_commit": "2016-06-01"}
+        # A commit of jdoe after its dates: all its commits are updated
+        cluster.commits["4"] = {"Author": "jdoe", "utc_commit": "2018-01-01"}
+        cluster.updated = []
+
+        demography(enrich)
+
+        self.assertCountEqual(cluster.updated, ["2", "3", "4"])
+        self.assertEqual(cluster.commits["3"]["author_min_date"], "2016-01-01")
+        self.assertEqual(cluster.commits["3"]["author_max_date"], "2017-01-01")
+        for commit_id in ["2", "4"]:
+            self.assertEqual(cluster.commits[commit_id]["author_min_date"], "2016-06-01")
+            self.assertEqual(cluster.commits[commit_id]["author_max_date"], "2018-01-01")
+
+        # Nothing new, nothing updated
+        cluster.updated = []
+        demography(enrich)
+        self.assertListEqual(cluster.updated, [])
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    unittest.main()
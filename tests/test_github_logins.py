@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+import json
+import logging
+import re
+import sys
+import unittest
+
+import requests
+
+if '..' not in sys.path:
+    sys.path.insert(0, '..')
+
+from grimoire_elk.elk.github_logins import GitHubLogins
+
+
+class MockResponse:
+
+    def __init__(self, status_code, result=None):
+        self.status_code = status_code
+        self.result = result
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(self.status_code)
+
+    def json(self):
+        return self.result
+
+
+class MockGitHub:
+    """GraphQL API answering the commits with the login of its author
+    and committer in logins (commit hash -> (author, committer))"""
+
+    def __init__(self, logins, result=None):
+        self.logins = logins
+        self.result = result  # answer to all the queries, if set
+        self.queries = []
+
+    def post(self, url, data=None, headers=None):
+        query = json.loads(data)['query']
+        self.queries.append(query)
+        if self.result:
+            return self.result
+
+        data = {"rateLimit": {"remaining": 5000, "resetAt": "2018-01-01T00:00:00Z"}}
+        for alias, commit_hash in re.findall(r'(c\d+): repository.*?oid: "(\w+)"', query):
+            author, committer = self.logins[commit_hash]
+            data[alias] = {"object": {"author": {"user": {"login": author} if author else None},
+                                      "committer": {"user": {"login": committer} if committer else None}}}
+
+        return MockResponse(200, {"data": data})
+
+
+class MockElastic:
+
+    url = "http://localhost:9200"
+    index = "git_enrich"
+    max_items_bulk = 100
+    max_bytes_bulk = None
+    max_seconds_bulk = None
+
+    def __init__(self):
+        self.requests = self
+        self.urls = []
+        self.docs = []
+
+    def put(self, url, data=None, headers=None):
+        self.urls.append(url.split("?")[0])
+        lines = data.decode('utf-8').splitlines()
+        self.docs.extend(json.loads(line) for line in lines[1::2])
+        items = [{"index": {"_id": json.loads(line)['index']['_id'], "status": 201}} for line in lines[0::2]]
+        return MockResponse(200, {"errors": False, "items": items})
+
+
+def get_github_logins(github, elastic=None):
+    github_logins = GitHubLogins(elastic, "token")
+    github_logins.batch_size = 2
+    github_logins.requests = github
+    return github_logins
+
+
+class TestGitHubLogins(unittest.TestCase):
+    """Unit tests for GitHubLogins class"""
+
+    def test_batches(self):
+        """Test that the commits are resolved in batches"""
+
+        github = MockGitHub({"h1": ("jsmith", "jdoe"), "h2": (None, "jdoe"), "h3": ("jdoe", "jdoe")})
+        elastic = MockElastic()
+        github_logins = get_github_logins(github, elastic)
+
+        self.assertEqual(github_logins.lookup("John <js@a.com>", "author", "h1", "o/r"), (False, None))
+        # The users already queued are not queued again
+        self.assertEqual(github_logins.lookup("John <js@a.com>", "author", "h1", "o/r"), (False, None))
+        self.assertEqual(github_logins.lookup("Joe <j@b.com>", "author", "h2", "o/r"), (False, None))
+        github_logins.lookup("Jane <jd@a.com>", "committer", "h3", "o/r")
+        github_logins.close()
+
+        self.assertEqual(len(github.queries), 2)
+        self.assertIn('c1: repository(owner: "o", name: "r") { object(oid: "h2")', github.queries[0])
+        self.assertNotIn('c2:', github.queries[0])
+        self.assertListEqual(sorted(github_logins.get_resolved()),
+                             [("Jane <jd@a.com>", "jdoe"), ("Joe <j@b.com>", None),
+                              ("John <js@a.com>", "jsmith")])
+        self.assertEqual(github_logins.get_resolved(), [])
+        self.assertEqual(github_logins.rate_limit, 5000)
+        self.assertEqual(github_logins.authors_not_found, 1)
+
+        # The users resolved are not queried again
+        self.assertEqual(github_logins.lookup("Joe <j@b.com>", "author", "h2", "o/r"), (True, None))
+        github_logins.close()
+        self.assertEqual(len(github.queries), 2)
+
+        # The logins are stored in their own index
+        self.assertListEqual(elastic.urls, ["http://localhost:9200/github_logins/items/_bulk"])
+        self.assertIn({"user": "John <js@a.com>", "login": "jsmith"}, elastic.docs)
+        self.assertEqual(len(elastic.docs), 3)
+
+    def test_not_found(self):
+        """Test that the commits not found don't make the rest of the batch fail"""
+
+        result = MockResponse(200, {
+            "data": {
+                "rateLimit": {"remaining": 5000, "resetAt": "2018-01-01T00:00:00Z"},
+                "c0": {"object": {"author": {"user": {"login": "jsmith"}}, "committer": None}},
+                "c1": None
+            },
+            "errors": [{"type": "NOT_FOUND", "path": ["c1"],
+                        "message": "Could not resolve to a Repository with the name 'r'."}]
+        })
+        github = MockGitHub({}, result)
+        elastic = MockElastic()
+        github_logins = get_github_logins(github, elastic)
+
+        github_logins.lookup("John <js@a.com>", "author", "h1", "o/r")
+        github_logins.lookup("Jane <jd@a.com>", "author", "h2", "o/other")
+        github_logins.close()
+
+        self.assertEqual(len(github.queries), 1)
+        self.assertListEqual(sorted(github_logins.get_resolved()),
+                             [("Jane <jd@a.com>", None), ("John <js@a.com>", "jsmith")])
+        self.assertEqual(len(elastic.docs), 2)
+
+        # The users are not queried again
+        self.assertEqual(github_logins.lookup("Jane <jd@a.com>", "author", "h2", "o/other"), (True, None))
+
+    def test_errors(self):
+        """Test that nothing is stored for the batches which fail"""
+
+        results = [
+            MockResponse(200, {"errors": [{"message": "Something went wrong"}]}),
+            MockResponse(200, {"data": None}),
+            MockResponse(502)
+        ]
+        for result in results:
+            github = MockGitHub({}, result)
+            elastic = MockElastic()
+            github_logins = get_github_logins(github, elastic)
+
+            github_logins.lookup("John <js@a.com>", "author", "h1", "o/r")
+            github_logins.close()
+
+            self.assertEqual(len(github.queries), 1)
+            self.assertEqual(github_logins.get_resolved(), [])
+            self.assertDictEqual(github_logins.logins, {})
+            self.assertListEqual(elastic.urls, [])
+
+            # The users are queried again
+            github_logins.lookup("John <js@a.com>", "author", "h1", "o/r")
+            github_logins.close()
+            self.assertEqual(len(github.queries), 2)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    unittest.main()
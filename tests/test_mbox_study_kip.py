@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+import json
+import logging
+import sys
+import unittest
+
+from dateutil import parser
+
+if '..' not in sys.path:
+    sys.path.insert(0, '..')
+
+from grimoire_elk.elk.bulk import BulkWriter
+from grimoire_elk.elk.mbox import MBoxEnrich
+from grimoire_elk.elk.mbox_study_kip import kafka_kip, KIP_STUDY
+from grimoire_elk.elk.study_state import StudyState
+
+
+ES_URL = "http://localhost:9200"
+INDEX_URL = ES_URL + "/mbox_enrich"
+STUDIES_URL = ES_URL + "/conf_studies"
+
+
+class MockResponse:
+
+    def __init__(self, status_code, result=None):
+        self.status_code = status_code
+        self.result = result
+        self.text = json.dumps(result)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(self.status_code)
+
+    def json(self):
+        return self.result
+
+
+class MockCluster:
+    """In memory mbox enriched index, shared by several mailing lists,
+    and conf studies index"""
+
+    def __init__(self):
+        self.messages = {}
+        self.studies = {}
+        self.studies_created = False
+        self.updated = []  # ids of the messages updated
+
+    def add(self, uuid, origin, timestamp, subject, body=""):
+        self.messages[uuid] = {
+            "uuid": uuid,
+            "origin": origin,
+            "metadata__timestamp": timestamp,
+            "email_date": timestamp,
+            "Subject": subject,
+            "body_extract": body
+        }
+
+    def head(self, url):
+        return MockResponse(200 if self.studies_created else 404)
+
+    def put(self, url, data=None, headers=None):
+        if url == STUDIES_URL:
+            self.studies_created = True
+            return MockResponse(200)
+
+        docs = self.studies if url.startswith(STUDIES_URL) else self.messages
+        lines = data.decode('utf-8').splitlines()
+        items = []
+        for action, doc in zip(lines[0::2], lines[1::2]):
+            action_name, action = list(json.loads(action).items())[0]
+            doc = json.loads(doc)
+            if action_name == "update":
+                docs[action['_id']].update(doc['doc'])
+                self.updated.append(action['_id'])
+            else:
+                docs[action['_id']] = doc
+            items.append({action_name: {"_id": action['_id'], "status": 200}})
+        return MockResponse(200, {"errors": False, "items": items})
+
+    def post(self, url, data=None, headers=None):
+        query = json.loads(data)
+
+        if url.startswith(STUDIES_URL) and url.endswith("/_mget"):
+            docs = [{"_id": doc_id, "found": doc_id in self.studies, "_source": self.studies.get(doc_id)}
+                    for doc_id in query['ids']]
+            return MockResponse(200, {"docs": docs})
+
+        if "/_search/scroll" in url:
+            return MockResponse(200, {"_scroll_id": "scroll_0"})
+
+        docs = self.studies if url.startswith(STUDIES_URL) else self.messages
+        clauses = query.get('query', {}).get('bool', {})
+        clauses = clauses.get('must', []) + clauses.get('filter', [])
+        hits = [{"_id": doc_id, "_source": doc} for doc_id, doc in docs.items()
+                if all(self.match(clause, doc) for clause in clauses)]
+        hits.sort(key=lambda hit: hit['_source'].get('metadata__timestamp', ''))
+
+        return MockResponse(200, {"_scroll_id": "scroll_0", "hits": {"hits": hits}})
+
+    def delete(self, url, data=None, headers=None):
+        return MockResponse(200)
+
+    @staticmethod
+    def match(clause, doc):
+        if 'term' in clause:
+            field, value = list(clause['term'].items())[0]
+            return doc.get(field) == value
+        if 'exists' in clause:
+            return clause['exists']['field'] in doc
+        field, value = list(clause['range'].items())[0]
+        return parser.parse(doc[field]) >= parser.parse(value['gte'])
+
+
+class MockElastic:
+
+    url = ES_URL
+    index = "mbox_enrich"
+    index_url = INDEX_URL
+    major = '6'
+    max_items_bulk = 100
+    max_bytes_bulk = None
+    max_seconds_bulk = None
+
+    def __init__(self, cluster):
+        self.requests = cluster
+
+    def bulk_writer(self, refresh=False):
+        return BulkWriter(self, self.index_url + "/items/_bulk")
+
+
+class MockBackend:
+
+    def __init__(self, origin):
+        self.origin = origin
+        self.tag = origin
+
+
+def get_enrich(cluster, origin):
+    enrich = MBoxEnrich()
+    enrich.set_elastic(MockElastic(cluster))
+    enrich.requests = cluster
+    enrich.perceval_backend = MockBackend(origin)
+    return enrich
+
+
+class TestKafkaKip(unittest.TestCase):
+    """Unit tests for the kafka kip study"""
+
+    def test_origins(self):
+        """Test that the lists in the same index have their own state"""
+
+        cluster = MockCluster()
+        cluster.add("a1", "dev", "2018-01-10T00:00:00+00:00", "[DISCUSS] KIP-1: Something")
+        cluster.add("a2", "dev", "2018-01-20T00:00:00+00:00", "Re: [DISCUSS] KIP-1: Something")
+
+        kafka_kip(get_enrich(cluster, "dev"))
+
+        self.assertCountEqual(set(cluster.updated), ["a1", "a2"])
+        self.assertEqual(cluster.messages["a1"]["kip"], 1)
+        self.assertEqual(cluster.messages["a1"]["kip_is_first_discuss"], 1)
+        self.assertEqual(cluster.messages["a2"]["kip_is_last_discuss"], 1)
+
+        # Messages of other list, older than the last one of the first list
+        cluster.add("b1", "users", "2018-01-01T00:00:00+00:00", "[VOTE] KIP-2: Other")
+        cluster.add("b2", "users", "2018-01-02T00:00:00+00:00", "Re: [VOTE] KIP-2: Other", "+1 (binding)")
+        cluster.updated = []
+
+        kafka_kip(get_enrich(cluster, "users"))
+
+        # Only the messages of the list are read and updated
+        self.assertCountEqual(set(cluster.updated), ["b1", "b2"])
+        self.assertEqual(cluster.messages["b1"]["kip"], 2)
+        self.assertEqual(cluster.messages["b2"]["kip_vote"], 1)
+        self.assertEqual(cluster.messages["b2"]["kip_is_last_vote"], 1)
+        self.assertEqual(cluster.messages["a2"]["kip_is_last_discuss"], 1)
+
+        elastic = MockElastic(cluster)
+        dev_state = StudyState(elastic, KIP_STUDY, "dev").get_all()
+        users_state = StudyState(elastic, KIP_STUDY, "users").get_all()
+        self.assertCountEqual(dev_state, ["1", "last_date"])
+        self.assertCountEqual(users_state, ["2", "last_date"])
+        self.assertEqual(dev_state["last_date"]["date"], "2018-01-20T00:00:00+00:00")
+        self.assertEqual(users_state["last_date"]["date"], "2018-01-02T00:00:00+00:00")
+
+        # A new message of the first list is read with the state of the list
+        cluster.add("a3", "dev", "2018-01-30T00:00:00+00:00", "Re: [DISCUSS] KIP-1: Something")
+        cluster.updated = []
+
+        kafka_kip(get_enrich(cluster, "dev"))
+
+        self.assertEqual(cluster.updated.count("a3"), 2)
+        self.assertEqual(cluster.updated.count("a2"), 2)
+        self.assertNotIn("b1", cluster.updated)
+        self.assertEqual(cluster.messages["a1"]["kip_is_first_discuss"], 1)
+        self.assertEqual(cluster.messages["a2"]["kip_is_last_discuss"], 0)
+        self.assertEqual(cluster.messages["a3"]["kip_is_last_discuss"], 1)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    unittest.main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+import json
+import logging
+import sys
+import unittest
+
+if '..' not in sys.path:
+    sys.path.insert(0, '..')
+
+from grimoire_elk.elk.metrics import Metrics
+
+
+class TestMetrics(unittest.TestCase):
+    """Unit tests for Metrics class"""
+
+    def setUp(self):
+        self.metrics = Metrics()
+        self.metrics.set_labels(connector="git", origin="https://repo", task="enrich")
+
+    def test_report(self):
+        """Test the counters, timers and hit rates in the report"""
+
+        self.metrics.inc("rich_docs", 3)
+        self.metrics.inc("rich_docs")
+        self.metrics.inc("sh_lookups", lookup="ids", result="hit")
+        self.metrics.inc("sh_lookups", 3, lookup="ids", result="miss")
+        self.metrics.observe("rich_item", 0.002)
+        self.metrics.observe("rich_item", 0.004)
+
+        report = self.metrics.get_report(connector="git")
+        # It can be stored as JSON
+        report = json.loads(json.dumps(report))
+
+        labels = {"connector": "git", "origin": "https://repo", "task": "enrich"}
+        self.assertEqual(report['labels'], {"connector": "git"})
+        self.assertIn({"name": "rich_docs", "labels": labels, "value": 4}, report['counters'])
+        self.assertEqual(report['hit_rates'], [{"name": "sh_lookups", "labels": dict(labels, lookup="ids"),
+                                                "hits": 1, "misses": 3, "rate": 0.25}])
+
+        timer = report['timers'][0]
+        self.assertEqual(timer['name'], "rich_item")
+        self.assertEqual(timer['count'], 2)
+        self.assertAlmostEqual(timer['seconds'], 0.006)
+        self.assertAlmostEqual(timer['max_seconds'], 0.004)
+        self.assertIn({"le": "0.01", "count": 2}, timer['buckets'])
+
+        # Values of other tasks are not included
+        report = self.metrics.get_report(task="feed")
+        self.assertEqual(report['counters'], [])
+        self.assertEqual(report['timers'], [])
+
+    def test_merge(self):
+        """Test merging the values of other process"""
+
+        worker = Metrics()
+        worker.set_labels(connector="git", origin="https://repo", task="enrich")
+        worker.inc("rich_docs", 2)
+        worker.observe("rich_item", 0.5)
+
+        self.metrics.inc("rich_docs", 1)
+        self.metrics.merge(worker.pop())
+        self.metrics.merge(worker.pop())
+
+        report = self.metrics.get_report()
+        self.assertEqual(report['counters'][0]['value'], 3)
+        self.assertEqual(report['timers'][0]['count'], 1)
+        self.assertEqual(worker.get_report()['counters'], [])
+
+    def test_prometheus(self):
+        """Test the Prometheus text format"""
+
+        self.metrics.set_labels(connector="git", origin='a "quoted" origin')
+        self.metrics.inc("bulk_docs", 10, index="git_enrich")
+        self.metrics.observe("bulk_http", 2)
+
+        lines = self.metrics.to_prometheus().splitlines()
+
+        labels = 'connector="git",origin="a \\"quoted\\" origin"'
+        self.assertEqual(lines[0], "# TYPE grimoire_elk_bulk_docs_total counter")
+        self.assertEqual(lines[1], 'grimoire_elk_bulk_docs_total{%s,index="git_enrich"} 10' % labels)
+        self.assertEqual(lines[2], "# TYPE grimoire_elk_bulk_http_seconds histogram")
+        self.assertIn('grimoire_elk_bulk_http_seconds_bucket{%s,le="1"} 0' % labels, lines)
+        self.assertIn('grimoire_elk_bulk_http_seconds_bucket{%s,le="5"} 1' % labels, lines)
+        self.assertIn('grimoire_elk_bulk_http_seconds_bucket{%s,le="+Inf"} 1' % labels, lines)
+        self.assertIn('grimoire_elk_bulk_http_seconds_sum{%s} 2' % labels, lines)
+        self.assertEqual(lines[-1], 'grimoire_elk_bulk_http_seconds_count{%s} 1' % labels)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    unittest.main()
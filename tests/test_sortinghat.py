@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+import logging
+import sys
+import unittest
+
+from datetime import datetime, timedelta
+from unittest import mock
+
+if '..' not in sys.path:
+    sys.path.insert(0, '..')
+
+from grimoire_elk.elk.enrich import SORTINGHAT_LIBS
+
+if SORTINGHAT_LIBS:
+    from grimoire_elk.elk.sortinghat import SortingHat, SortingHatSnapshot
+
+
+UNAFFILIATED = "Unknown"
+
+
+def get_enrollment(intervals, item_date):
+    """ Enrollment found like Enrich does with api.enrollments """
+
+    for start, end, org_name in intervals:
+        if not item_date or start <= item_date <= end:
+            return org_name
+    return UNAFFILIATED
+
+
+@unittest.skipIf(not SORTINGHAT_LIBS, "SortingHat not available")
+class TestSortingHatSnapshot(unittest.TestCase):
+    """Unit tests for SortingHatSnapshot class"""
+
+    def test_get_enrollment(self):
+        """Test the organization found for each date"""
+
+        # In api.enrollments order, by organization name and dates
+        intervals = [
+            (datetime(2010, 1, 1), datetime(2012, 1, 1), "Bitergia"),
+            (datetime(2014, 1, 1), datetime(2016, 1, 1), "Bitergia"),
+            (datetime(2011, 1, 1), datetime(2015, 1, 1), "GitHub"),
+            (datetime(2016, 1, 1), datetime(2017, 1, 1), "GitHub"),
+            (datetime(2011, 6, 1), datetime(2011, 7, 1), "Mozilla"),
+            (datetime(2018, 1, 1), datetime(2018, 1, 1), "Mozilla")
+        ]
+
+        snapshot = SortingHatSnapshot(None)
+        snapshot.enrollments["uuid"] = snapshot.get_periods(intervals)
+
+        self.assertEqual(snapshot.get_enrollment("uuid", None, UNAFFILIATED), "Bitergia")
+        self.assertEqual(snapshot.get_enrollment("other", None, UNAFFILIATED), UNAFFILIATED)
+        self.assertEqual(snapshot.get_enrollment("other", datetime(2011, 1, 1), UNAFFILIATED), UNAFFILIATED)
+
+        expected = {
+            datetime(2009, 1, 1): UNAFFILIATED,
+            datetime(2010, 1, 1): "Bitergia",
+            datetime(2011, 6, 15): "Bitergia",
+            datetime(2012, 1, 1): "Bitergia",
+            datetime(2012, 1, 1, 0, 0, 1): "GitHub",
+            datetime(2015, 6, 1): "Bitergia",
+            datetime(2016, 1, 1): "Bitergia",
+            datetime(2016, 1, 2): "GitHub",
+            datetime(2017, 6, 1): UNAFFILIATED,
+            datetime(2018, 1, 1): "Mozilla",
+            datetime(2018, 1, 2): UNAFFILIATED
+        }
+        for item_date, org_name in expected.items():
+            self.assertEqual(snapshot.get_enrollment("uuid", item_date, UNAFFILIATED), org_name)
+
+        # Same organization than the api.enrollments lookup for any date
+        item_date = datetime(2009, 1, 1)
+        while item_date < datetime(2019, 1, 1):
+            self.assertEqual(snapshot.get_enrollment("uuid", item_date, UNAFFILIATED),
+                             get_enrollment(intervals, item_date))
+            item_date += timedelta(days=5, hours=7)
+
+    def test_update(self):
+        """Test that the snapshot is only reloaded when the version changes"""
+
+        snapshot = SortingHatSnapshot(None)
+        snapshot.version = ("10", "2018-01-01")
+
+        with mock.patch.object(SortingHat, 'get_version', return_value=("10", "2018-01-01")), \
+                mock.patch.object(SortingHatSnapshot, 'load') as load:
+            self.assertFalse(snapshot.update())
+            load.assert_not_called()
+
+        with mock.patch.object(SortingHat, 'get_version', return_value=("11", "2018-01-02")), \
+                mock.patch.object(SortingHatSnapshot, 'load') as load:
+            self.assertTrue(snapshot.update())
+            load.assert_called_once_with()
+        self.assertIsNotNone(snapshot.checked)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    unittest.main()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+import json
+import logging
+import sys
+import unittest
+
+if '..' not in sys.path:
+    sys.path.insert(0, '..')
+
+from grimoire_elk.elk.study_state import StudyState
+
+
+ES_URL = "http://localhost:9200"
+STUDIES_URL = ES_URL + "/conf_studies"
+
+
+class MockResponse:
+
+    def __init__(self, status_code, result=None):
+        self.status_code = status_code
+        self.result = result
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(self.status_code)
+
+    def json(self):
+        return self.result
+
+
+class MockStudies:
+    """In memory conf studies index. Term queries only match the fields
+    mapped as keywords, like analyzed text fields in Elasticsearch."""
+
+    def __init__(self):
+        self.mapping = None
+        self.docs = {}
+
+    def head(self, url):
+        return MockResponse(200 if self.mapping is not None else 404)
+
+    def put(self, url, data=None, headers=None):
+        if url == STUDIES_URL:
+            self.mapping = json.loads(data)['mappings']['items']['properties']
+            return MockResponse(200)
+
+        # bulk request
+        lines = data.decode('utf-8').splitlines()
+        items = []
+        for action, doc in zip(lines[0::2], lines[1::2]):
+            doc_id = json.loads(action)['index']['_id']
+            self.docs[doc_id] = json.loads(doc)
+            items.append({"index": {"_id": doc_id, "status": 201}})
+        return MockResponse(200, {"errors": False, "items": items})
+
+    def post(self, url, data=None, headers=None):
+        query = json.loads(data)
+
+        if url.endswith("/_mget"):
+            docs = [{"_id": doc_id, "found": doc_id in self.docs, "_source": self.docs.get(doc_id)}
+                    for doc_id in query['ids']]
+            return MockResponse(200, {"docs": docs})
+
+        if "/_search?" in url:
+            hits = [{"_id": doc_id, "_source": doc} for doc_id, doc in self.docs.items()
+                    if all(self.match(term['term'], doc) for term in query['query']['bool']['must'])]
+            return MockResponse(200, {"_scroll_id": "scroll_0", "hits": {"hits": hits}})
+
+        # next scroll page
+        return MockResponse(200, {"_scroll_id": "scroll_0"})
+
+    def delete(self, url, data=None, headers=None):
+        return MockResponse(200)
+
+    def match(self, term, doc):
+        field, value = list(term.items())[0]
+        if self.mapping.get(field, {}).get('type') != 'keyword':
+            # Analyzed text, the terms are lowercased tokens
+            return False
+        return doc[field] == value
+
+
+class MockElastic:
+
+    url = ES_URL
+    major = '6'
+    max_items_bulk = 100
+    max_bytes_bulk = None
+    max_seconds_bulk = None
+
+    def __init__(self, index, session):
+        self.index = index
+        self.index_url = ES_URL + "/" + index
+        self.requests = session
+
+
+class TestStudyState(unittest.TestCase):
+    """Unit tests for StudyState class"""
+
+    def test_get_set(self):
+        """Test that the states stored are got by key"""
+
+        study_state = StudyState(MockElastic("git_enrich", MockStudies()), "demography")
+
+        self.assertDictEqual(study_state.get(["jsmith"]), {})
+        self.assertEqual(study_state.set({"jsmith": {"min": 1}, "jdoe": {"min": 2}}), 2)
+        self.assertDictEqual(study_state.get(["jsmith", "other"]), {"jsmith": {"min": 1}})
+
+    def test_get_all(self):
+        """Test that all the states of a study and index are got"""
+
+        studies = MockStudies()
+        self.assertDictEqual(StudyState(MockElastic("git_enrich", studies), "demography").get_all(), {})
+
+        StudyState(MockElastic("git_enrich", studies), "demography").set({"jsmith": {"min": 1}})
+        StudyState(MockElastic("git_enrich", studies), "kip").set({"jsmith": {"min": 2}})
+        StudyState(MockElastic("git-enrich", studies), "demography").set({"jdoe": {"min": 3}})
+
+        # The index is created with the mapping of the states
+        self.assertEqual(studies.mapping['study']['type'], 'keyword')
+        self.assertEqual(studies.mapping['index']['type'], 'keyword')
+
+        states = StudyState(MockElastic("git_enrich", studies), "demography").get_all()
+        self.assertDictEqual(states, {"jsmith": {"min": 1}})
+        states = StudyState(MockElastic("git-enrich", studies), "demography").get_all()
+        self.assertDictEqual(states, {"jdoe": {"min": 3}})
+
+    def test_origin(self):
+        """Test that the states of each origin are kept apart"""
+
+        studies = MockStudies()
+        StudyState(MockElastic("mbox_enrich", studies), "kip", "dev").set({"1": {"votes": 1}})
+        StudyState(MockElastic("mbox_enrich", studies), "kip", "users").set({"1": {"votes": 2}})
+
+        self.assertEqual(studies.mapping['origin']['type'], 'keyword')
+        study_state = StudyState(MockElastic("mbox_enrich", studies), "kip", "dev")
+        self.assertDictEqual(study_state.get_all(), {"1": {"votes": 1}})
+        self.assertDictEqual(study_state.get(["1"]), {"1": {"votes": 1}})
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    unittest.main()
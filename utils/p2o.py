@@ -24,14 +24,18 @@
 #
 
 from datetime import datetime
+import json
 import logging
 from os import sys
-import time
 
 from grimoire_elk.arthur import feed_backend, enrich_backend
 from grimoire_elk.elastic_items import ElasticItems
 
 from grimoire_elk.elk.elastic import ElasticSearch
+from grimoire_elk.elk import utils as elk_utils
+from grimoire_elk.elk.enrich import Enrich
+from grimoire_elk.elk.metrics import metrics
+from grimoire_elk.ocean.conf import ConfOcean
 from grimoire_elk.utils import get_params_parser, config_logging
 
 
@@ -64,18 +68,37 @@ if __name__ == '__main__':
             # Configure elastic bulk size and scrolling
             if args.bulk_size:
                 ElasticSearch.max_items_bulk = args.bulk_size
+            if args.bulk_mb:
+                ElasticSearch.max_bytes_bulk = int(args.bulk_mb * 1024 * 1024)
+            if args.bulk_seconds:
+                ElasticSearch.max_seconds_bulk = args.bulk_seconds
+            if args.bulk_workers:
+                ElasticSearch.bulk_workers = args.bulk_workers
+            if args.bulk_gzip:
+                ElasticSearch.bulk_gzip = True
+            if args.http_pool_size:
+                elk_utils.HTTP_POOL_MAXSIZE = args.http_pool_size
             if args.scroll_size:
                 ElasticItems.scroll_size = args.scroll_size
+            if args.scroll_slices:
+                ElasticItems.scroll_slices = args.scroll_slices
+            if args.scroll_unordered:
+                ElasticItems.scroll_ordered = False
+            if args.search_after:
+                ElasticItems.search_after = True
+            if args.sh_snapshot:
+                Enrich.use_sh_snapshot = True
+            if args.enrich_workers:
+                Enrich.enrich_workers = args.enrich_workers
+            if args.metrics_conf:
+                ConfOcean.store_metrics = True
             if not args.enrich_only:
                 feed_backend(url, clean, args.fetch_cache,
                              args.backend, args.backend_args,
                              args.index, args.index_enrich, args.project,
                              args.arthur)
-
-                # Wait for one second, to ensure bulk write reflects in searches
-                # https://www.elastic.co/guide/en/elasticsearch/reference/6.1/docs-refresh.html
-                # (there are better ways of doing this, but for now...)
-                time.sleep(1)
+                # The raw index is refreshed once the feed is done, so the
+                # items are already visible in searches for the enrichment
                 logging.info("Backend feed completed")
 
             if args.enrich or args.enrich_only:
@@ -91,7 +114,8 @@ if __name__ == '__main__':
                                args.refresh_projects, args.refresh_identities,
                                args.author_id, args.author_uuid,
                                args.filter_raw, args.filters_raw_prefix,
-                               args.jenkins_rename_file)
+                               args.jenkins_rename_file,
+                               do_refresh_identities_changes=args.refresh_identities_changes)
                 logging.info("Enrich backend completed")
             elif args.events_enrich:
                 logging.info("Enrich option is needed for events_enrich")
@@ -102,6 +126,15 @@ if __name__ == '__main__':
         logging.info("\n\nReceived Ctrl-C or other break signal. Exiting.\n")
         sys.exit(0)
 
+    if args.metrics_file:
+        with open(args.metrics_file, 'w') as f:
+            json.dump(metrics.get_report(), f, indent=4)
+        logging.info("Metrics written to %s", args.metrics_file)
+    if args.metrics_prometheus:
+        with open(args.metrics_prometheus, 'w') as f:
+            f.write(metrics.to_prometheus())
+        logging.info("Metrics written to %s", args.metrics_prometheus)
+
     total_time_min = (datetime.now() - app_init).total_seconds() / 60
 
     logging.info("Finished in %.2f min" % (total_time_min))